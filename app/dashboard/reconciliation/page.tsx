@@ -79,6 +79,21 @@ interface ReconciliationData {
     pr_invoices_parsed: number;
     gstr2b_invoices_parsed: number;
   };
+  vendor_summary?: VendorSummaryRow[];
+}
+
+interface VendorSummaryRow {
+  vendor_gstin: string;
+  period: string;
+  pr_count: number;
+  gstr2b_count: number;
+  pr_taxable: number;
+  gstr2b_taxable: number;
+  taxable_delta: number;
+  pr_tax: number;
+  gstr2b_tax: number;
+  tax_delta: number;
+  balanced: boolean;
 }
 
 const formatINR = (amount: number) => {
@@ -91,6 +106,8 @@ const statusLabel = (status: string) => {
     amount_mismatch: "Amount Mismatch",
     date_mismatch: "Date Mismatch",
     gstin_mismatch: "GSTIN Mismatch",
+    invoice_mismatch: "Invoice No Mismatch",
+    split_match: "Split / Merged Invoice",
     pr_only: "Missing in GSTR-2B",
     gstr2b_only: "Missing in PR",
   };
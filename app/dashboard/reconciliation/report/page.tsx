@@ -88,7 +88,7 @@ export default function ReconciliationReportPage() {
     .filter((r) => r.status === "exact_match")
     .reduce((s, r) => s + (r.gstr2b_invoice?.taxable_value || r.pr_invoice?.taxable_value || 0), 0);
   const discrepancyTaxable = data.results
-    .filter((r) => ["amount_mismatch", "date_mismatch", "gstin_mismatch"].includes(r.status))
+    .filter((r) => ["amount_mismatch", "date_mismatch", "gstin_mismatch", "invoice_mismatch", "split_match"].includes(r.status))
     .reduce((s, r) => s + (r.pr_invoice?.taxable_value || r.gstr2b_invoice?.taxable_value || 0), 0);
   const missingTaxable = data.results
     .filter((r) => ["pr_only", "gstr2b_only"].includes(r.status))
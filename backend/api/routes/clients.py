@@ -9,6 +9,7 @@ from models.schemas import (
     GSTINCreate, GSTINResponse
 )
 from services.supabase_service import get_supabase_service, SupabaseService
+from core.rule_profile import RuleProfile
 
 
 router = APIRouter()
@@ -43,10 +44,18 @@ async def create_client(
     supabase: SupabaseService = Depends(get_supabase_service)
 ):
     """Create a new client"""
+    payload = data.model_dump()
+    if payload.get("rule_profile") is None:
+        payload.pop("rule_profile", None)  # Column default: engine defaults
+    else:
+        try:
+            payload["rule_profile"] = RuleProfile.from_dict(payload["rule_profile"]).as_dict()
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid rule profile: {e}")
     try:
         # TODO: Get user_id from auth
         user_id = "system"
-        client = await supabase.create_client(data.model_dump(), user_id)
+        client = await supabase.create_client(payload, user_id)
         return ClientResponse(**client)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
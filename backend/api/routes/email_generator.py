@@ -25,10 +25,26 @@ class DiscrepancyDetail(BaseModel):
     return_period: Optional[str] = None
 
 
+class VendorSummaryRow(BaseModel):
+    """One row of the reconcile response's vendor_summary (per GSTIN and period)"""
+    vendor_gstin: str
+    period: str = ""
+    pr_count: int = 0
+    gstr2b_count: int = 0
+    pr_taxable: float = 0
+    gstr2b_taxable: float = 0
+    taxable_delta: float = 0
+    pr_tax: float = 0
+    gstr2b_tax: float = 0
+    tax_delta: float = 0
+    balanced: bool = False
+
+
 class EmailGenerateRequest(BaseModel):
     discrepancies: List[DiscrepancyDetail]
     sender_name: str = "Accounts Team"
     sender_company: str = "Our Company"
+    vendor_summary: List[VendorSummaryRow] = []  # From the reconcile response; adds period totals
 
 
 class EmailTemplate(BaseModel):
@@ -60,13 +76,20 @@ async def generate_emails(
             vendor_groups[key] = []
         vendor_groups[key].append(d)
     
+    # Period totals already aggregated by the reconciliation, by GSTIN
+    summary_by_gstin = {}
+    for row in data.vendor_summary:
+        summary_by_gstin.setdefault(row.vendor_gstin, []).append(row)
+
     emails = []
     for vendor_name, discrepancies in vendor_groups.items():
+        gstins = sorted(set(d.vendor_gstin for d in discrepancies if d.vendor_gstin))
         email = _generate_vendor_email(
             vendor_name=vendor_name,
             discrepancies=discrepancies,
             sender_name=data.sender_name,
-            sender_company=data.sender_company
+            sender_company=data.sender_company,
+            summary=[row for gstin in gstins for row in summary_by_gstin.get(gstin, [])]
         )
         emails.append(email)
     
@@ -103,7 +126,8 @@ def _generate_vendor_email(
     vendor_name: str,
     discrepancies: List[DiscrepancyDetail],
     sender_name: str,
-    sender_company: str
+    sender_company: str,
+    summary: Optional[List[VendorSummaryRow]] = None
 ) -> EmailTemplate:
     """Generate email for a specific vendor based on their discrepancies"""
     
@@ -111,13 +135,13 @@ def _generate_vendor_email(
     types = set(d.discrepancy_type for d in discrepancies)
     
     if "pr_only" in types and len(types) == 1:
-        return _email_missing_in_gstr2b(vendor_name, discrepancies, sender_name, sender_company)
+        return _email_missing_in_gstr2b(vendor_name, discrepancies, sender_name, sender_company, summary)
     elif "gstr2b_only" in types and len(types) == 1:
-        return _email_missing_in_pr(vendor_name, discrepancies, sender_name, sender_company)
+        return _email_missing_in_pr(vendor_name, discrepancies, sender_name, sender_company, summary)
     elif "gstin_mismatch" in types:
-        return _email_gstin_mismatch(vendor_name, discrepancies, sender_name, sender_company)
+        return _email_gstin_mismatch(vendor_name, discrepancies, sender_name, sender_company, summary)
     else:
-        return _email_amount_mismatch(vendor_name, discrepancies, sender_name, sender_company)
+        return _email_amount_mismatch(vendor_name, discrepancies, sender_name, sender_company, summary)
 
 
 def _format_amount(amount: float) -> str:
@@ -125,8 +149,8 @@ def _format_amount(amount: float) -> str:
     return f"₹{abs(amount):,.2f}"
 
 
-def _invoice_table(discrepancies: List[DiscrepancyDetail]) -> str:
-    """Generate invoice details table for email body"""
+def _invoice_table(discrepancies: List[DiscrepancyDetail], summary: Optional[List[VendorSummaryRow]] = None) -> str:
+    """Generate invoice details table for email body, followed by period totals when given"""
     lines = []
     lines.append("Invoice Details:")
     lines.append("-" * 60)
@@ -146,6 +170,21 @@ def _invoice_table(discrepancies: List[DiscrepancyDetail]) -> str:
         lines.append("")
     
     lines.append("-" * 60)
+
+    if summary:
+        lines.append("")
+        lines.append("Period Totals (Taxable Value):")
+        lines.append("-" * 60)
+        for row in summary:
+            label = row.period or "Undated"
+            if len(set(r.vendor_gstin for r in summary)) > 1:
+                label += f" ({row.vendor_gstin})"
+            lines.append(f"{label}:")
+            lines.append(f"   Our Records: {_format_amount(row.pr_taxable)} ({row.pr_count} invoice(s))")
+            lines.append(f"   GSTR-2B Amount: {_format_amount(row.gstr2b_taxable)} ({row.gstr2b_count} invoice(s))")
+            if row.taxable_delta != 0:
+                lines.append(f"   Difference: {_format_amount(row.taxable_delta)}")
+        lines.append("-" * 60)
     return "\n".join(lines)
 
 
@@ -153,7 +192,8 @@ def _email_amount_mismatch(
     vendor_name: str,
     discrepancies: List[DiscrepancyDetail],
     sender_name: str,
-    sender_company: str
+    sender_company: str,
+    summary: Optional[List[VendorSummaryRow]] = None
 ) -> EmailTemplate:
     """Email for amount mismatch discrepencies"""
     total_diff = sum(abs(d.difference) for d in discrepancies)
@@ -169,7 +209,7 @@ Greetings from {sender_company}.
 
 During our GST reconciliation for the current return period, we have identified amount discrepancies in the following invoice(s) between our Purchase Register and your GSTR-2B filing:
 
-{_invoice_table(discrepancies)}
+{_invoice_table(discrepancies, summary)}
 
 Total Discrepancy: {_format_amount(total_diff)}
 
@@ -203,7 +243,8 @@ def _email_missing_in_gstr2b(
     vendor_name: str,
     discrepancies: List[DiscrepancyDetail],
     sender_name: str,
-    sender_company: str
+    sender_company: str,
+    summary: Optional[List[VendorSummaryRow]] = None
 ) -> EmailTemplate:
     """Email for invoices in PR but missing in GSTR-2B"""
     invoice_nos = ", ".join(d.invoice_no for d in discrepancies[:3])
@@ -220,7 +261,7 @@ Greetings from {sender_company}.
 
 During our GST reconciliation, we found that the following invoice(s) from your end are present in our Purchase Register but are NOT appearing in your GSTR-2B filing on the GST portal:
 
-{_invoice_table(discrepancies)}
+{_invoice_table(discrepancies, summary)}
 
 Total Tax at Risk: {_format_amount(total_tax)}
 
@@ -254,7 +295,8 @@ def _email_missing_in_pr(
     vendor_name: str,
     discrepancies: List[DiscrepancyDetail],
     sender_name: str,
-    sender_company: str
+    sender_company: str,
+    summary: Optional[List[VendorSummaryRow]] = None
 ) -> EmailTemplate:
     """Email for invoices in GSTR-2B but missing in PR (internal + vendor notification)"""
     subject = f"GST Reconciliation: {len(discrepancies)} Invoice(s) in GSTR-2B Not in Our Records — Clarification Needed"
@@ -265,7 +307,7 @@ Greetings from {sender_company}.
 
 During our GST reconciliation, we found that the following invoice(s) appear in your GSTR-2B filing but are NOT present in our Purchase Register:
 
-{_invoice_table(discrepancies)}
+{_invoice_table(discrepancies, summary)}
 
 Request:
 We kindly request you to:
@@ -297,7 +339,8 @@ def _email_gstin_mismatch(
     vendor_name: str,
     discrepancies: List[DiscrepancyDetail],
     sender_name: str,
-    sender_company: str
+    sender_company: str,
+    summary: Optional[List[VendorSummaryRow]] = None
 ) -> EmailTemplate:
     """Email for GSTIN mismatch"""
     subject = f"GST Reconciliation: GSTIN Mismatch in {len(discrepancies)} Invoice(s) — Correction Required"
@@ -308,7 +351,7 @@ Greetings from {sender_company}.
 
 During our GST reconciliation, we have identified a GSTIN mismatch in the following invoice(s):
 
-{_invoice_table(discrepancies)}
+{_invoice_table(discrepancies, summary)}
 
 The GSTIN on the invoice does not match our records or the GSTR-2B data. This may be due to:
 - Data entry error in GSTIN
@@ -3,14 +3,23 @@ Unified Reconciliation API
 Accepts two file uploads, parses, reconciles, returns full results
 Now logs to Supabase for admin visibility
 """
+import json
 import uuid
 from fastapi import APIRouter, UploadFile, File, HTTPException, Header, Request, Form
-from typing import List, Dict, Any, Optional
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+from itertools import chain
 from datetime import datetime, timezone
 
 from core.file_parser import FileParser
-from core.reconciliation_engine import ReconciliationEngine
+from core.columnar_engine import select_engine
+from core.external_engine import ExternalReconciliationEngine
+from core.reconciliation_engine import ReconciliationContext, MatchResult
+from core.invoice_record import from_paise
+from core.rule_profile import RuleProfile, client_rule_profile
 from core.db import get_db
+from config import get_settings
 
 
 router = APIRouter()
@@ -29,7 +38,6 @@ async def reconcile_files(
     Returns full results including stats, matched/mismatched invoices, and summary.
     """
     parser = FileParser()  # Fresh instance per request to avoid state leakage
-    engine = ReconciliationEngine()
     
     try:
         # Read file contents
@@ -68,47 +76,47 @@ async def reconcile_files(
     for i, inv in enumerate(gstr2b_invoices):
         inv["id"] = f"gstr2b_{i}"
     
-    # Run reconciliation
-    match_results = engine.reconcile(pr_invoices, gstr2b_invoices)
-    stats = engine.get_stats(match_results)
+    # Run reconciliation (columnar, process-parallel or out-of-core engine for large registers),
+    # compiled for the client's rule profile when it has one
+    settings = get_settings()
+    profile = await run_in_threadpool(_load_rule_profile, client_id)
+    engine = select_engine(
+        len(pr_invoices),
+        len(gstr2b_invoices),
+        settings.reconcile_workers,
+        settings.reconcile_memory_budget_mb,
+        settings.reconcile_spill_dir,
+        profile
+    )
+    context = ReconciliationContext()
+    streamed = isinstance(engine, ExternalReconciliationEngine)
+    if streamed:
+        # Out of core: results stay spilled and are streamed into the response.
+        # The engine yields its first result once every stage is done, so the
+        # stats below are complete by then
+        results_iter = engine.reconcile_iter(pr_invoices, gstr2b_invoices, context)
+        first = await run_in_threadpool(next, results_iter, None)
+        match_results: Iterable[MatchResult] = chain([first], results_iter) if first is not None else []
+    else:
+        match_results = await run_in_threadpool(engine.reconcile, pr_invoices, gstr2b_invoices, context)
+    totals = context.totals
+    stats = engine.stats_from_counts(totals.status_counts)
     
-    # Build results with full invoice details
-    results_with_details = []
-    pr_map = {inv["id"]: inv for inv in pr_invoices}
-    gstr2b_map = {inv["id"]: inv for inv in gstr2b_invoices}
+    # Flag pathological uploads (e.g. one invoice number reused by many vendors)
+    bucket_stats = context.bucket_stats
+    oversized = bucket_stats.get("invoice", {}).get("oversized", 0)
+    if oversized:
+        print(f"⚠️ {oversized} oversized candidate buckets (largest: {bucket_stats['invoice']['largest']})")
     
-    for r in match_results:
-        result = {
-            "id": str(uuid.uuid4()),
-            "status": r.status.value,
-            "confidence_score": r.confidence_score,
-            "match_rule": r.match_rule,
-            "taxable_diff": r.taxable_diff,
-            "igst_diff": r.igst_diff,
-            "cgst_diff": r.cgst_diff,
-            "sgst_diff": r.sgst_diff,
-            "total_diff": r.total_diff,
-            "pr_invoice": _serialize_invoice(pr_map.get(r.pr_invoice_id)) if r.pr_invoice_id else None,
-            "gstr2b_invoice": _serialize_invoice(gstr2b_map.get(r.gstr2b_invoice_id)) if r.gstr2b_invoice_id else None,
-        }
-        results_with_details.append(result)
+    # Results with full invoice details, built per row as they are sent
+    results_with_details = (_result_details(r, pr_invoices, gstr2b_invoices) for r in match_results)
     
-    # Calculate ITC summary
-    total_pr_taxable = sum(inv.get("taxable_value", 0) for inv in pr_invoices)
-    total_gstr2b_taxable = sum(inv.get("taxable_value", 0) for inv in gstr2b_invoices)
-    total_pr_tax = sum(inv.get("total_tax", 0) for inv in pr_invoices)
-    total_gstr2b_tax = sum(inv.get("total_tax", 0) for inv in gstr2b_invoices)
-    
-    # ITC that can be claimed (exact matches)
-    itc_claimable = 0
-    itc_at_risk = 0
-    for r in match_results:
-        if r.status.value == "exact_match":
-            gstr2b_inv = gstr2b_map.get(r.gstr2b_invoice_id, {})
-            itc_claimable += gstr2b_inv.get("total_tax", 0)
-        elif r.status.value in ["amount_mismatch", "date_mismatch", "gstin_mismatch"]:
-            gstr2b_inv = gstr2b_map.get(r.gstr2b_invoice_id, {})
-            itc_at_risk += gstr2b_inv.get("total_tax", 0)
+    # ITC summary, accumulated by the engine during matching (in paise)
+    total_pr_taxable = from_paise(totals.pr_totals["taxable"])
+    total_gstr2b_taxable = from_paise(totals.gstr2b_totals["taxable"])
+    total_gstr2b_tax = from_paise(totals.gstr2b_totals["total_tax"])
+    itc_claimable = from_paise(totals.itc_claimable["total_tax"])
+    itc_at_risk = from_paise(totals.itc_at_risk["total_tax"])
     
     # Log to Supabase
     try:
@@ -175,7 +183,7 @@ async def reconcile_files(
             client_update_error = str(e)
             print(f"⚠️ Client status update error for {client_id}: {e}")
 
-    return {
+    response = {
         "success": True,
         "client_id": client_id,
         "client_update_success": client_update_success,
@@ -196,8 +204,11 @@ async def reconcile_files(
             "amount_mismatch": stats["amount_mismatch"],
             "date_mismatch": stats.get("date_mismatch", 0),
             "gstin_mismatch": stats.get("gstin_mismatch", 0),
+            "invoice_mismatch": stats.get("invoice_mismatch", 0),
+            "split_match": stats.get("split_match", 0),
             "pr_only": stats["pr_only"],
             "gstr2b_only": stats["gstr2b_only"],
+            "duplicate": stats["duplicate"],
             "match_rate": round(stats["match_rate"], 1),
             "pending_review": stats["pending_review"],
             "discrepancies": stats["discrepancies"],
@@ -208,9 +219,64 @@ async def reconcile_files(
             "total_itc_available": round(total_gstr2b_tax, 2),
             "total_pr_taxable": round(total_pr_taxable, 2),
             "total_gstr2b_taxable": round(total_gstr2b_taxable, 2),
+            "by_tax_head": {
+                "itc_claimable": {head: from_paise(v) for head, v in totals.itc_claimable.items()},
+                "itc_at_risk": {head: from_paise(v) for head, v in totals.itc_at_risk.items()},
+            },
         },
-        "results": results_with_details,
+        "index_stats": bucket_stats,
+        "vendor_summary": context.vendor_summary(),
     }
+    if streamed:
+        return StreamingResponse(_stream_json(response, "results", results_with_details), media_type="application/json")
+    response["results"] = list(results_with_details)
+    return response
+
+
+def _result_details(r: MatchResult, pr_invoices: List[Dict], gstr2b_invoices: List[Dict]) -> Dict:
+    """A match result with the full invoices it refers to"""
+    return {
+        "id": str(uuid.uuid4()),
+        "status": r.status.value,
+        "confidence_score": r.confidence_score,
+        "match_rule": r.match_rule,
+        "taxable_diff": r.taxable_diff,
+        "igst_diff": r.igst_diff,
+        "cgst_diff": r.cgst_diff,
+        "sgst_diff": r.sgst_diff,
+        "total_diff": r.total_diff,
+        "duplicate_of": r.duplicate_of,
+        "pr_invoice": _serialize_invoice(_by_position(pr_invoices, r.pr_invoice_id)),
+        "gstr2b_invoice": _serialize_invoice(_by_position(gstr2b_invoices, r.gstr2b_invoice_id)),
+    }
+
+
+def _by_position(invoices: List[Dict], invoice_id: Optional[str]) -> Optional[Dict]:
+    """Invoice of an id assigned above ('pr_<i>' / 'gstr2b_<i>'), without an id map"""
+    if not invoice_id:
+        return None
+    return invoices[int(invoice_id.rsplit("_", 1)[1])]
+
+
+def _stream_json(head: Dict, key: str, items: Iterator[Dict]) -> Iterator[bytes]:
+    """`head` with `key` set to a list of `items`, as JSON written one item at a time"""
+    opening = json.dumps(head, default=str, separators=(",", ":"))
+    yield f"{opening[:-1]},{json.dumps(key)}:[".encode()
+    for i, item in enumerate(items):
+        yield (("," if i else "") + json.dumps(item, default=str, separators=(",", ":"))).encode()
+    yield b"]}"
+
+
+def _load_rule_profile(client_id: Optional[str]) -> Optional[RuleProfile]:
+    """Rule profile of the client, if any (a lookup failure falls back to the defaults)"""
+    if not client_id:
+        return None
+    try:
+        result = get_db().table("clients").select("id, rule_profile").eq("id", client_id).execute()
+    except Exception as e:
+        print(f"⚠️ Rule profile lookup failed for client {client_id}: {e}")
+        return None
+    return client_rule_profile(result.data[0]) if result.data else None
 
 
 def _serialize_invoice(inv: Dict | None) -> Dict | None:
@@ -1,21 +1,243 @@
 """
 Reconciliation API Routes
 """
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from typing import List, Dict, Set, Optional, Iterator, Iterable, Tuple
+from itertools import islice, chain
 from datetime import datetime
+from uuid import UUID, uuid4
+import os
 
 from models.schemas import (
     ReconciliationRunCreate, ReconciliationRunResponse,
     ReconciliationStartRequest, ReconciliationStats,
-    MatchResultResponse, MatchStatus
+    MatchResultResponse, MatchStatus, ToleranceSweepRequest
 )
 from services.supabase_service import get_supabase_service, SupabaseService
-from core.reconciliation_engine import get_reconciliation_engine, ReconciliationEngine
+from core.reconciliation_engine import (
+    get_reconciliation_engine, ReconciliationEngine, ReconciliationContext, MatchResult
+)
+from core.invoice_record import InvoiceRecord, RecordBuilder, from_paise, to_paise
+from core.open_items import OpenItem, OpenItemsIndex, OPEN_STATUSES, probe_keys, carry_forward
+from core.sql_pushdown import SqlPushdown, PushdownResidue, connect_postgres
+from core.itc_history import ItcHistoryIndex, find_repeat_claims
+from core.tolerance_sweep import ToleranceSweep, ToleranceSetting, stored_results
+from core.rule_profile import RuleProfile, client_rule_profile, profile_engine
+from core.columnar_engine import select_engine
+from core.external_engine import ExternalReconciliationEngine
+from core.incremental_engine import IncrementalReconciliation, result_key
+from core.file_parser import get_file_parser, FileParser
+from config import get_settings
 
 
 router = APIRouter()
 
+# Match results are inserted in batches of this size while the engine runs
+MATCH_RESULT_BATCH_SIZE = 1000
+
+# Registers a completed run can be revised with
+REVISION_SOURCES = ("purchase_register", "gstr2b")
+
+
+def _batched(results: Iterator[MatchResult], size: int) -> Iterator[List[MatchResult]]:
+    """Group a result stream into lists of at most `size` results"""
+    while True:
+        batch = list(islice(results, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _result_row(run_id: str, r: MatchResult) -> Dict:
+    """match_results row of an engine result"""
+    return {
+        "run_id": run_id,
+        "pr_invoice_id": r.pr_invoice_id,
+        "gstr2b_invoice_id": r.gstr2b_invoice_id,
+        "match_status": r.status.value,
+        "confidence_score": r.confidence_score,
+        "match_rule_applied": r.match_rule,
+        "taxable_diff": r.taxable_diff,
+        "igst_diff": r.igst_diff,
+        "cgst_diff": r.cgst_diff,
+        "sgst_diff": r.sgst_diff,
+        "total_diff": r.total_diff
+    }
+
+
+def _completed_run(
+    engine: ReconciliationEngine,
+    context: ReconciliationContext,
+    pr_count: int,
+    gstr2b_count: int
+) -> Tuple[Dict, Dict]:
+    """(stats, run update) of a finished run, from the totals the engine accumulated"""
+    totals = context.totals
+    stats = engine.stats_from_counts(totals.status_counts)
+    return stats, {
+        "status": "completed",
+        "completed_at": datetime.utcnow().isoformat(),
+        "total_pr_invoices": pr_count,
+        "total_gstr2b_invoices": gstr2b_count,
+        "matched_count": stats["exact_match"],
+        "mismatch_count": (
+            stats["amount_mismatch"] + stats["date_mismatch"]
+            + stats["gstin_mismatch"] + stats["invoice_mismatch"]
+            + stats["split_match"]
+        ),
+        "pr_only_count": stats["pr_only"],
+        "gstr2b_only_count": stats["gstr2b_only"],
+        "total_pr_taxable": from_paise(totals.pr_totals["taxable"]),
+        "total_gstr2b_taxable": from_paise(totals.gstr2b_totals["taxable"])
+    }
+
+
+def _reconcile_pushdown(
+    engine: ReconciliationEngine,
+    run_id: str,
+    context: ReconciliationContext,
+    residue: PushdownResidue
+) -> Tuple[int, int]:
+    """Reconcile a stored run inside Postgres; returns (PR count, GSTR-2B count)"""
+    conn = connect_postgres(get_settings().database_url)
+    try:
+        counts = SqlPushdown(engine).reconcile_run(conn, run_id, context, residue=residue)
+        conn.commit()
+        return counts
+    finally:
+        conn.close()
+
+
+async def _client_profile(supabase: SupabaseService, run: Optional[Dict]) -> Optional[RuleProfile]:
+    """Rule profile of the run's client, if any (a lookup failure falls back to the defaults)"""
+    client_id = (run or {}).get("client_id")
+    if not client_id:
+        return None
+    try:
+        client = await supabase.get_client(client_id)
+    except Exception as e:
+        print(f"⚠️ Rule profile lookup failed for client {client_id}: {e}")
+        return None
+    return client_rule_profile(client)
+
+
+async def _client_engine(
+    supabase: SupabaseService,
+    engine: ReconciliationEngine,
+    run: Optional[Dict]
+) -> ReconciliationEngine:
+    """The engine compiled for the run's client rule profile (the shared engine without one)"""
+    profile = await _client_profile(supabase, run)
+    return engine if profile is None else profile_engine(profile, type(engine))
+
+
+async def _carry_forward_open_items(
+    supabase: SupabaseService,
+    engine: ReconciliationEngine,
+    run: Dict,
+    open_results: List[MatchResult],
+    invoices: Iterable[Dict]
+) -> Dict:
+    """
+    Close the client's open items from earlier periods that this period's
+    PR_ONLY / GSTR2B_ONLY invoices match, and open items for the rest.
+    Only open items sharing a (GSTIN, invoice no) with them are loaded.
+    """
+    client_id, period = run["client_id"], run["return_period"]
+    wanted = {r.pr_invoice_id or r.gstr2b_invoice_id for r in open_results}
+    records = await run_in_threadpool(_records_by_id, invoices, wanted)
+    
+    # A re-run replaces what the period's previous run did
+    await supabase.reset_open_items_for_period(client_id, period)
+    rows = await supabase.get_open_items(client_id, probe_keys(open_results, records))
+    index = OpenItemsIndex(OpenItem.from_row(row) for row in rows)
+    closed, opened = carry_forward(engine, index, open_results, records, period)
+    
+    closed_at = datetime.utcnow().isoformat()
+    await supabase.close_open_items([
+        {
+            **item.item.as_row(client_id),
+            "id": item.item.id,
+            "closed_period": period,
+            "closed_by_invoice_id": item.invoice_id,
+            "closed_at": closed_at
+        }
+        for item in closed
+    ])
+    if opened:
+        await supabase.bulk_insert_open_items([item.as_row(client_id) for item in opened])
+    return {"closed": [item.as_dict() for item in closed], "opened": len(opened)}
+
+
+def _records_by_id(invoices: Iterable[Dict], wanted: Set[str]) -> Dict[str, InvoiceRecord]:
+    """Records of the wanted invoices (the invoices may be a paged read, consumed once)"""
+    builder = RecordBuilder()
+    return {inv["id"]: builder.build(inv) for inv in invoices if inv["id"] in wanted}
+
+
+def _check_repeat_claims(directory: str, run: Dict, pr_invoices: Iterable[Dict]) -> List[Dict]:
+    """PR invoices of the run already claimed in another period of the client (then recorded)"""
+    index = ItcHistoryIndex(os.path.join(directory, str(run["client_id"])))
+    builder = RecordBuilder()
+    return find_repeat_claims(index, (builder.build(inv) for inv in pr_invoices), run["return_period"])
+
+
+def _state_path(directory: Optional[str], run_id: str) -> Optional[str]:
+    """Saved incremental state of a run: one file per run id under the configured directory"""
+    if not directory:
+        return None
+    return os.path.join(directory, f"{UUID(run_id)}.json.gz")
+
+
+def _drop_incremental_state(directory: Optional[str], run_id: str) -> None:
+    path = _state_path(directory, run_id)
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _load_incremental(
+    supabase: SupabaseService,
+    engine: ReconciliationEngine,
+    run_id: str,
+    path: Optional[str]
+) -> IncrementalReconciliation:
+    """The run's saved incremental state; rebuilt from its stored invoices when missing or stale"""
+    if path and os.path.exists(path):
+        try:
+            return IncrementalReconciliation.load(path, engine)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ Rebuilding incremental state of run {run_id}: {e}")
+    incremental = IncrementalReconciliation(engine)
+    incremental.reconcile(
+        list(supabase.iter_invoices_for_run(run_id, "purchase_register")),
+        list(supabase.iter_invoices_for_run(run_id, "gstr2b"))
+    )
+    return incremental
+
+
+def _tolerance_sweep(
+    engine: ReconciliationEngine,
+    pr_invoices: List[Dict],
+    gstr2b_invoices: List[Dict],
+    result_rows: List[Dict],
+    request: ToleranceSweepRequest
+) -> List[Dict]:
+    """What-if summaries of a stored run, one per requested tolerance setting"""
+    builder = RecordBuilder()
+    sweep = ToleranceSweep(
+        engine, builder.build_all(pr_invoices), builder.build_all(gstr2b_invoices), stored_results(result_rows)
+    )
+    return sweep.sweep([
+        ToleranceSetting.from_engine(
+            engine,
+            amount_tolerance_paise=None if s.amount_tolerance is None else to_paise(s.amount_tolerance),
+            percentage_tolerance_bps=None if s.percentage_tolerance is None else round(s.percentage_tolerance * 100),
+            date_tolerance_days=s.date_tolerance_days
+        )
+        for s in request.settings
+    ])
+
 
 @router.post("/runs", response_model=ReconciliationRunResponse)
 async def create_reconciliation_run(
@@ -66,59 +288,171 @@ async def start_reconciliation(
             "started_at": datetime.utcnow().isoformat()
         })
         
-        # Get invoices
-        pr_invoices = await supabase.get_invoices_for_run(run_id, "purchase_register")
-        gstr2b_invoices = await supabase.get_invoices_for_run(run_id, "gstr2b")
-        
-        # Run reconciliation
-        results = engine.reconcile(pr_invoices, gstr2b_invoices)
-        stats = engine.get_stats(results)
+        settings = get_settings()
+        # A fresh run replaces the results any saved revision state describes
+        _drop_incremental_state(settings.incremental_state_dir, run_id)
+        run = await supabase.get_reconciliation_run(run_id)
+        profile = await _client_profile(supabase, run)
+        context = ReconciliationContext()
+        open_results: List[MatchResult] = []
+        # A profile that reorders or disables the leading rules is matched in memory
+        pushdown_engine = profile_engine(profile, type(engine)) if profile else engine
+        pushdown = settings.reconcile_pushdown and SqlPushdown.supports(pushdown_engine)
+        if pushdown:
+            engine = pushdown_engine
+            # Rules that are plain joins run as SQL next to the data; the rest in Python.
+            # Only the residue is read back, which is all the open items check needs
+            residue = PushdownResidue(with_claims=bool(settings.itc_history_dir))
+            pr_count, gstr2b_count = await run_in_threadpool(_reconcile_pushdown, engine, run_id, context, residue)
+            open_results = residue.open_results
+            open_invoices: Iterable[Dict] = residue.invoices
+            claim_invoices = residue.claims
+        else:
+            # Pick the row, columnar, process-parallel or out-of-core engine from the counts alone
+            pr_count = await supabase.count_invoices_for_run(run_id, "purchase_register")
+            gstr2b_count = await supabase.count_invoices_for_run(run_id, "gstr2b")
+            engine = select_engine(
+                pr_count,
+                gstr2b_count,
+                settings.reconcile_workers,
+                settings.reconcile_memory_budget_mb,
+                settings.reconcile_spill_dir,
+                profile
+            )
+            
+            def pages(source: str) -> Iterator[Dict]:
+                return supabase.iter_invoices_for_run(run_id, source)
+            
+            if isinstance(engine, ExternalReconciliationEngine):
+                # Out of core: paged reads stream into the engine, and are read again
+                # (lazily) by the later checks, so no side is ever held in memory
+                pr_invoices: Iterable[Dict] = pages("purchase_register")
+                gstr2b_invoices: Iterable[Dict] = pages("gstr2b")
+                open_invoices = chain(pages("purchase_register"), pages("gstr2b"))
+                claim_invoices = pages("purchase_register")
+            else:
+                pr_invoices = await run_in_threadpool(list, pages("purchase_register"))
+                gstr2b_invoices = await run_in_threadpool(list, pages("gstr2b"))
+                open_invoices = chain(pr_invoices, gstr2b_invoices)
+                claim_invoices = pr_invoices
+            
+            # Run reconciliation off the event loop (engines are stateless),
+            # saving results to the database in batches as each phase produces them
+            results = engine.reconcile_iter(pr_invoices, gstr2b_invoices, context)
+            async for batch in iterate_in_threadpool(_batched(results, MATCH_RESULT_BATCH_SIZE)):
+                open_results.extend(r for r in batch if r.status in OPEN_STATUSES)
+                await supabase.bulk_insert_match_results([_result_row(run_id, r) for r in batch])
         
-        # Save results to database
-        match_results = []
-        for r in results:
-            match_results.append({
-                "run_id": run_id,
-                "pr_invoice_id": r.pr_invoice_id,
-                "gstr2b_invoice_id": r.gstr2b_invoice_id,
-                "match_status": r.status.value,
-                "confidence_score": r.confidence_score,
-                "match_rule_applied": r.match_rule,
-                "taxable_diff": r.taxable_diff,
-                "igst_diff": r.igst_diff,
-                "cgst_diff": r.cgst_diff,
-                "sgst_diff": r.sgst_diff,
-                "total_diff": r.total_diff
-            })
+        # Counts and totals were accumulated by the engine during matching
+        stats, completed = _completed_run(engine, context, pr_count, gstr2b_count)
+        await supabase.update_reconciliation_run(run_id, completed)
         
-        if match_results:
-            await supabase.bulk_insert_match_results(match_results)
+        # Checks across the client's return periods
+        carried = None
+        repeat_claims = None
+        if run and run.get("client_id"):
+            if open_results:
+                try:
+                    carried = await _carry_forward_open_items(supabase, engine, run, open_results, open_invoices)
+                except Exception as e:
+                    print(f"⚠️ Open items carry-forward error for run {run_id}: {e}")
+            if settings.itc_history_dir:
+                try:
+                    repeat_claims = await run_in_threadpool(
+                        _check_repeat_claims, settings.itc_history_dir, run, claim_invoices
+                    )
+                except Exception as e:
+                    print(f"⚠️ ITC history check error for run {run_id}: {e}")
         
-        # Calculate totals
-        total_pr_taxable = sum(inv.get("taxable_value", 0) for inv in pr_invoices)
-        total_gstr2b_taxable = sum(inv.get("taxable_value", 0) for inv in gstr2b_invoices)
+        return {
+            "run_id": run_id,
+            "status": "completed",
+            "stats": stats,
+            "open_items": carried,
+            "repeat_claims": repeat_claims
+        }
         
-        # Update run with results
+    except Exception as e:
+        await supabase.update_reconciliation_run(run_id, {"status": "failed"})
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/runs/{run_id}/revise")
+async def revise_reconciliation(
+    run_id: str,
+    source: str = Form(...),
+    file: UploadFile = File(...),
+    supabase: SupabaseService = Depends(get_supabase_service),
+    engine: ReconciliationEngine = Depends(get_reconciliation_engine),
+    parser: FileParser = Depends(get_file_parser)
+):
+    """
+    Re-reconcile a completed run against a revised Purchase Register or
+    GSTR-2B. Only the partitions whose rows changed are matched again, and
+    only the changed invoices and match results are written.
+    """
+    if source not in REVISION_SOURCES:
+        raise HTTPException(status_code=400, detail=f"source must be one of {list(REVISION_SOURCES)}")
+    run = await supabase.get_reconciliation_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run["status"] != "completed":
+        raise HTTPException(status_code=400, detail="Run has not completed")
+    
+    content = await file.read()
+    file_name = file.filename or f"{source}.xlsx"
+    if source == "purchase_register":
+        invoices, _ = parser.parse_purchase_register(content, file_name)
+    else:
+        invoices, _ = parser.parse_gstr2b(content, file_name)
+    if not invoices:
+        raise HTTPException(status_code=400, detail={"message": "No invoices parsed", "errors": parser.get_errors()})
+    for inv in invoices:
+        inv["run_id"] = run_id
+        inv["id"] = str(uuid4())  # Rows matching a stored row keep the stored id
+    
+    settings = get_settings()
+    path = _state_path(settings.incremental_state_dir, run_id)
+    try:
         await supabase.update_reconciliation_run(run_id, {
-            "status": "completed",
-            "completed_at": datetime.utcnow().isoformat(),
-            "total_pr_invoices": len(pr_invoices),
-            "total_gstr2b_invoices": len(gstr2b_invoices),
-            "matched_count": stats["exact_match"],
-            "mismatch_count": stats["amount_mismatch"] + stats["gstin_mismatch"],
-            "pr_only_count": stats["pr_only"],
-            "gstr2b_only_count": stats["gstr2b_only"],
-            "total_pr_taxable": total_pr_taxable,
-            "total_gstr2b_taxable": total_gstr2b_taxable
+            "status": "matching",
+            f"{source}_file": file_name
         })
+        engine = await _client_engine(supabase, engine, run)
+        incremental = await run_in_threadpool(_load_incremental, supabase, engine, run_id, path)
+        
+        context = ReconciliationContext()
+        registers = (invoices, None) if source == "purchase_register" else (None, invoices)
+        delta = await run_in_threadpool(incremental.update, *registers, context)
+        
+        # New rows first (results reference them), stale results and rows last
+        await supabase.upsert_invoices(delta.added_invoices + delta.moved_invoices)
+        await supabase.delete_match_results(run_id, delta.deleted + [result_key(r) for r in delta.upserted])
+        for batch in _batched(iter(delta.upserted), MATCH_RESULT_BATCH_SIZE):
+            await supabase.bulk_insert_match_results([_result_row(run_id, r) for r in batch])
+        await supabase.delete_invoices(delta.removed_invoice_ids)
+        
+        pr_records, gstr2b_records = incremental.records
+        stats, completed = _completed_run(engine, context, len(pr_records), len(gstr2b_records))
+        await supabase.update_reconciliation_run(run_id, completed)
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            await run_in_threadpool(incremental.save, path)
         
         return {
             "run_id": run_id,
             "status": "completed",
-            "stats": stats
+            "stats": stats,
+            "invoices_added": len(delta.added_invoices),
+            "invoices_removed": len(delta.removed_invoice_ids),
+            "results_upserted": len(delta.upserted),
+            "results_deleted": len(delta.deleted),
+            "partitions": delta.partitions
         }
         
     except Exception as e:
+        # The saved state may no longer describe the stored rows; rebuild it next time
+        _drop_incremental_state(settings.incremental_state_dir, run_id)
         await supabase.update_reconciliation_run(run_id, {"status": "failed"})
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -142,6 +476,34 @@ async def get_reconciliation_stats(
     )
 
 
+@router.post("/runs/{run_id}/tolerance-sweep")
+async def tolerance_sweep(
+    run_id: str,
+    request: ToleranceSweepRequest,
+    supabase: SupabaseService = Depends(get_supabase_service),
+    engine: ReconciliationEngine = Depends(get_reconciliation_engine)
+):
+    """
+    What-if analysis of a completed run: status counts and ITC claimable /
+    at risk under each of the given tolerance settings. The run's candidate
+    pairs are loaded once and reclassified per setting, without re-matching.
+    """
+    run = await supabase.get_reconciliation_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run["status"] != "completed":
+        raise HTTPException(status_code=400, detail="Run has not completed")
+    
+    pr_invoices = await run_in_threadpool(list, supabase.iter_invoices_for_run(run_id, "purchase_register"))
+    gstr2b_invoices = await run_in_threadpool(list, supabase.iter_invoices_for_run(run_id, "gstr2b"))
+    result_rows = await run_in_threadpool(list, supabase.iter_match_results_for_run(run_id))
+    engine = await _client_engine(supabase, engine, run)
+    summaries = await run_in_threadpool(
+        _tolerance_sweep, engine, pr_invoices, gstr2b_invoices, result_rows, request
+    )
+    return {"run_id": run_id, "settings": summaries}
+
+
 @router.get("/runs/{run_id}/results", response_model=List[MatchResultResponse])
 async def get_match_results(
     run_id: str,
@@ -4,9 +4,10 @@ List, create, and delete clients stored in Supabase 'clients' table
 """
 from fastapi import APIRouter, HTTPException, Header, Request
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Dict, Any
 from datetime import datetime
 from core.db import get_db
+from core.rule_profile import RuleProfile
 
 router = APIRouter()
 
@@ -15,6 +16,15 @@ class ClientCreateRequest(BaseModel):
     name: str
     email: Optional[str] = None
     gstin: Optional[str] = None
+    rule_profile: Optional[Dict[str, Any]] = None
+
+
+def _stored_rule_profile(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate a rule profile and return it in its stored (normalized) form"""
+    try:
+        return RuleProfile.from_dict(data).as_dict()
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid rule profile: {e}")
 
 
 @router.get("/")
@@ -50,6 +60,8 @@ async def create_client(
         "pending_month": datetime.now().strftime("%B %Y"),
         "created_by": user_email,
     }
+    if data.rule_profile is not None:
+        insert_data["rule_profile"] = _stored_rule_profile(data.rule_profile)
 
     result = db.table("clients").insert(insert_data).execute()
 
@@ -87,6 +99,7 @@ class ClientUpdateRequest(BaseModel):
     name: Optional[str] = None
     email: Optional[str] = None
     gstin: Optional[str] = None
+    rule_profile: Optional[Dict[str, Any]] = None
 
 
 @router.patch("/{client_id}")
@@ -95,7 +108,7 @@ async def update_client(
     data: ClientUpdateRequest,
     authorization: Optional[str] = Header(None),
 ):
-    """Update client details (name, email, gstin)"""
+    """Update client details (name, email, gstin, rule profile)"""
     db = get_db()
 
     update_data = {}
@@ -105,6 +118,8 @@ async def update_client(
         update_data["email"] = data.email.strip() or None
     if data.gstin is not None:
         update_data["gstin"] = data.gstin.strip().upper() or None
+    if data.rule_profile is not None:
+        update_data["rule_profile"] = _stored_rule_profile(data.rule_profile)
 
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
@@ -28,6 +28,22 @@ class Settings(BaseSettings):
     # Redis (for Celery)
     redis_url: str = "redis://localhost:6379/0"
     
+    # Reconciliation worker processes (0/1 = match in the request process)
+    reconcile_workers: int = 0
+    
+    # Memory budget for matching; larger registers are reconciled out of core (0 = no limit)
+    reconcile_memory_budget_mb: int = 0
+    reconcile_spill_dir: Optional[str] = None  # Sorted runs go here (default: system temp dir)
+    
+    # Run the exact / key-join rules of stored runs as SQL over database_url (needs psycopg)
+    reconcile_pushdown: bool = False
+    
+    # Per-client claim history for cross-period duplicate ITC checks (None = off)
+    itc_history_dir: Optional[str] = None
+    
+    # Saved incremental state per run, for cheap revisions of a completed run (None = rebuilt each time)
+    incremental_state_dir: Optional[str] = None
+    
     # Email / SMTP
     smtp_host: str = "smtp.gmail.com"
     smtp_port: int = 587
@@ -0,0 +1,375 @@
+"""
+Candidate Index
+Multi-key lookup structure over GSTR-2B records for the matching rules
+"""
+from typing import List, Dict, Tuple, Iterator, Iterable, Hashable, Optional, Sequence
+from itertools import product
+from bisect import bisect_left, bisect_right
+import heapq
+
+from core.invoice_record import InvoiceRecord, gstin_pan
+from core.fuzzy_index import FuzzyKeyIndex, FuzzyThresholds, DEFAULT_FUZZY_THRESHOLDS
+
+
+# Buckets larger than this are split further by per-head amount bands
+MAX_BUCKET_SIZE = 64
+
+
+class Bucket:
+    """
+    Positions of GSTR-2B records sharing an index key, in file order.
+
+    `cursor` skips the claimed prefix so repeated "first unclaimed" lookups
+    are amortized O(1). Oversized buckets get `sub`, a split of the same
+    positions by per-head amount bands.
+    """
+    __slots__ = ("positions", "cursor", "sub")
+
+    def __init__(self):
+        self.positions: List[int] = []
+        self.cursor = 0
+        self.sub: Optional[Dict[Tuple[int, int, int], "Bucket"]] = None
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def unclaimed(self, claimed: Sequence[bool]) -> Iterator[int]:
+        """Yield unclaimed positions in file order"""
+        positions = self.positions
+        cursor = self.cursor
+        while cursor < len(positions) and claimed[positions[cursor]]:
+            cursor += 1
+        self.cursor = cursor
+        for i in range(cursor, len(positions)):
+            pos = positions[i]
+            if not claimed[pos]:
+                yield pos
+
+
+class DateBucket:
+    """Positions of GSTR-2B records sharing an index key, sorted by date ordinal (then file order)"""
+    __slots__ = ("ordinals", "positions")
+
+    def __init__(self, entries: List[Tuple[int, int]]):
+        entries.sort()
+        self.ordinals = [ordinal for ordinal, _ in entries]
+        self.positions = [pos for _, pos in entries]
+
+    def window(self, low: int, high: int) -> range:
+        """Indexes of entries dated within [low, high], found by bisection"""
+        return range(bisect_left(self.ordinals, low), bisect_right(self.ordinals, high))
+
+
+class CandidateIndex:
+    """
+    Indexes GSTR-2B records (by list position) under three keys:
+
+    - Primary:   (GSTIN, invoice key)       -> Rules 1-3 (same vendor)
+    - Secondary: invoice key                -> any candidate for an invoice number
+    - Secondary: (invoice key, tax band)    -> Rule 5 (GSTIN mismatch, amounts equal)
+    - Branch:    (PAN, invoice key, tax band) -> Rule 4 (same legal entity, other GSTIN)
+    - Exact:     InvoiceRecord.exact_key    -> fast path for identical invoices
+    - Dated:     (GSTIN, tax band), sorted by invoice date ordinal
+                                            -> date-window lookups, any invoice number
+    - Totals:    (GSTIN, invoice total band) -> amount-only lookups, any invoice number
+    - Fuzzy:     FuzzyKeyIndex, built on first use over the unclaimed records
+                                            -> similar invoice numbers, same GSTIN
+
+    The tax band is the GST total (IGST + CGST + SGST) divided into bands of
+    3x the per-head tolerance. Amounts that match head-by-head can differ by at
+    most one band, so a lookup checks the record's own band and its two
+    neighbours and never has to scan the whole invoice-number bucket.
+
+    Skew protection: buckets above `max_bucket_size` (e.g. invoice "1" reused
+    by hundreds of vendors) are split again by IGST/CGST/SGST bands of the
+    tolerance width, so amount-checked lookups only visit the neighbouring
+    sub-buckets. Per-lookup work stays bounded by the sub-bucket size.
+
+    Invoice totals (taxable + tax) are banded by the tolerance width itself,
+    so totals within tolerance sit in the same or a neighbouring band.
+
+    `paired` ({PR id: position}) holds pairs already settled by the balanced-
+    vendor pre-pass; those GSTR-2B records are left out of every index.
+    """
+
+    def __init__(
+        self,
+        records: List[InvoiceRecord],
+        tolerance_paise: int,
+        max_bucket_size: int = MAX_BUCKET_SIZE,
+        paired: Optional[Dict[str, int]] = None
+    ):
+        self.records = records
+        self.paired = paired or {}
+        self.head_width = max(tolerance_paise, 1)
+        self.band_width = 3 * self.head_width
+        self.max_bucket_size = max_bucket_size
+        self.by_gstin_invoice: Dict[Tuple[str, str], Bucket] = {}
+        self.by_invoice: Dict[str, Bucket] = {}
+        self.by_invoice_amount: Dict[Tuple[str, int], Bucket] = {}
+        self.by_exact_key: Dict[Tuple, Bucket] = {}
+        self.by_gstin_amount_date: Dict[Tuple[str, int], DateBucket] = {}
+        self.by_gstin_total: Dict[Tuple[str, int], Bucket] = {}
+        self.by_pan_invoice_amount: Dict[Tuple[str, str, int], Bucket] = {}
+        self.pans: Dict[str, str] = {}
+        self.fuzzy: Optional[FuzzyKeyIndex] = None
+
+        dated: Dict[Tuple[str, int], List[Tuple[int, int]]] = {}
+        skipped = set(self.paired.values())
+        for pos, rec in enumerate(records):
+            if pos in skipped:
+                continue
+            self._add(self.by_gstin_total, (rec.gstin, rec.total // self.head_width), pos)
+            if rec.date_ordinal is not None:
+                dated.setdefault((rec.gstin, self.tax_band(rec)), []).append((rec.date_ordinal, pos))
+            if not rec.key:
+                continue
+            self._add(self.by_exact_key, rec.exact_key, pos)
+            self._add(self.by_gstin_invoice, (rec.gstin, rec.key), pos)
+            self._add(self.by_invoice, rec.key, pos)
+            self._add(self.by_invoice_amount, (rec.key, self.tax_band(rec)), pos)
+            self._add(self.by_pan_invoice_amount, (self.pan(rec.gstin), rec.key, self.tax_band(rec)), pos)
+
+        for buckets in (self.by_gstin_invoice, self.by_invoice_amount, self.by_pan_invoice_amount):
+            for bucket in buckets.values():
+                if len(bucket) > max_bucket_size:
+                    self._split(bucket)
+
+        for key, entries in dated.items():
+            self.by_gstin_amount_date[key] = DateBucket(entries)
+
+    @staticmethod
+    def _add(buckets: Dict[Hashable, Bucket], key: Hashable, pos: int) -> None:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = Bucket()
+        bucket.positions.append(pos)
+
+    def _split(self, bucket: Bucket) -> None:
+        """Split an oversized bucket by per-head amount bands"""
+        bucket.sub = {}
+        for pos in bucket.positions:
+            self._add(bucket.sub, self.head_bands(self.records[pos]), pos)
+
+    def pan(self, gstin: str) -> str:
+        """PAN of a GSTIN, extracted once per GSTIN per index"""
+        pan = self.pans.get(gstin)
+        if pan is None:
+            pan = self.pans[gstin] = gstin_pan(gstin)
+        return pan
+
+    def tax_band(self, rec: InvoiceRecord) -> int:
+        """Band of the record's GST total"""
+        return (rec.igst + rec.cgst + rec.sgst) // self.band_width
+
+    def head_bands(self, rec: InvoiceRecord) -> Tuple[int, int, int]:
+        """Per-head (IGST, CGST, SGST) bands of the tolerance width"""
+        width = self.head_width
+        return (rec.igst // width, rec.cgst // width, rec.sgst // width)
+
+    def _amount_candidates(
+        self,
+        buckets: Iterable[Bucket],
+        rec: InvoiceRecord,
+        claimed: Sequence[bool]
+    ) -> Iterator[int]:
+        """Unclaimed positions from buckets that may match rec's amounts, in file order"""
+        sources = []
+        neighbours = None
+        for bucket in buckets:
+            if bucket.sub is None:
+                sources.append(bucket)
+                continue
+            if neighbours is None:
+                i, c, s = self.head_bands(rec)
+                neighbours = list(product((i - 1, i, i + 1), (c - 1, c, c + 1), (s - 1, s, s + 1)))
+            sources.extend(bucket.sub[b] for b in neighbours if b in bucket.sub)
+
+        if len(sources) == 1:
+            return sources[0].unclaimed(claimed)
+        return heapq.merge(*(source.unclaimed(claimed) for source in sources))
+
+    def has_invoice(self, key: str) -> bool:
+        """True if any GSTR-2B record carries this invoice key"""
+        return key in self.by_invoice
+
+    def first_identical(
+        self,
+        rec: InvoiceRecord,
+        claimed: Sequence[bool]
+    ) -> Optional[int]:
+        """First unclaimed candidate with an identical exact_key"""
+        bucket = self.by_exact_key.get(rec.exact_key)
+        if bucket is None:
+            return None
+        return next(bucket.unclaimed(claimed), None)
+
+    def first_same_gstin_invoice(
+        self,
+        rec: InvoiceRecord,
+        claimed: Sequence[bool]
+    ) -> Optional[int]:
+        """First unclaimed candidate with the same GSTIN and invoice key"""
+        bucket = self.by_gstin_invoice.get((rec.gstin, rec.key))
+        if bucket is None:
+            return None
+        return next(bucket.unclaimed(claimed), None)
+
+    def same_gstin_invoice(
+        self,
+        rec: InvoiceRecord,
+        claimed: Sequence[bool]
+    ) -> Iterator[int]:
+        """Unclaimed candidates with the same GSTIN and invoice key that may match on amounts"""
+        bucket = self.by_gstin_invoice.get((rec.gstin, rec.key))
+        if bucket is None:
+            return iter(())
+        return self._amount_candidates((bucket,), rec, claimed)
+
+    def same_invoice_amount(
+        self,
+        rec: InvoiceRecord,
+        claimed: Sequence[bool]
+    ) -> Iterator[int]:
+        """Unclaimed candidates with the same invoice key and a compatible GST total"""
+        band = self.tax_band(rec)
+        buckets = [
+            self.by_invoice_amount[(rec.key, b)]
+            for b in (band - 1, band, band + 1)
+            if (rec.key, b) in self.by_invoice_amount
+        ]
+        return self._amount_candidates(buckets, rec, claimed)
+
+    def same_pan_invoice(
+        self,
+        rec: InvoiceRecord,
+        claimed: Sequence[bool]
+    ) -> Iterator[int]:
+        """Unclaimed candidates with the same PAN (any branch), invoice key and a compatible GST total"""
+        pan = self.pan(rec.gstin)
+        band = self.tax_band(rec)
+        buckets = [
+            self.by_pan_invoice_amount[(pan, rec.key, b)]
+            for b in (band - 1, band, band + 1)
+            if (pan, rec.key, b) in self.by_pan_invoice_amount
+        ]
+        return self._amount_candidates(buckets, rec, claimed)
+
+    def same_gstin_date_window(
+        self,
+        rec: InvoiceRecord,
+        days: int,
+        claimed: Sequence[bool]
+    ) -> Iterator[int]:
+        """
+        Unclaimed candidates with the same GSTIN and a compatible GST total,
+        dated within +/- days of rec (any invoice number). Nearest date first,
+        then file order. O(log n) per band plus the size of the window.
+        """
+        if rec.date_ordinal is None:
+            return iter(())
+        band = self.tax_band(rec)
+        found = []
+        for b in (band - 1, band, band + 1):
+            bucket = self.by_gstin_amount_date.get((rec.gstin, b))
+            if bucket is None:
+                continue
+            for i in bucket.window(rec.date_ordinal - days, rec.date_ordinal + days):
+                pos = bucket.positions[i]
+                if not claimed[pos]:
+                    found.append((abs(bucket.ordinals[i] - rec.date_ordinal), pos))
+        found.sort()
+        return (pos for _, pos in found)
+
+    def same_gstin_total(
+        self,
+        rec: InvoiceRecord,
+        claimed: Sequence[bool]
+    ) -> Iterator[int]:
+        """Unclaimed candidates with the same GSTIN whose invoice total may be within tolerance, in file order"""
+        band = rec.total // self.head_width
+        buckets = [
+            self.by_gstin_total[(rec.gstin, b)]
+            for b in (band - 1, band, band + 1)
+            if (rec.gstin, b) in self.by_gstin_total
+        ]
+        return heapq.merge(*(bucket.unclaimed(claimed) for bucket in buckets))
+
+    def similar_invoice(
+        self,
+        rec: InvoiceRecord,
+        claimed: Sequence[bool],
+        thresholds: FuzzyThresholds = DEFAULT_FUZZY_THRESHOLDS
+    ) -> List[int]:
+        """
+        Unclaimed candidates with the same GSTIN and a similar invoice key, in file order.
+        The fuzzy index is built on the first lookup, so it only covers the residue
+        left by the earlier passes.
+        """
+        if self.fuzzy is None:
+            self.fuzzy = FuzzyKeyIndex(
+                self.records, (pos for pos in range(len(self.records)) if not claimed[pos]), thresholds
+            )
+        return self.fuzzy.candidates(rec, claimed)
+
+    def stats(self) -> Dict:
+        """Bucket-size statistics per index, for spotting pathological uploads"""
+        return {
+            "max_bucket_size": self.max_bucket_size,
+            "gstin_invoice": summarize_bucket_sizes(
+                {f"{g}/{k}": len(b) for (g, k), b in self.by_gstin_invoice.items()},
+                self.max_bucket_size
+            ),
+            "invoice": summarize_bucket_sizes(
+                {k: len(b) for k, b in self.by_invoice.items()},
+                self.max_bucket_size
+            ),
+            "invoice_amount": summarize_bucket_sizes(
+                {f"{k}@{band}": len(b) for (k, band), b in self.by_invoice_amount.items()},
+                self.max_bucket_size
+            ),
+        }
+
+
+def summarize_bucket_sizes(sizes: Dict[str, int], max_bucket_size: int, top: int = 5) -> Dict:
+    """Summarize bucket sizes: count, largest, mean, oversized count and the largest keys"""
+    if not sizes:
+        return {"buckets": 0, "largest": 0, "mean": 0, "oversized": 0, "top": []}
+    total = sum(sizes.values())
+    largest = heapq.nsmallest(top, sizes.items(), key=lambda item: (-item[1], item[0]))
+    return {
+        "buckets": len(sizes),
+        "largest": largest[0][1],
+        "mean": round(total / len(sizes), 2),
+        "oversized": sum(1 for size in sizes.values() if size > max_bucket_size),
+        "top": [{"key": key, "size": size} for key, size in largest],
+    }
+
+
+def merge_bucket_stats(stats_list: List[Dict], top: int = 5) -> Dict:
+    """
+    Combine CandidateIndex.stats() from independently indexed shards.
+    Buckets are counted per shard, so a key present in two shards counts twice.
+    """
+    if not stats_list:
+        return {}
+    merged: Dict = {"max_bucket_size": stats_list[0]["max_bucket_size"]}
+    for name in ("gstin_invoice", "invoice", "invoice_amount"):
+        parts = [stats[name] for stats in stats_list if stats[name]["buckets"]]
+        buckets = sum(part["buckets"] for part in parts)
+        if not buckets:
+            merged[name] = summarize_bucket_sizes({}, merged["max_bucket_size"])
+            continue
+        largest = heapq.nsmallest(
+            top,
+            (item for part in parts for item in part["top"]),
+            key=lambda item: (-item["size"], item["key"])
+        )
+        merged[name] = {
+            "buckets": buckets,
+            "largest": largest[0]["size"],
+            "mean": round(sum(part["mean"] * part["buckets"] for part in parts) / buckets, 2),
+            "oversized": sum(part["oversized"] for part in parts),
+            "top": largest,
+        }
+    return merged
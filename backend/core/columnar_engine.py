@@ -0,0 +1,530 @@
+"""
+Columnar GST Reconciliation Engine
+Vectorized (NumPy) variant of the deterministic rule set for large registers
+"""
+from typing import List, Dict, Tuple, Optional, Iterator
+import numpy as np
+
+from core.reconciliation_engine import (
+    ReconciliationEngine, ReconciliationContext, MatchResult, MatchStatus, ITC_HEADS
+)
+from core.invoice_record import InvoiceRecord
+from core.parallel_engine import ParallelReconciliationEngine, PARALLEL_MIN_ROWS
+from core.external_engine import ExternalReconciliationEngine, IN_MEMORY_ROW_BYTES
+from core.candidate_index import CandidateIndex, summarize_bucket_sizes
+from core.rule_profile import RuleProfile, profile_engine
+
+
+# Below this many invoices (both sides combined) the row engine is faster
+COLUMNAR_MIN_ROWS = 5000
+
+AMOUNT_FIELDS = ("taxable", "igst", "cgst", "sgst", "cess", "total_tax")
+
+
+class InvoiceColumns:
+    """Column-oriented view of one side of the reconciliation"""
+
+    def __init__(self, records: List[InvoiceRecord]):
+        self.ids = [rec.id for rec in records]
+        self.keys = np.array([rec.key for rec in records], dtype=object)
+        self.gstins = np.array([rec.gstin for rec in records], dtype=object)
+        self.gstin_keys = np.array([rec.gstin + "|" + rec.key for rec in records], dtype=object)
+        # Date ordinals, 0 where the date is missing
+        self.dates = np.array([rec.date_ordinal or 0 for rec in records], dtype=np.int64)
+        # Integer paise for exact tolerance checks and diffs
+        self.paise: Dict[str, np.ndarray] = {
+            field: np.array([getattr(rec, field) for rec in records], dtype=np.int64)
+            for field in AMOUNT_FIELDS
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class ColumnarReconciliationEngine(ReconciliationEngine):
+    """
+    Columnar GST Reconciliation Engine
+
+    Applies the same rule passes and confidence scores as ReconciliationEngine, but:
+    - Normalizes keys and amounts once into NumPy arrays
+    - Joins PR and GSTR-2B on the rule's key in bulk (sort + searchsorted)
+    - Evaluates tax-head diffs and tolerance checks as array operations
+
+    Identical invoices are paired first by hashing the full normalized tuple.
+    Joins are limited to neighbouring GST-total bands, and first-unclaimed
+    rules pair groups by rank instead of by cross product, so skewed invoice
+    numbers do not blow up the number of candidate pairs.
+
+    Only PR invoices competing for the same GSTR-2B invoice are resolved
+    in a Python loop, preserving the row engine's first-come pairing.
+    Rules without a vectorized pass (VECTOR_PASSES) run with the row
+    engine's finder over the residue.
+    """
+
+    @staticmethod
+    def _factorize(pr_values: np.ndarray, gstr2b_values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Integer codes for a key column, shared by both sides"""
+        _, codes = np.unique(np.concatenate([pr_values, gstr2b_values]), return_inverse=True)
+        codes = codes.astype(np.int64)
+        return codes[:len(pr_values)], codes[len(pr_values):]
+
+    @staticmethod
+    def _factorize_rows(pr_rows: np.ndarray, gstr2b_rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Integer codes for a multi-column (2-D int64) key, shared by both sides"""
+        both = np.concatenate([pr_rows, gstr2b_rows])
+        if len(both) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        _, codes = np.unique(both, axis=0, return_inverse=True)
+        codes = codes.reshape(-1).astype(np.int64)
+        return codes[:len(pr_rows)], codes[len(pr_rows):]
+
+    def _join(
+        self,
+        pr_keys: np.ndarray,
+        gstr2b_keys: np.ndarray,
+        pr_rows: np.ndarray,
+        gstr2b_rows: np.ndarray,
+        offsets: Tuple[int, ...] = (0,)
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Join the given PR rows with the given GSTR-2B rows on an integer key,
+        matching each PR key + offset for every offset (band neighbours).
+        Returns (pr_idx, gstr2b_idx), ordered by PR row then GSTR-2B file order.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if len(pr_rows) == 0 or len(gstr2b_rows) == 0:
+            return empty, empty
+
+        # Stable sort keeps GSTR-2B file order inside each key group
+        gstr2b_order = np.argsort(gstr2b_keys[gstr2b_rows], kind="stable")
+        sorted_keys = gstr2b_keys[gstr2b_rows][gstr2b_order]
+
+        pr_parts, gstr2b_parts = [], []
+        for offset in offsets:
+            probe = pr_keys[pr_rows] + offset
+            starts = np.searchsorted(sorted_keys, probe, side="left")
+            counts = np.searchsorted(sorted_keys, probe, side="right") - starts
+            within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            pr_parts.append(np.repeat(pr_rows, counts))
+            gstr2b_parts.append(gstr2b_rows[gstr2b_order[np.repeat(starts, counts) + within]])
+
+        pr_idx = np.concatenate(pr_parts)
+        gstr2b_idx = np.concatenate(gstr2b_parts)
+        if len(offsets) > 1:
+            order = np.lexsort((gstr2b_idx, pr_idx))
+            pr_idx, gstr2b_idx = pr_idx[order], gstr2b_idx[order]
+        return pr_idx, gstr2b_idx
+
+    def _banded_keys(
+        self,
+        pr_codes: np.ndarray,
+        gstr2b_codes: np.ndarray,
+        pr_bands: np.ndarray,
+        gstr2b_bands: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Combine a key code with an amount band into one int64 key.
+        Bands are padded so that band +/- 1 never spills into the next code.
+        """
+        all_bands = np.concatenate([pr_bands, gstr2b_bands])
+        if len(all_bands) == 0:
+            return pr_codes, gstr2b_codes
+        low = all_bands.min()
+        span = int(all_bands.max() - low) + 3
+        return (
+            pr_codes * span + (pr_bands - low + 1),
+            gstr2b_codes * span + (gstr2b_bands - low + 1),
+        )
+
+    def _rank_within(self, codes: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """0-based position of each row among rows sharing its code (file order)"""
+        ranks = np.empty(len(rows), dtype=np.int64)
+        if len(rows) == 0:
+            return ranks
+        order = np.argsort(codes[rows], kind="stable")
+        sorted_codes = codes[rows][order]
+        group_start = np.searchsorted(sorted_codes, sorted_codes, side="left")
+        ranks[order] = np.arange(len(rows)) - group_start
+        return ranks
+
+    def _join_by_rank(
+        self,
+        pr_codes: np.ndarray,
+        gstr2b_codes: np.ndarray,
+        pr_rows: np.ndarray,
+        gstr2b_rows: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pair rows sharing a code when every PR row takes the first unclaimed
+        GSTR-2B row of its group: the k-th PR row pairs with the k-th GSTR-2B
+        row, i.e. a 1:1 join on (code, rank).
+        """
+        pr_ranked = np.zeros(len(pr_codes), dtype=np.int64)
+        gstr2b_ranked = np.zeros(len(gstr2b_codes), dtype=np.int64)
+        pr_ranked[pr_rows] = self._rank_within(pr_codes, pr_rows)
+        gstr2b_ranked[gstr2b_rows] = self._rank_within(gstr2b_codes, gstr2b_rows)
+        pr_keys, gstr2b_keys = self._banded_keys(pr_codes, gstr2b_codes, pr_ranked, gstr2b_ranked)
+        return self._join(pr_keys, gstr2b_keys, pr_rows, gstr2b_rows)
+
+    def _amounts_match_vec(
+        self,
+        a1: np.ndarray,
+        a2: np.ndarray,
+        use_percentage: bool = False
+    ) -> np.ndarray:
+        """Vectorized paise_match"""
+        diff = np.abs(a1 - a2)
+        within = diff <= self.AMOUNT_TOLERANCE_PAISE
+
+        if use_percentage:
+            threshold = self.PERCENTAGE_THRESHOLD_PAISE
+            large = (a1 > threshold) | (a2 > threshold)
+            max_val = np.maximum(a1, a2)
+            within = np.where(
+                large, diff * 10000 <= max_val * self.PERCENTAGE_TOLERANCE_BPS, within
+            )
+
+        return within
+
+    def _all_amounts_match_vec(
+        self,
+        pr: InvoiceColumns,
+        gstr2b: InvoiceColumns,
+        pr_idx: np.ndarray,
+        gstr2b_idx: np.ndarray
+    ) -> np.ndarray:
+        """Vectorized all_amounts_match per candidate pair"""
+        matches = self._amounts_match_vec(
+            pr.paise["taxable"][pr_idx],
+            gstr2b.paise["taxable"][gstr2b_idx],
+            use_percentage=True
+        )
+        for field in ("igst", "cgst", "sgst"):
+            matches &= self._amounts_match_vec(
+                pr.paise[field][pr_idx],
+                gstr2b.paise[field][gstr2b_idx]
+            )
+        return matches
+
+    def _resolve_pairs(
+        self,
+        pr_idx: np.ndarray,
+        gstr2b_idx: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pair each PR invoice with its first unclaimed candidate.
+        Candidates must be ordered by PR row, then GSTR-2B file order.
+        Returns (pr rows, gstr2b rows) of the chosen pairs, in PR order.
+        """
+        if len(pr_idx) == 0:
+            return pr_idx, gstr2b_idx
+
+        # A GSTR-2B invoice is contested if it is a candidate of several PR invoices
+        _, gstr2b_inverse, gstr2b_counts = np.unique(
+            gstr2b_idx, return_inverse=True, return_counts=True
+        )
+        contested = gstr2b_counts[gstr2b_inverse] > 1
+        contested_pr = np.unique(pr_idx[contested])
+        in_contest = np.isin(pr_idx, contested_pr)
+
+        # Uncontested PR invoices simply take their first candidate
+        first = np.ones(len(pr_idx), dtype=bool)
+        first[1:] = pr_idx[1:] != pr_idx[:-1]
+        simple = first & ~in_contest
+        chosen_pr = [pr_idx[simple]]
+        chosen_gstr2b = [gstr2b_idx[simple]]
+
+        # Contested PR invoices claim candidates first-come, in PR order
+        claimed = set()
+        done_pr = -1
+        loop_pr, loop_gstr2b = [], []
+        for p, g in zip(pr_idx[in_contest].tolist(), gstr2b_idx[in_contest].tolist()):
+            if p == done_pr or g in claimed:
+                continue
+            claimed.add(g)
+            loop_pr.append(p)
+            loop_gstr2b.append(g)
+            done_pr = p
+        chosen_pr.append(np.array(loop_pr, dtype=np.int64))
+        chosen_gstr2b.append(np.array(loop_gstr2b, dtype=np.int64))
+
+        pr_rows = np.concatenate(chosen_pr)
+        gstr2b_rows = np.concatenate(chosen_gstr2b)
+        order = np.argsort(pr_rows, kind="stable")
+        return pr_rows[order], gstr2b_rows[order]
+
+    def _pair_results(
+        self,
+        status: MatchStatus,
+        pr: InvoiceColumns,
+        gstr2b: InvoiceColumns,
+        pr_rows: np.ndarray,
+        gstr2b_rows: np.ndarray,
+        rule: Optional[Tuple[float, str]] = None
+    ) -> List[MatchResult]:
+        """Build MatchResults for resolved pairs, diffs computed column-wise"""
+        confidence, rule = rule or self.RULES[status]
+        diffs = [
+            (pr.paise[field][pr_rows] - gstr2b.paise[field][gstr2b_rows]) / 100
+            for field in ("taxable", "igst", "cgst", "sgst")
+        ]
+        diffs.append((
+            (pr.paise["taxable"][pr_rows] + pr.paise["total_tax"][pr_rows])
+            - (gstr2b.paise["taxable"][gstr2b_rows] + gstr2b.paise["total_tax"][gstr2b_rows])
+        ) / 100)
+
+        return [
+            MatchResult(
+                status=status,
+                pr_invoice_id=pr.ids[p],
+                gstr2b_invoice_id=gstr2b.ids[g],
+                confidence_score=confidence,
+                match_rule=rule,
+                taxable_diff=taxable_diff,
+                igst_diff=igst_diff,
+                cgst_diff=cgst_diff,
+                sgst_diff=sgst_diff,
+                total_diff=total_diff,
+            )
+            for p, g, taxable_diff, igst_diff, cgst_diff, sgst_diff, total_diff in zip(
+                pr_rows.tolist(), gstr2b_rows.tolist(), *(d.tolist() for d in diffs)
+            )
+        ]
+
+    def _bucket_stats(
+        self,
+        gstr2b: InvoiceColumns,
+        primary: np.ndarray,
+        key: np.ndarray,
+        band: np.ndarray,
+        rows_mask: np.ndarray
+    ) -> Dict:
+        """Same statistics as CandidateIndex.stats, from group counts"""
+        rows = np.nonzero(rows_mask)[0]
+
+        def sizes(labels: List[str], codes: np.ndarray) -> Dict[str, int]:
+            _, first, counts = np.unique(codes, return_index=True, return_counts=True)
+            return {labels[i]: int(n) for i, n in zip(first.tolist(), counts.tolist())}
+
+        keys = gstr2b.keys[rows].tolist()
+        gstin_keys = gstr2b.gstin_keys[rows].tolist()
+        bands = band[rows].tolist()
+        _, amount_codes = self._banded_keys(key[rows], key[rows], band[rows], band[rows])
+        return {
+            "max_bucket_size": self.MAX_BUCKET_SIZE,
+            "gstin_invoice": summarize_bucket_sizes(
+                sizes([k.replace("|", "/", 1) for k in gstin_keys], primary[rows]), self.MAX_BUCKET_SIZE
+            ),
+            "invoice": summarize_bucket_sizes(sizes(keys, key[rows]), self.MAX_BUCKET_SIZE),
+            "invoice_amount": summarize_bucket_sizes(
+                sizes([f"{k}@{b}" for k, b in zip(keys, bands)], amount_codes), self.MAX_BUCKET_SIZE
+            ),
+        }
+
+    def _dates_match_vec(
+        self,
+        pr: InvoiceColumns,
+        gstr2b: InvoiceColumns,
+        pr_idx: np.ndarray,
+        gstr2b_idx: np.ndarray
+    ) -> np.ndarray:
+        """Vectorized dates_match per candidate pair (0 = missing date)"""
+        pr_dates = pr.dates[pr_idx]
+        gstr2b_dates = gstr2b.dates[gstr2b_idx]
+        return (
+            (pr_dates == 0) | (gstr2b_dates == 0)
+            | (np.abs(pr_dates - gstr2b_dates) <= self.DATE_TOLERANCE_DAYS)
+        )
+
+    # ============================================
+    # VECTORIZED RULE PASSES
+    # ============================================
+
+    def _vec_identical(self, run: "ColumnarRun") -> Tuple[np.ndarray, np.ndarray]:
+        """Rule 1 fast path: identical (GSTIN, invoice key, date, amounts) tuples, paired by rank"""
+        pr, gstr2b = run.pr, run.gstr2b
+        fields = ("taxable", "igst", "cgst", "sgst")
+        pr_exact, gstr2b_exact = self._factorize_rows(
+            np.column_stack([run.pr_primary, pr.dates] + [pr.paise[f] for f in fields]),
+            np.column_stack([run.gstr2b_primary, gstr2b.dates] + [gstr2b.paise[f] for f in fields])
+        )
+        pr_rows, gstr2b_rows = self._join_by_rank(pr_exact, gstr2b_exact, *run.open_rows())
+
+        # Pairs settled by the balanced-vendor pre-pass belong to this rule, in PR order
+        pr_rows = np.concatenate([run.paired_pr, pr_rows])
+        gstr2b_rows = np.concatenate([run.paired_gstr2b, gstr2b_rows])
+        order = np.argsort(pr_rows, kind="stable")
+        return pr_rows[order], gstr2b_rows[order]
+
+    def _vec_exact(self, run: "ColumnarRun") -> Tuple[np.ndarray, np.ndarray]:
+        """Rule 1: GSTIN + invoice key + band neighbours, amounts within tolerance, dates within the window"""
+        pr_idx, gstr2b_idx = self._join(
+            run.pr_primary_banded, run.gstr2b_primary_banded, *run.open_rows(), offsets=(-1, 0, 1)
+        )
+        keep = (
+            self._all_amounts_match_vec(run.pr, run.gstr2b, pr_idx, gstr2b_idx)
+            & self._dates_match_vec(run.pr, run.gstr2b, pr_idx, gstr2b_idx)
+        )
+        return self._resolve_pairs(pr_idx[keep], gstr2b_idx[keep])
+
+    def _vec_date_mismatch(self, run: "ColumnarRun") -> Tuple[np.ndarray, np.ndarray]:
+        """Rule 2: GSTIN + invoice key + band neighbours, amounts within tolerance, any date"""
+        pr_idx, gstr2b_idx = self._join(
+            run.pr_primary_banded, run.gstr2b_primary_banded, *run.open_rows(), offsets=(-1, 0, 1)
+        )
+        keep = self._all_amounts_match_vec(run.pr, run.gstr2b, pr_idx, gstr2b_idx)
+        return self._resolve_pairs(pr_idx[keep], gstr2b_idx[keep])
+
+    def _vec_amount_mismatch(self, run: "ColumnarRun") -> Tuple[np.ndarray, np.ndarray]:
+        """Rule 3: first unclaimed row of the same GSTIN + invoice key"""
+        return self._join_by_rank(run.pr_primary, run.gstr2b_primary, *run.open_rows())
+
+    def _vec_gstin_mismatch(self, run: "ColumnarRun") -> Tuple[np.ndarray, np.ndarray]:
+        """Rule 5: invoice key + band neighbours, amounts within tolerance, GSTIN differs"""
+        pr_banded, gstr2b_banded = self._banded_keys(run.pr_key, run.gstr2b_key, run.pr_band, run.gstr2b_band)
+        pr_idx, gstr2b_idx = self._join(pr_banded, gstr2b_banded, *run.open_rows(), offsets=(-1, 0, 1))
+        keep = (
+            (run.pr.gstins[pr_idx] != run.gstr2b.gstins[gstr2b_idx])
+            & self._all_amounts_match_vec(run.pr, run.gstr2b, pr_idx, gstr2b_idx)
+        )
+        return self._resolve_pairs(pr_idx[keep], gstr2b_idx[keep])
+
+    # Vectorized implementation per RULE_PASSES finder; other rules run row-wise on the residue
+    VECTOR_PASSES = {
+        "find_identical": _vec_identical,
+        "find_exact": _vec_exact,
+        "find_date_mismatch": _vec_date_mismatch,
+        "find_amount_mismatch": _vec_amount_mismatch,
+        "find_gstin_mismatch": _vec_gstin_mismatch,
+    }
+
+    def _row_pass(self, run: "ColumnarRun", pass_no: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Run one RULE_PASSES entry with the row engine's finder over the open rows"""
+        pr_rows = np.nonzero(run.pr_open)[0]
+        gstr2b_rows = np.nonzero(run.gstr2b_open)[0]
+        index = CandidateIndex(
+            [run.gstr2b_records[i] for i in gstr2b_rows.tolist()],
+            self.AMOUNT_TOLERANCE_PAISE,
+            self.MAX_BUCKET_SIZE
+        )
+        claimed = [False] * len(gstr2b_rows)
+        row_of = {run.pr_records[i].id: i for i in pr_rows.tolist()}
+        pairs = list(self.iter_passes([pass_no], [run.pr_records[i] for i in pr_rows.tolist()], index, claimed))
+        return (
+            np.array([row_of[pr_rec.id] for _, pr_rec, _ in pairs], dtype=np.int64),
+            gstr2b_rows[np.array([pos for _, _, pos in pairs], dtype=np.int64)],
+        )
+
+    def iter_matches(
+        self,
+        pr_records: List[InvoiceRecord],
+        gstr2b_records: List[InvoiceRecord],
+        context: ReconciliationContext
+    ) -> Iterator[MatchResult]:
+        """
+        Columnar rule passes, yielding each rule's results once it is resolved.
+        Same output (order, statuses, scores, diffs) as ReconciliationEngine.iter_matches.
+        """
+        paired = self.balanced_vendor_pairs(pr_records, gstr2b_records, context)
+        run = ColumnarRun(self, pr_records, gstr2b_records, paired)
+        pr, gstr2b = run.pr, run.gstr2b
+
+        context.bucket_stats = self._bucket_stats(
+            gstr2b, run.gstr2b_primary, run.gstr2b_key, run.gstr2b_band, run.gstr2b_keyed & run.gstr2b_open
+        )
+
+        for pass_no, (status, finder, _, rule) in enumerate(self.RULE_PASSES):
+            vector_pass = self.VECTOR_PASSES.get(finder)
+            if vector_pass is not None:
+                pr_rows, gstr2b_rows = vector_pass(self, run)
+            else:
+                pr_rows, gstr2b_rows = self._row_pass(run, pass_no)
+
+            run.pr_open[pr_rows] = False
+            run.gstr2b_open[gstr2b_rows] = False
+            results = self._pair_results(status, pr, gstr2b, pr_rows, gstr2b_rows, rule)
+            for result in results:
+                context.record_match(result)
+            context.totals.add_pair_amounts(
+                status, len(results), {head: int(gstr2b.paise[head][gstr2b_rows].sum()) for head in ITC_HEADS}
+            )
+            yield from results
+
+        yield from self.split_results(
+            [run.pr_records[i] for i in np.nonzero(run.pr_open)[0].tolist()],
+            [run.gstr2b_records[i] for i in np.nonzero(run.gstr2b_open)[0].tolist()],
+            context
+        )
+        yield from self.unmatched_results(pr.ids, gstr2b.ids, context)
+
+
+class ColumnarRun:
+    """Columns, key codes and open-row masks shared by the passes of one columnar run"""
+
+    def __init__(
+        self,
+        engine: ColumnarReconciliationEngine,
+        pr_records: List[InvoiceRecord],
+        gstr2b_records: List[InvoiceRecord],
+        paired: Optional[Dict[str, int]] = None
+    ):
+        self.pr_records = pr_records
+        self.gstr2b_records = gstr2b_records
+        self.pr = InvoiceColumns(pr_records)
+        self.gstr2b = InvoiceColumns(gstr2b_records)
+
+        self.pr_key, self.gstr2b_key = engine._factorize(self.pr.keys, self.gstr2b.keys)
+        self.pr_primary, self.gstr2b_primary = engine._factorize(self.pr.gstin_keys, self.gstr2b.gstin_keys)
+
+        # GST total band, as in CandidateIndex: matching amounts are at most one band apart
+        band_width = 3 * max(engine.AMOUNT_TOLERANCE_PAISE, 1)
+        self.pr_band = (self.pr.paise["igst"] + self.pr.paise["cgst"] + self.pr.paise["sgst"]) // band_width
+        self.gstr2b_band = (
+            self.gstr2b.paise["igst"] + self.gstr2b.paise["cgst"] + self.gstr2b.paise["sgst"]
+        ) // band_width
+        self.pr_primary_banded, self.gstr2b_primary_banded = engine._banded_keys(
+            self.pr_primary, self.gstr2b_primary, self.pr_band, self.gstr2b_band
+        )
+
+        # Key-based rules only consider rows with an invoice number
+        self.pr_keyed = self.pr.keys != ""
+        self.gstr2b_keyed = self.gstr2b.keys != ""
+        self.pr_open = np.ones(len(self.pr), dtype=bool)
+        self.gstr2b_open = np.ones(len(self.gstr2b), dtype=bool)
+
+        # Pairs from the balanced-vendor pre-pass skip the rule passes
+        paired = paired or {}
+        self.paired_pr = np.array([i for i, rec in enumerate(pr_records) if rec.id in paired], dtype=np.int64)
+        self.paired_gstr2b = np.array([paired[pr_records[i].id] for i in self.paired_pr.tolist()], dtype=np.int64)
+        self.pr_open[self.paired_pr] = False
+        self.gstr2b_open[self.paired_gstr2b] = False
+
+    def open_rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Unmatched rows that carry an invoice number, per side"""
+        return (
+            np.nonzero(self.pr_open & self.pr_keyed)[0],
+            np.nonzero(self.gstr2b_open & self.gstr2b_keyed)[0],
+        )
+
+
+def select_engine(
+    pr_count: int,
+    gstr2b_count: int,
+    workers: int = 0,
+    memory_budget_mb: int = 0,
+    spill_dir: Optional[str] = None,
+    profile: Optional[RuleProfile] = None
+) -> ReconciliationEngine:
+    """
+    Pick the row, columnar or process-parallel engine based on input size,
+    or the out-of-core engine when matching in memory would exceed the budget (0 = no limit).
+    With a client rule profile, the engine is that class compiled for the profile.
+    """
+    if memory_budget_mb and (pr_count + gstr2b_count) * IN_MEMORY_ROW_BYTES > memory_budget_mb * 1024 * 1024:
+        return profile_engine(profile, ExternalReconciliationEngine, memory_budget_mb, spill_dir)
+    if workers > 1 and pr_count + gstr2b_count >= PARALLEL_MIN_ROWS:
+        return profile_engine(profile, ParallelReconciliationEngine, workers)
+    if pr_count + gstr2b_count >= COLUMNAR_MIN_ROWS:
+        return profile_engine(profile, ColumnarReconciliationEngine)
+    return profile_engine(profile, ReconciliationEngine)
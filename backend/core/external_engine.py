@@ -0,0 +1,291 @@
+"""
+Out-of-Core Reconciliation Engine
+Sort-merge reconciliation over on-disk sorted runs for registers larger than memory
+"""
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Callable
+from dataclasses import fields
+from itertools import groupby
+from operator import attrgetter, itemgetter
+import heapq
+import os
+import pickle
+import tempfile
+
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext, MatchResult
+from core.invoice_record import InvoiceRecord, RecordBuilder, gstin_pan
+from core.candidate_index import CandidateIndex, merge_bucket_stats
+
+
+# Rough in-memory cost of one invoice in the row / columnar engines
+# (parsed dict, record, index entries, result), used to pick this engine
+IN_MEMORY_ROW_BYTES = 2048
+
+# Rough cost of one buffered row (sort key + record fields) before it is spilled
+SPILL_ROW_BYTES = 512
+
+# Sort buffers that can be filling at the same time (stage being read, next stage, results)
+SPILL_BUFFERS = 3
+
+# Smallest run worth writing, whatever the budget
+MIN_RUN_ROWS = 10000
+
+# Rows per pickled chunk in a run file; reading a run holds one chunk
+SPILL_CHUNK_ROWS = 4096
+
+# Smallest batch of partitions reconciled together, whatever the budget
+MIN_BATCH_ROWS = 5000
+
+# Runs merged at once; more runs are first merged into larger runs
+MERGE_FAN_IN = 64
+
+_RECORD_FIELDS = attrgetter(*(f.name for f in fields(InvoiceRecord)))
+
+
+class SpillSorter:
+    """
+    External sort of tuples: rows are buffered, the buffer is sorted and
+    written to a run file whenever it reaches `run_rows`, and iteration
+    k-way merges the runs. Rows must compare by a unique leading part
+    (e.g. side + position), so payloads are never compared.
+    """
+
+    def __init__(self, run_rows: int, directory: str):
+        self.run_rows = run_rows
+        self.directory = directory
+        self.buffer: List[Tuple] = []
+        self.runs: List[str] = []
+
+    def add(self, row: Tuple) -> None:
+        self.buffer.append(row)
+        if len(self.buffer) >= self.run_rows:
+            self._spill()
+
+    def __iter__(self) -> Iterator[Tuple]:
+        """Rows in sorted order; run files are deleted as they are consumed"""
+        if not self.runs:
+            self.buffer.sort()
+            rows, self.buffer = self.buffer, []
+            yield from rows
+            return
+        self._spill()
+        while len(self.runs) > MERGE_FAN_IN:
+            batch, self.runs = self.runs[:MERGE_FAN_IN], self.runs[MERGE_FAN_IN:]
+            self.runs.append(self._write(heapq.merge(*(self._read(path) for path in batch))))
+        runs, self.runs = self.runs, []
+        yield from heapq.merge(*(self._read(path) for path in runs))
+
+    def _spill(self) -> None:
+        if self.buffer:
+            self.buffer.sort()
+            self.runs.append(self._write(self.buffer))
+            self.buffer = []
+
+    def _write(self, rows: Iterable[Tuple]) -> str:
+        fd, path = tempfile.mkstemp(suffix=".run", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= SPILL_CHUNK_ROWS:
+                    pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+            if chunk:
+                pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+        return path
+
+    @staticmethod
+    def _read(path: str) -> Iterator[Tuple]:
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        chunk = pickle.load(f)
+                    except EOFError:
+                        return
+                    yield from chunk
+        finally:
+            os.remove(path)
+
+
+class ExternalReconciliationEngine(ReconciliationEngine):
+    """
+    Reconciliation with memory bounded by `memory_budget_mb` plus the
+    largest single partition, for registers that do not fit in memory.
+
+    Records are normalized as they stream in and written to sorted runs on
+    disk. The rule passes are cut into stages of consecutive passes with
+    the same scope, and each stage is a merge join over runs sorted by its
+    partition key, holding a batch of whole partitions in memory at a time:
+
+    - vendor-scoped passes: partitioned by vendor PAN (which covers every
+      GSTIN of the PAN, for the cross-branch rule)
+    - cross-vendor passes (GSTIN_MISMATCH pairs on the invoice number):
+      partitioned by invoice key
+
+    The residue of each stage is spilled, sorted by the next stage's key.
+    The first stage also splits off duplicates and runs the balanced-vendor
+    pre-pass; the last one also runs split matching and emits PR_ONLY /
+    GSTR2B_ONLY. Partitions never compete for candidates, so every result
+    is the one the in-memory engine produces; results are spilled with
+    their (phase, pass, file position) and merged back into its order.
+
+    Run state is accumulated in the context as usual, except the matched
+    id sets, which would grow with the registers.
+    """
+
+    def __init__(self, memory_budget_mb: int, spill_dir: Optional[str] = None):
+        self.memory_budget_mb = memory_budget_mb
+        self.spill_dir = spill_dir
+
+    @property
+    def run_rows(self) -> int:
+        """Rows each sort buffer holds before spilling a run (half the budget, split across the buffers)"""
+        budget = self.memory_budget_mb * 1024 * 1024 // 2
+        return max(MIN_RUN_ROWS, budget // (SPILL_ROW_BYTES * SPILL_BUFFERS))
+
+    @property
+    def batch_rows(self) -> int:
+        """Rows of whole partitions reconciled together in memory (the other half of the budget)"""
+        budget = self.memory_budget_mb * 1024 * 1024 // 2
+        return max(MIN_BATCH_ROWS, budget // IN_MEMORY_ROW_BYTES)
+
+    def reconcile_iter(
+        self,
+        pr_invoices: Iterable[Dict],
+        gstr2b_invoices: Iterable[Dict],
+        context: Optional[ReconciliationContext] = None
+    ) -> Iterator[MatchResult]:
+        """
+        Same results, in the same order, as ReconciliationEngine.reconcile_iter.
+        The invoices may be any iterables (e.g. paged database reads); each is
+        consumed once. Results are yielded once every stage has finished.
+        """
+        context = context if context is not None else ReconciliationContext()
+        stages = self.stages()
+        pans: Dict[str, str] = {}
+
+        with tempfile.TemporaryDirectory(prefix="reconcile-", dir=self.spill_dir) as directory:
+            results = SpillSorter(self.run_rows, directory)
+            stage_rows = SpillSorter(self.run_rows, directory)
+            for side, invoices in enumerate((pr_invoices, gstr2b_invoices)):
+                side_totals = (context.totals.pr_totals, context.totals.gstr2b_totals)[side]
+                for pos, invoice in enumerate(invoices):
+                    # Fresh builder per run, so normalization caches stay within the budget
+                    if pos % self.run_rows == 0:
+                        builder = RecordBuilder()
+                    rec = builder.build(invoice)
+                    context.totals.add_records(side_totals, (rec,))
+                    stage_rows.add((self._pan(rec.gstin, pans), side, pos, _RECORD_FIELDS(rec)))
+
+            for stage_no, (vendor_scoped, pass_numbers) in enumerate(stages):
+                first, last = stage_no == 0, stage_no == len(stages) - 1
+                next_rows = None if last else SpillSorter(self.run_rows, directory)
+                next_key = None if last else self._partition_key(stages[stage_no + 1][0], pans)
+
+                # Partitions are independent, so small ones are reconciled together
+                pr: List[Tuple[int, InvoiceRecord]] = []
+                gstr2b: List[Tuple[int, InvoiceRecord]] = []
+                for partition, rows in groupby(stage_rows, key=itemgetter(0)):
+                    # Records without an invoice number never pair on it
+                    if not vendor_scoped and partition == "":
+                        for _, side, pos, values in rows:
+                            next_rows.add((next_key(values), side, pos, values))
+                        continue
+                    for _, side, pos, values in rows:
+                        (gstr2b if side else pr).append((pos, InvoiceRecord(*values)))
+                    if len(pr) + len(gstr2b) >= self.batch_rows:
+                        self._reconcile_batch(pass_numbers, pr, gstr2b, first, results, next_rows, next_key, context)
+                        pr, gstr2b = [], []
+                if pr or gstr2b:
+                    self._reconcile_batch(pass_numbers, pr, gstr2b, first, results, next_rows, next_key, context)
+                stage_rows = next_rows
+
+            for row in results:
+                yield row[-1]
+
+    def _reconcile_batch(
+        self,
+        pass_numbers: List[int],
+        pr: List[Tuple[int, InvoiceRecord]],
+        gstr2b: List[Tuple[int, InvoiceRecord]],
+        first: bool,
+        results: SpillSorter,
+        next_rows: Optional[SpillSorter],
+        next_key: Optional[Callable[[Tuple], str]],
+        context: ReconciliationContext
+    ) -> None:
+        """
+        Run one stage over a batch of whole partitions (records with their
+        global positions, in file order per batch). Results are spilled
+        tagged for the final merge; the residue goes to the next stage, or
+        is reported unmatched after split matching in the last stage.
+        """
+        batch = ReconciliationContext()
+        pr_positions = {rec.id: pos for pos, rec in pr}
+        gstr2b_positions = {rec.id: pos for pos, rec in gstr2b}
+        pr_records = [rec for _, rec in pr]
+        gstr2b_records = [rec for _, rec in gstr2b]
+        paired = None
+
+        if first:
+            # Duplicate groups and vendor periods share a GSTIN, so they never span partitions
+            pr_records, pr_duplicates = self.split_duplicates(pr_records)
+            gstr2b_records, gstr2b_duplicates = self.split_duplicates(gstr2b_records)
+            for result in self.duplicate_results(pr_duplicates, gstr2b_duplicates, batch):
+                if result.pr_invoice_id:
+                    results.add((3, 0, pr_positions[result.pr_invoice_id], 0, result))
+                else:
+                    results.add((3, 1, gstr2b_positions[result.gstr2b_invoice_id], 0, result))
+            paired = self.balanced_vendor_pairs(pr_records, gstr2b_records, batch)
+            context.vendors.update(batch.vendors)
+
+        claimed = [False] * len(gstr2b_records)
+        if gstr2b_records:
+            index = CandidateIndex(gstr2b_records, self.AMOUNT_TOLERANCE_PAISE, self.MAX_BUCKET_SIZE, paired)
+            if first:
+                stats = index.stats()
+                context.bucket_stats = merge_bucket_stats([context.bucket_stats, stats]) if context.bucket_stats else stats
+            for pass_no, pr_rec, pos in self.iter_passes(pass_numbers if pr_records else (), pr_records, index, claimed):
+                result = self.pass_result(pass_no, pr_rec, gstr2b_records[pos])
+                batch.record_match(result, gstr2b_records[pos])
+                results.add((0, pass_no, pr_positions[pr_rec.id], 0, result))
+
+        pr_residue = [rec for rec in pr_records if rec.id not in batch.matched_pr_ids]
+        gstr2b_residue = [rec for pos, rec in enumerate(gstr2b_records) if not claimed[pos]]
+
+        if next_rows is None:
+            for group in self.split_groups(pr_residue, gstr2b_residue):
+                side, single_pos = (0, pr_positions[group.single.id]) if group.single_is_pr else (
+                    1, gstr2b_positions[group.single.id]
+                )
+                for i, result in enumerate(self.split_group_results(group, batch)):
+                    results.add((1, side, single_pos, i, result))
+            for result in self.unmatched_results(
+                [rec.id for rec in pr_residue], [rec.id for rec in gstr2b_residue], batch
+            ):
+                if result.pr_invoice_id:
+                    results.add((2, 0, pr_positions[result.pr_invoice_id], 0, result))
+                else:
+                    results.add((2, 1, gstr2b_positions[result.gstr2b_invoice_id], 0, result))
+        else:
+            for side, residue, positions in (
+                (0, pr_residue, pr_positions), (1, gstr2b_residue, gstr2b_positions)
+            ):
+                for rec in residue:
+                    values = _RECORD_FIELDS(rec)
+                    next_rows.add((next_key(values), side, positions[rec.id], values))
+
+        context.totals.merge(batch.totals)
+
+    @staticmethod
+    def _pan(gstin: str, pans: Dict[str, str]) -> str:
+        pan = pans.get(gstin)
+        if pan is None:
+            pan = pans[gstin] = gstin_pan(gstin)
+        return pan
+
+    def _partition_key(self, vendor_scoped: bool, pans: Dict[str, str]) -> Callable[[Tuple], str]:
+        """Partition of a record (as its field tuple) for a stage: vendor PAN or invoice key"""
+        if vendor_scoped:
+            return lambda values: self._pan(values[2], pans)
+        return itemgetter(1)
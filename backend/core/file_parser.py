@@ -5,9 +5,12 @@ Handles Purchase Register and GSTR-2B file formats
 import pandas as pd
 from typing import List, Dict, Tuple, Optional
 from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from io import BytesIO
 import re
 
+from core.invoice_record import from_paise
+
 
 class FileParser:
     """
@@ -158,22 +161,26 @@ class FileParser:
         
         return None
     
-    def _parse_amount(self, value) -> float:
-        """Parse amount value to float"""
+    def _parse_paise(self, value) -> int:
+        """
+        Parse amount value straight to integer paise (half-up), from its
+        decimal text, so the amount never passes through float arithmetic
+        """
         if pd.isna(value):
-            return 0.0
-        
-        if isinstance(value, (int, float)):
-            return float(value)
+            return 0
         
-        # Remove currency symbols, commas, and spaces
+        # Remove currency symbols, commas, and spaces (numbers use their shortest repr)
         str_value = str(value).strip()
         str_value = re.sub(r'[₹$,\s]', '', str_value)
         
         try:
-            return float(str_value)
-        except ValueError:
-            return 0.0
+            return int(Decimal(str_value).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+        except (InvalidOperation, ValueError):
+            return 0
+    
+    def _amount_paise(self, row, column_map: Dict[str, str], field: str) -> int:
+        """Paise of an amount column (0 when the column is not mapped)"""
+        return self._parse_paise(row.get(column_map.get(field, ""), 0))
     
     def _parse_gstin(self, value, row_num: int = None) -> Optional[str]:
         """Parse and validate GSTIN — lenient mode, keeps value even if not 15 chars"""
@@ -256,32 +263,37 @@ class FileParser:
                 if not invoice_no or not vendor_gstin:
                     continue
                 
+                # Amounts in paise; the invoice carries them in rupees
+                taxable, igst, cgst, sgst, cess = (
+                    self._amount_paise(row, column_map, field)
+                    for field in ("taxable_value", "igst", "cgst", "sgst", "cess")
+                )
+                
+                # Calculate total tax if not provided
+                if column_map.get("total_tax"):
+                    total_tax = self._amount_paise(row, column_map, "total_tax")
+                else:
+                    total_tax = igst + cgst + sgst + cess
+                
+                # Calculate invoice value if not provided
+                invoice_value = self._amount_paise(row, column_map, "invoice_value") or taxable + total_tax
+                
                 invoice = {
                     "invoice_no": invoice_no,
                     "invoice_date": self._parse_date(row.get(column_map.get("invoice_date", ""))),
                     "vendor_gstin": vendor_gstin,
                     "vendor_name": str(row.get(column_map.get("vendor_name", ""), "")).strip() or None,
-                    "taxable_value": self._parse_amount(row.get(column_map.get("taxable_value", ""), 0)),
-                    "igst": self._parse_amount(row.get(column_map.get("igst", ""), 0)),
-                    "cgst": self._parse_amount(row.get(column_map.get("cgst", ""), 0)),
-                    "sgst": self._parse_amount(row.get(column_map.get("sgst", ""), 0)),
-                    "cess": self._parse_amount(row.get(column_map.get("cess", ""), 0)),
-                    "total_tax": 0,
-                    "invoice_value": self._parse_amount(row.get(column_map.get("invoice_value", ""), 0)),
+                    "taxable_value": from_paise(taxable),
+                    "igst": from_paise(igst),
+                    "cgst": from_paise(cgst),
+                    "sgst": from_paise(sgst),
+                    "cess": from_paise(cess),
+                    "total_tax": from_paise(total_tax),
+                    "invoice_value": from_paise(invoice_value),
                     "row_number": idx + 2,  # Excel row (1-indexed + header)
                     "source": "purchase_register"
                 }
                 
-                # Calculate total tax if not provided
-                if column_map.get("total_tax"):
-                    invoice["total_tax"] = self._parse_amount(row.get(column_map["total_tax"], 0))
-                else:
-                    invoice["total_tax"] = invoice["igst"] + invoice["cgst"] + invoice["sgst"] + invoice["cess"]
-                
-                # Calculate invoice value if not provided
-                if invoice["invoice_value"] == 0:
-                    invoice["invoice_value"] = invoice["taxable_value"] + invoice["total_tax"]
-                
                 invoices.append(invoice)
                 
             except Exception as e:
@@ -353,28 +365,33 @@ class FileParser:
                 if not invoice_no or not vendor_gstin:
                     continue
                 
+                # Amounts in paise; the invoice carries them in rupees
+                taxable, igst, cgst, sgst, cess = (
+                    self._amount_paise(row, column_map, field)
+                    for field in ("taxable_value", "igst", "cgst", "sgst", "cess")
+                )
+                
+                # Calculate totals
+                total_tax = igst + cgst + sgst + cess
+                
                 invoice = {
                     "invoice_no": invoice_no,
                     "invoice_date": self._parse_date(row.get(column_map.get("invoice_date", ""))),
                     "vendor_gstin": vendor_gstin,
                     "vendor_name": str(row.get(column_map.get("vendor_name", ""), "")).strip() or None,
-                    "taxable_value": self._parse_amount(row.get(column_map.get("taxable_value", ""), 0)),
-                    "igst": self._parse_amount(row.get(column_map.get("igst", ""), 0)),
-                    "cgst": self._parse_amount(row.get(column_map.get("cgst", ""), 0)),
-                    "sgst": self._parse_amount(row.get(column_map.get("sgst", ""), 0)),
-                    "cess": self._parse_amount(row.get(column_map.get("cess", ""), 0)),
-                    "total_tax": 0,
-                    "invoice_value": 0,
+                    "taxable_value": from_paise(taxable),
+                    "igst": from_paise(igst),
+                    "cgst": from_paise(cgst),
+                    "sgst": from_paise(sgst),
+                    "cess": from_paise(cess),
+                    "total_tax": from_paise(total_tax),
+                    "invoice_value": from_paise(taxable + total_tax),
                     "return_period": str(row.get(column_map.get("return_period", ""), "")).strip() or None,
                     "itc_available": True,
                     "row_number": idx + 2,
                     "source": "gstr2b"
                 }
                 
-                # Calculate totals
-                invoice["total_tax"] = invoice["igst"] + invoice["cgst"] + invoice["sgst"] + invoice["cess"]
-                invoice["invoice_value"] = invoice["taxable_value"] + invoice["total_tax"]
-                
                 # Parse ITC availability
                 itc_val = row.get(column_map.get("itc_available", ""), "")
                 if itc_val:
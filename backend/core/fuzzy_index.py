@@ -0,0 +1,157 @@
+"""
+Fuzzy Invoice Key Index
+Similar-invoice-number lookups per GSTIN without pairwise comparison
+"""
+from typing import List, Dict, Tuple, Set, Iterable, Sequence, NamedTuple
+from bisect import bisect_left
+
+from core.invoice_record import InvoiceRecord
+
+
+# Shortest key that may match as the tail of a longer one ("001" in "INV2024001")
+FUZZY_MIN_SUFFIX = 3
+
+# Shortest keys compared by edit distance; shorter keys differ too easily
+FUZZY_MIN_EDIT_LENGTH = 4
+
+# A tail shared by more keys than this (per GSTIN) is too ambiguous to pair on
+FUZZY_MAX_SUFFIX_MATCHES = 64
+
+
+class FuzzyThresholds(NamedTuple):
+    """Thresholds of the similar-invoice-number rule (defaults: the constants above)"""
+    min_suffix: int = FUZZY_MIN_SUFFIX
+    min_edit_length: int = FUZZY_MIN_EDIT_LENGTH
+    max_suffix_matches: int = FUZZY_MAX_SUFFIX_MATCHES
+
+
+DEFAULT_FUZZY_THRESHOLDS = FuzzyThresholds()
+
+
+def key_digits(key: str) -> str:
+    """Digits of a normalized invoice key, in order"""
+    return "".join(ch for ch in key if ch.isdigit())
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """Optimal string alignment distance <= 1 (one insert, delete, substitute or adjacent swap)"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    if i == len(a):
+        return True
+    return (
+        a[i + 1:] == b[i + 1:]
+        or (i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:])
+    )
+
+
+def is_key_suffix(short: str, long: str, min_suffix: int = FUZZY_MIN_SUFFIX) -> bool:
+    """`short` is the tail of `long` (e.g. serial number without its series / year prefix)"""
+    return (
+        min_suffix <= len(short) < len(long)
+        and long.endswith(short)
+        and any(ch.isdigit() for ch in short)
+    )
+
+
+def invoice_keys_similar(a: str, b: str, thresholds: FuzzyThresholds = DEFAULT_FUZZY_THRESHOLDS) -> bool:
+    """
+    Two different normalized invoice keys that plausibly name the same invoice:
+    - one is the tail of the other ("INV/2024/001" vs "001"), or
+    - they are one edit apart with the same digits ("INV001" vs "IN001", "NIV001")
+    """
+    if a == b or not a or not b:
+        return False
+    if is_key_suffix(a, b, thresholds.min_suffix) or is_key_suffix(b, a, thresholds.min_suffix):
+        return True
+    return (
+        min(len(a), len(b)) >= thresholds.min_edit_length
+        and key_digits(a) == key_digits(b)
+        and within_one_edit(a, b)
+    )
+
+
+def _deletions(key: str) -> Set[str]:
+    """The key and every key obtained by deleting one character"""
+    return {key} | {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+class FuzzyKeyIndex:
+    """
+    Indexes GSTR-2B records (by list position) for invoice_keys_similar lookups,
+    always within one GSTIN:
+
+    - Keys:      (GSTIN, key)                   -> probe tails found by hashing each suffix
+    - Reversed:  GSTIN -> sorted reversed keys  -> keys ending with the probe, by bisection
+    - Deletions: (GSTIN, key minus one char)    -> keys within one edit (symmetric deletion)
+
+    A lookup costs O(L) hash probes plus O(log n) bisection for a key of
+    length L, so matching a vendor's residue stays O(n log n) instead of
+    comparing every pair of invoice numbers.
+    """
+
+    def __init__(
+        self,
+        records: List[InvoiceRecord],
+        positions: Iterable[int],
+        thresholds: FuzzyThresholds = DEFAULT_FUZZY_THRESHOLDS
+    ):
+        self.records = records
+        self.thresholds = thresholds
+        self.by_key: Dict[Tuple[str, str], List[int]] = {}
+        self.by_deletion: Dict[Tuple[str, str], List[int]] = {}
+        reversed_keys: Dict[str, List[Tuple[str, int]]] = {}
+
+        for pos in positions:
+            rec = records[pos]
+            if not rec.key:
+                continue
+            self.by_key.setdefault((rec.gstin, rec.key), []).append(pos)
+            reversed_keys.setdefault(rec.gstin, []).append((rec.key[::-1], pos))
+            if len(rec.key) >= thresholds.min_edit_length:
+                for variant in _deletions(rec.key):
+                    self.by_deletion.setdefault((rec.gstin, variant), []).append(pos)
+
+        self.reversed: Dict[str, Tuple[List[str], List[int]]] = {}
+        for gstin, entries in reversed_keys.items():
+            entries.sort()
+            self.reversed[gstin] = ([k for k, _ in entries], [pos for _, pos in entries])
+
+    def candidates(self, rec: InvoiceRecord, claimed: Sequence[bool]) -> List[int]:
+        """Unclaimed positions with the same GSTIN and a similar (not equal) invoice key, in file order"""
+        key, gstin = rec.key, rec.gstin
+        if not key:
+            return []
+        thresholds = self.thresholds
+        found = set()
+
+        # Keys the probe ends with
+        for i in range(1, len(key) - thresholds.min_suffix + 1):
+            found.update(self.by_key.get((gstin, key[i:]), ()))
+
+        # Keys ending with the probe
+        if len(key) >= thresholds.min_suffix and gstin in self.reversed:
+            keys, positions = self.reversed[gstin]
+            prefix = key[::-1]
+            start = bisect_left(keys, prefix)
+            end = bisect_left(keys, prefix + "\x7f", start)
+            if end - start <= thresholds.max_suffix_matches:
+                found.update(positions[start:end])
+
+        # Keys within one edit
+        if len(key) >= thresholds.min_edit_length:
+            for variant in _deletions(key):
+                found.update(self.by_deletion.get((gstin, variant), ()))
+
+        records = self.records
+        return sorted(
+            pos for pos in found
+            if not claimed[pos] and invoice_keys_similar(key, records[pos].key, thresholds)
+        )
@@ -0,0 +1,559 @@
+"""
+Incremental Reconciliation
+Re-reconciles a run against a revised register, redoing only the partitions whose rows changed
+"""
+from typing import List, Dict, Tuple, Optional, Set, Any
+from collections import deque
+from dataclasses import dataclass, field, fields, asdict, replace
+from hashlib import blake2b
+from operator import attrgetter
+import gzip
+import json
+import os
+import sys
+import tempfile
+
+from core.reconciliation_engine import (
+    ReconciliationEngine, ReconciliationContext, ReconciliationTotals, MatchResult, MatchStatus, TOTAL_FIELDS
+)
+from core.invoice_record import InvoiceRecord, RecordBuilder, gstin_pan
+from core.candidate_index import CandidateIndex
+from core.vendor_summary import VendorAggregate
+
+
+# Changed partitions of one stage are reconciled together in batches of about this many rows
+INCREMENTAL_BATCH_ROWS = 5000
+
+# Record content compared between file versions (everything but the row's identity and position)
+_CONTENT_FIELDS = attrgetter(
+    "key", "gstin", "invoice_date", "date_ordinal", "taxable", "igst", "cgst", "sgst", "cess", "total_tax"
+)
+
+# Order tag of a result: (phase, pass or side, side of the id, record id, part);
+# sorting on the id's current file position gives ReconciliationEngine's order
+Tag = Tuple[int, int, int, str, int]
+
+# Results are identified by their invoice pair; every invoice is in exactly one result
+ResultKey = Tuple[Optional[str], Optional[str]]
+
+# Version of the saved state; files of another version are rejected by load()
+STATE_FORMAT_VERSION = 1
+
+_RECORD_FIELDS = tuple(f.name for f in fields(InvoiceRecord))
+_RESULT_FIELDS = tuple(f.name for f in fields(MatchResult))
+
+
+def row_hash(rec: InvoiceRecord) -> bytes:
+    """Stable content hash of a normalized record (same across processes)"""
+    return blake2b(repr(_CONTENT_FIELDS(rec)).encode(), digest_size=8).digest()
+
+
+def result_key(result: MatchResult) -> ResultKey:
+    return (result.pr_invoice_id, result.gstr2b_invoice_id)
+
+
+@dataclass
+class PartitionOutput:
+    """What one stage produced for one partition (vendor PAN or invoice key)"""
+    pr_ids: Tuple[str, ...]  # Input, in file order
+    gstr2b_ids: Tuple[str, ...]
+    results: List[Tuple[Tag, MatchResult]]
+    pr_residue: List[str]  # Left for the next stage
+    gstr2b_residue: List[str]
+    totals: ReconciliationTotals  # Status counts and ITC of the results
+    vendors: Dict[Tuple[str, str], VendorAggregate] = field(default_factory=dict)  # First stage only
+
+
+@dataclass
+class ReconciliationDelta:
+    """Changes from one version of a run to the next"""
+    added_invoices: List[Dict]  # Rows to store (new or changed), as uploaded
+    removed_invoice_ids: List[str]  # Stored rows no longer in the file
+    moved_invoices: List[Dict]  # Unchanged rows at a new row number, as uploaded under the stored id
+    upserted: List[MatchResult]  # New or changed results
+    deleted: List[ResultKey]  # (PR id, GSTR-2B id) of results that no longer exist
+    partitions: int = 0  # Partitions re-evaluated, over all stages
+
+    @property
+    def empty(self) -> bool:
+        return not (
+            self.added_invoices or self.removed_invoice_ids or self.moved_invoices or self.upserted or self.deleted
+        )
+
+
+class IncrementalReconciliation:
+    """
+    Persistent reconciliation state of one run, for cheap re-runs when a
+    revised Purchase Register or GSTR-2B is uploaded.
+
+    The run is reconciled in the engine's stages (vendor-scoped passes by
+    vendor PAN, cross-vendor passes by invoice key), and the output of every
+    stage is kept per partition with the partition's input. A new file
+    version is diffed against the stored rows by content hash: unchanged
+    rows keep their stored identity, so only partitions whose input changed
+    (rows added, removed or reordered, or residue that moved between
+    stages) are reconciled again. Partitions never compete for candidates,
+    so the results are the ones a full ReconciliationEngine run over the
+    stored rows produces.
+    """
+
+    def __init__(self, engine: Optional[ReconciliationEngine] = None):
+        self.engine = engine or ReconciliationEngine()
+        self.clear()
+
+    def clear(self) -> None:
+        """Forget the stored run"""
+        self.records: Tuple[List[InvoiceRecord], List[InvoiceRecord]] = ([], [])  # Per side, file order
+        self.hashes: Tuple[Dict[str, bytes], Dict[str, bytes]] = ({}, {})  # Per side: id -> content hash
+        self.side_totals = ReconciliationTotals()
+        self.partitions: List[Dict[str, PartitionOutput]] = []  # Per stage: partition -> output
+
+    # ============================================
+    # PUBLIC API
+    # ============================================
+
+    def reconcile(
+        self,
+        pr_invoices: List[Dict],
+        gstr2b_invoices: List[Dict],
+        context: Optional[ReconciliationContext] = None
+    ) -> List[MatchResult]:
+        """Reconcile a run from scratch, keeping its state for later updates"""
+        self.clear()
+        self.update(pr_invoices, gstr2b_invoices, context)
+        return self.results()
+
+    def update(
+        self,
+        pr_invoices: Optional[List[Dict]] = None,
+        gstr2b_invoices: Optional[List[Dict]] = None,
+        context: Optional[ReconciliationContext] = None
+    ) -> ReconciliationDelta:
+        """
+        Apply new versions of one or both registers (None = unchanged) and
+        re-reconcile what they affect. `context` receives the run's totals
+        and vendor summary after the update.
+
+        Returns: the changed invoices and results
+        """
+        builder = RecordBuilder()
+        added_invoices: List[Dict] = []
+        removed_ids: List[str] = []
+        moved_invoices: List[Dict] = []
+        changed: Set[str] = set()
+        moved_ids: Set[str] = set()
+        for side, invoices in enumerate((pr_invoices, gstr2b_invoices)):
+            if invoices is None:
+                continue
+            added, removed, moved = self._apply_version(side, builder.build_all(invoices))
+            added_invoices.extend(invoices[pos] for pos, _ in added)
+            removed_ids.extend(rec.id for rec in removed)
+            moved_invoices.extend({**invoices[pos], "id": rec.id} for pos, rec in moved)
+            moved_ids.update(rec.id for _, rec in moved)
+            # Rows re-uploaded under the same id with new content
+            changed.update({rec.id for _, rec in added} & {rec.id for rec in removed})
+
+        old_results: Dict[ResultKey, MatchResult] = {}
+        new_results: Dict[ResultKey, MatchResult] = {}
+        recomputed = 0
+        stages = self.engine.stages()
+        if len(self.partitions) != len(stages):
+            self.partitions = [{} for _ in stages]
+
+        stage_input = self.records
+        for stage_no, (vendor_scoped, _) in enumerate(stages):
+            groups = self._partition(stage_input, vendor_scoped)
+            previous = self.partitions[stage_no]
+            outputs: Dict[str, PartitionOutput] = {}
+            dirty: List[str] = []
+            for key, (pr, gstr2b) in groups.items():
+                output = previous.get(key)
+                if (
+                    output is not None
+                    and output.pr_ids == tuple(rec.id for rec in pr)
+                    and output.gstr2b_ids == tuple(rec.id for rec in gstr2b)
+                    and changed.isdisjoint(output.pr_ids)
+                    and changed.isdisjoint(output.gstr2b_ids)
+                    # DUPLICATE results name their original's row number
+                    and not (moved_ids and any(r.duplicate_of in moved_ids for _, r in output.results))
+                ):
+                    outputs[key] = output
+                else:
+                    dirty.append(key)
+
+            for key, output in previous.items():
+                if outputs.get(key) is not output:
+                    old_results.update((result_key(r), r) for _, r in output.results)
+            for key, output in self._reconcile_partitions(stage_no, stages, groups, dirty).items():
+                outputs[key] = output
+                new_results.update((result_key(r), r) for _, r in output.results)
+            recomputed += len(dirty)
+            self.partitions[stage_no] = outputs
+            stage_input = self._residue(outputs)
+
+        if context is not None:
+            self.fill_context(context)
+        return ReconciliationDelta(
+            added_invoices=added_invoices,
+            removed_invoice_ids=removed_ids,
+            moved_invoices=moved_invoices,
+            upserted=[r for key, r in new_results.items() if old_results.get(key) != r],
+            deleted=[key for key in old_results if key not in new_results],
+            partitions=recomputed,
+        )
+
+    def results(self) -> List[MatchResult]:
+        """Current results of the run, in ReconciliationEngine order"""
+        positions = tuple({rec.id: pos for pos, rec in enumerate(records)} for records in self.records)
+        tagged = [item for stage in self.partitions for output in stage.values() for item in output.results]
+        tagged.sort(key=lambda item: (item[0][0], item[0][1], positions[item[0][2]][item[0][3]], item[0][4]))
+        return [result for _, result in tagged]
+
+    def fill_context(self, context: ReconciliationContext) -> None:
+        """Write the run's totals and vendor summary into `context` (matched id sets are not kept)"""
+        totals = ReconciliationTotals()
+        totals.merge(self.side_totals)
+        vendors: Dict[Tuple[str, str], VendorAggregate] = {}
+        for stage in self.partitions:
+            for output in stage.values():
+                totals.merge(output.totals)
+                vendors.update(output.vendors)
+        context.totals = totals
+        context.vendors = vendors
+
+    def save(self, path: str) -> None:
+        """
+        Persist the state (not the engine) to `path` as gzipped JSON, replacing
+        it atomically. Plain data only, so loading a file never runs code.
+        """
+        state = {
+            "version": STATE_FORMAT_VERSION,
+            "rules": _rules_digest(self.engine),
+            "records": [
+                [[getattr(rec, f) for f in _RECORD_FIELDS] for rec in records] for records in self.records
+            ],
+            "hashes": [
+                [hashes[rec.id].hex() for rec in records] for records, hashes in zip(self.records, self.hashes)
+            ],
+            "side_totals": asdict(self.side_totals),
+            "partitions": [
+                {key: _encode_output(output) for key, output in stage.items()} for stage in self.partitions
+            ],
+        }
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path) or None)
+        try:
+            with gzip.open(os.fdopen(fd, "wb"), "wt", encoding="utf-8") as f:
+                json.dump(state, f, separators=(",", ":"))
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path: str, engine: Optional[ReconciliationEngine] = None) -> "IncrementalReconciliation":
+        """
+        State saved by save(), to be updated with the given engine. Raises
+        ValueError if the file is of another format version or was saved
+        under other matching rules.
+        """
+        incremental = cls(engine)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") != STATE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported incremental state version {state.get('version')!r}")
+        if state["rules"] != _rules_digest(incremental.engine):
+            raise ValueError("Incremental state was saved under other matching rules")
+
+        records = tuple([_decode_record(values) for values in side] for side in state["records"])
+        incremental.records = records
+        incremental.hashes = tuple(
+            {rec.id: bytes.fromhex(digest) for rec, digest in zip(side, digests)}
+            for side, digests in zip(records, state["hashes"])
+        )
+        incremental.side_totals = ReconciliationTotals(**state["side_totals"])
+        incremental.partitions = [
+            {key: _decode_output(output) for key, output in stage.items()} for stage in state["partitions"]
+        ]
+        return incremental
+
+    # ============================================
+    # FILE VERSIONS
+    # ============================================
+
+    def _apply_version(
+        self,
+        side: int,
+        new_records: List[InvoiceRecord]
+    ) -> Tuple[List[Tuple[int, InvoiceRecord]], List[InvoiceRecord], List[Tuple[int, InvoiceRecord]]]:
+        """
+        Replace a side's rows with a new version. Rows are paired with stored
+        rows of the same content: first under the same id, then (for uploads
+        with fresh ids) in file order among stored rows whose id the new
+        version does not use. Paired rows keep the stored id, so their
+        results stay valid, and take the new row number.
+
+        Returns: ([(position in the upload, record)] added, [record] removed,
+        [(position in the upload, record)] paired rows whose row number changed)
+        """
+        hashes = self.hashes[side]
+        by_id = {rec.id: rec for rec in self.records[side]}
+        digests = [row_hash(rec) for rec in new_records]
+        kept = {
+            rec.id for rec, digest in zip(new_records, digests)
+            if rec.id in by_id and hashes[rec.id] == digest
+        }
+        new_ids = {rec.id for rec in new_records}
+        stored: Dict[bytes, deque] = {}
+        for rec in self.records[side]:
+            if rec.id not in new_ids:
+                stored.setdefault(hashes[rec.id], deque()).append(rec)
+
+        records: List[InvoiceRecord] = []
+        new_hashes: Dict[str, bytes] = {}
+        added: List[Tuple[int, InvoiceRecord]] = []
+        moved: List[Tuple[int, InvoiceRecord]] = []
+        retained: Set[str] = set()
+        for pos, (new, digest) in enumerate(zip(new_records, digests)):
+            same = stored.get(digest)
+            if new.id in kept:
+                rec = by_id[new.id]
+            elif same:
+                rec = same.popleft()
+            else:
+                rec = new
+                added.append((pos, rec))
+            if rec is not new:
+                retained.add(rec.id)
+                if rec.row_number != new.row_number:
+                    rec = replace(rec, row_number=new.row_number)
+                    moved.append((pos, rec))
+            records.append(rec)
+            new_hashes[rec.id] = digest
+        removed = [rec for rec in self.records[side] if rec.id not in retained]
+
+        side_totals = (self.side_totals.pr_totals, self.side_totals.gstr2b_totals)[side]
+        for rec in removed:
+            for f in TOTAL_FIELDS:
+                side_totals[f] -= getattr(rec, f)
+        self.side_totals.add_records(side_totals, (rec for _, rec in added))
+
+        self.records[side][:] = records
+        hashes.clear()
+        hashes.update(new_hashes)
+        return added, removed, moved
+
+    # ============================================
+    # STAGES
+    # ============================================
+
+    def _partition(
+        self,
+        records: Tuple[List[InvoiceRecord], List[InvoiceRecord]],
+        vendor_scoped: bool
+    ) -> Dict[str, Tuple[List[InvoiceRecord], List[InvoiceRecord]]]:
+        """Group a stage's input (per side, file order) by vendor PAN or invoice key"""
+        pans: Dict[str, str] = {}
+        groups: Dict[str, Tuple[List[InvoiceRecord], List[InvoiceRecord]]] = {}
+        for side, side_records in enumerate(records):
+            for rec in side_records:
+                if vendor_scoped:
+                    key = pans.get(rec.gstin)
+                    if key is None:
+                        key = pans[rec.gstin] = gstin_pan(rec.gstin)
+                else:
+                    key = rec.key
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = ([], [])
+                group[side].append(rec)
+        return groups
+
+    def _residue(
+        self,
+        outputs: Dict[str, PartitionOutput]
+    ) -> Tuple[List[InvoiceRecord], List[InvoiceRecord]]:
+        """Residue of every partition of a stage, per side in file order (the next stage's input)"""
+        residue = (
+            {rec_id for output in outputs.values() for rec_id in output.pr_residue},
+            {rec_id for output in outputs.values() for rec_id in output.gstr2b_residue},
+        )
+        return tuple([rec for rec in records if rec.id in ids] for records, ids in zip(self.records, residue))
+
+    def _reconcile_partitions(
+        self,
+        stage_no: int,
+        stages: List[Tuple[bool, List[int]]],
+        groups: Dict[str, Tuple[List[InvoiceRecord], List[InvoiceRecord]]],
+        keys: List[str]
+    ) -> Dict[str, PartitionOutput]:
+        """Run one stage over the given partitions, reconciling small ones together"""
+        vendor_scoped, pass_numbers = stages[stage_no]
+        outputs: Dict[str, PartitionOutput] = {}
+        batch: List[str] = []
+        rows = 0
+        for key in keys:
+            pr, gstr2b = groups[key]
+            if not vendor_scoped and key == "":
+                # Records without an invoice number never pair on it
+                outputs[key] = self._output(pr, gstr2b, [], [rec.id for rec in pr], [rec.id for rec in gstr2b], {})
+                continue
+            batch.append(key)
+            rows += len(pr) + len(gstr2b)
+            if rows >= INCREMENTAL_BATCH_ROWS:
+                outputs.update(self._reconcile_batch(stage_no, stages, groups, batch))
+                batch, rows = [], 0
+        if batch:
+            outputs.update(self._reconcile_batch(stage_no, stages, groups, batch))
+        return outputs
+
+    def _reconcile_batch(
+        self,
+        stage_no: int,
+        stages: List[Tuple[bool, List[int]]],
+        groups: Dict[str, Tuple[List[InvoiceRecord], List[InvoiceRecord]]],
+        keys: List[str]
+    ) -> Dict[str, PartitionOutput]:
+        """
+        One stage over a batch of whole partitions, as in the out-of-core
+        engine; the output is then split back into the partitions.
+        """
+        engine = self.engine
+        first, last = stage_no == 0, stage_no == len(stages) - 1
+        pass_numbers = stages[stage_no][1]
+        pr_records = [rec for key in keys for rec in groups[key][0]]
+        gstr2b_records = [rec for key in keys for rec in groups[key][1]]
+        batch = ReconciliationContext()
+        tagged: List[Tuple[Tag, MatchResult]] = []
+        paired = None
+
+        if first:
+            pr_records, pr_duplicates = engine.split_duplicates(pr_records)
+            gstr2b_records, gstr2b_duplicates = engine.split_duplicates(gstr2b_records)
+            for result in engine.duplicate_results(pr_duplicates, gstr2b_duplicates, batch):
+                side = 0 if result.pr_invoice_id else 1
+                tagged.append(((3, side, side, result.pr_invoice_id or result.gstr2b_invoice_id, 0), result))
+            paired = engine.balanced_vendor_pairs(pr_records, gstr2b_records, batch)
+
+        claimed = [False] * len(gstr2b_records)
+        if pr_records and gstr2b_records:
+            index = CandidateIndex(gstr2b_records, engine.AMOUNT_TOLERANCE_PAISE, engine.MAX_BUCKET_SIZE, paired)
+            for pass_no, pr_rec, pos in engine.iter_passes(pass_numbers, pr_records, index, claimed):
+                result = engine.pass_result(pass_no, pr_rec, gstr2b_records[pos])
+                batch.record_match(result)
+                tagged.append(((0, pass_no, 0, pr_rec.id, 0), result))
+
+        pr_residue = [rec for rec in pr_records if rec.id not in batch.matched_pr_ids]
+        gstr2b_residue = [rec for pos, rec in enumerate(gstr2b_records) if not claimed[pos]]
+        if last:
+            for group in engine.split_groups(pr_residue, gstr2b_residue):
+                side = 0 if group.single_is_pr else 1
+                for i, result in enumerate(engine.split_group_results(group, batch)):
+                    tagged.append(((1, side, side, group.single.id, i), result))
+            for result in engine.unmatched_results(
+                [rec.id for rec in pr_residue], [rec.id for rec in gstr2b_residue], batch
+            ):
+                side = 0 if result.pr_invoice_id else 1
+                tagged.append(((2, side, side, result.pr_invoice_id or result.gstr2b_invoice_id, 0), result))
+            pr_residue, gstr2b_residue = [], []
+
+        # Split the batch back into partitions; a result belongs to its invoices' partition
+        partition_of: Tuple[Dict[str, str], Dict[str, str]] = ({}, {})
+        for key in keys:
+            for side, side_records in enumerate(groups[key]):
+                partition_of[side].update((rec.id, key) for rec in side_records)
+        split: Dict[str, Tuple[List, List, List, Dict]] = {key: ([], [], [], {}) for key in keys}
+        for tag, result in tagged:
+            if result.pr_invoice_id:
+                split[partition_of[0][result.pr_invoice_id]][0].append((tag, result))
+            else:
+                split[partition_of[1][result.gstr2b_invoice_id]][0].append((tag, result))
+        for side, residue in enumerate((pr_residue, gstr2b_residue)):
+            for rec in residue:
+                split[partition_of[side][rec.id]][1 + side].append(rec.id)
+        pans: Dict[str, str] = {}
+        for vendor_key, vendor in batch.vendors.items():
+            pan = pans.get(vendor.gstin)
+            if pan is None:
+                pan = pans[vendor.gstin] = gstin_pan(vendor.gstin)
+            split[pan][3][vendor_key] = vendor
+
+        return {
+            key: self._output(groups[key][0], groups[key][1], results, pr_ids, gstr2b_ids, vendors)
+            for key, (results, pr_ids, gstr2b_ids, vendors) in split.items()
+        }
+
+    def _output(
+        self,
+        pr: List[InvoiceRecord],
+        gstr2b: List[InvoiceRecord],
+        results: List[Tuple[Tag, MatchResult]],
+        pr_residue: List[str],
+        gstr2b_residue: List[str],
+        vendors: Dict[Tuple[str, str], VendorAggregate]
+    ) -> PartitionOutput:
+        """PartitionOutput with the totals of its results"""
+        totals = ReconciliationTotals()
+        gstr2b_by_id = {rec.id: rec for rec in gstr2b}
+        booked: Set[str] = set()
+        for _, result in results:
+            gstr2b_id = result.gstr2b_invoice_id
+            if result.pr_invoice_id and gstr2b_id and gstr2b_id not in booked:
+                # A merged split group books its one GSTR-2B invoice once
+                booked.add(gstr2b_id)
+                totals.add_pair(result.status, gstr2b_by_id[gstr2b_id])
+            else:
+                totals.count(result.status)
+        return PartitionOutput(
+            pr_ids=tuple(rec.id for rec in pr),
+            gstr2b_ids=tuple(rec.id for rec in gstr2b),
+            results=results,
+            pr_residue=pr_residue,
+            gstr2b_residue=gstr2b_residue,
+            totals=totals,
+            vendors=vendors,
+        )
+
+
+# ============================================
+# STATE FILES
+# ============================================
+
+def _rules_digest(engine: ReconciliationEngine) -> str:
+    """Rule profile the engine was compiled for ("" for the plain rules)"""
+    profile = getattr(engine, "RULE_PROFILE", None)
+    return profile.digest if profile is not None else ""
+
+
+def _decode_record(values: List[Any]) -> InvoiceRecord:
+    rec_id, key, gstin, *rest = values
+    return InvoiceRecord(rec_id, sys.intern(key), sys.intern(gstin), *rest)
+
+
+def _encode_output(output: PartitionOutput) -> Dict[str, Any]:
+    return {
+        "pr_ids": output.pr_ids,
+        "gstr2b_ids": output.gstr2b_ids,
+        "results": [
+            [tag, [getattr(result, f) for f in _RESULT_FIELDS]] for tag, result in output.results
+        ],
+        "pr_residue": output.pr_residue,
+        "gstr2b_residue": output.gstr2b_residue,
+        "totals": asdict(output.totals),
+        "vendors": [asdict(vendor) for vendor in output.vendors.values()],
+    }
+
+
+def _decode_output(data: Dict[str, Any]) -> PartitionOutput:
+    results = []
+    for tag, (status, *values) in data["results"]:
+        results.append((tuple(tag), MatchResult(MatchStatus(status), *values)))
+    vendors = [VendorAggregate(**vendor) for vendor in data["vendors"]]
+    return PartitionOutput(
+        pr_ids=tuple(data["pr_ids"]),
+        gstr2b_ids=tuple(data["gstr2b_ids"]),
+        results=results,
+        pr_residue=data["pr_residue"],
+        gstr2b_residue=data["gstr2b_residue"],
+        totals=ReconciliationTotals(**data["totals"]),
+        vendors={(vendor.gstin, vendor.period): vendor for vendor in vendors},
+    )
@@ -0,0 +1,162 @@
+"""
+Normalized Invoice Records
+Compact, immutable per-invoice records built once before matching
+"""
+from typing import List, Dict, Tuple, Optional, Any
+from dataclasses import dataclass
+from datetime import date, datetime
+import re
+import sys
+
+
+_NON_ALNUM = re.compile(r'[^A-Z0-9]')
+
+
+def normalize_invoice_no(invoice_no: Optional[str]) -> str:
+    """
+    Normalize invoice number for matching.
+    Removes spaces, special chars, converts to uppercase.
+    """
+    if not invoice_no:
+        return ""
+    return _NON_ALNUM.sub('', str(invoice_no).upper().strip())
+
+
+def normalize_gstin(gstin: Optional[str]) -> str:
+    """Normalize GSTIN for matching"""
+    if not gstin:
+        return ""
+    return str(gstin).upper().strip().replace(" ", "")
+
+
+def gstin_pan(gstin: str) -> str:
+    """
+    PAN embedded in a normalized GSTIN (characters 3-12).
+    Malformed GSTINs are returned unchanged so they still group consistently.
+    """
+    if len(gstin) != 15:
+        return gstin
+    return gstin[2:12]
+
+
+def to_paise(amount: Any) -> int:
+    """Convert a rupee amount (float/str/None) to integer paise"""
+    if not amount:
+        return 0
+    return round(float(amount) * 100)
+
+
+def from_paise(paise: int) -> float:
+    """Convert integer paise back to rupees (exact to 2 decimals)"""
+    return paise / 100
+
+
+def date_ordinal(value: Any) -> Optional[int]:
+    """Proleptic Gregorian ordinal of an ISO date (or date/datetime), None if missing or invalid"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date().toordinal()
+    if isinstance(value, date):
+        return value.toordinal()
+    try:
+        return date.fromisoformat(str(value).strip()[:10]).toordinal()
+    except ValueError:
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class InvoiceRecord:
+    """
+    One invoice, normalized for matching.
+
+    Keys and GSTINs are interned so equality checks are pointer comparisons
+    and repeated values share memory; amounts are integer paise and the
+    invoice date is also kept as an integer day ordinal.
+    """
+    id: str
+    key: str  # Normalized invoice number
+    gstin: str  # Normalized vendor GSTIN
+    invoice_date: Optional[str]
+    date_ordinal: Optional[int]
+    taxable: int
+    igst: int
+    cgst: int
+    sgst: int
+    cess: int
+    total_tax: int
+    row_number: Optional[int] = None
+
+    @property
+    def total(self) -> int:
+        """Taxable value + total tax, in paise"""
+        return self.taxable + self.total_tax
+    
+    @property
+    def exact_key(self) -> Tuple[str, str, Optional[int], int, int, int, int]:
+        """Full normalized tuple; equal keys are an exact match under any tolerance or date window"""
+        return (self.gstin, self.key, self.date_ordinal, self.taxable, self.igst, self.cgst, self.sgst)
+    
+    @property
+    def duplicate_key(self) -> Tuple[str, str, int, int, int, int]:
+        """Rows of one register sharing this key (and an invoice number) are duplicates"""
+        return (self.gstin, self.key, self.taxable, self.igst, self.cgst, self.sgst)
+
+
+class RecordBuilder:
+    """
+    Builds InvoiceRecords, caching normalization of repeated raw values.
+    Use one builder per reconciliation run so the caches stay bounded.
+    """
+
+    def __init__(self):
+        self._keys: Dict[str, str] = {}
+        self._gstins: Dict[str, str] = {}
+        self._dates: Dict[Any, Optional[int]] = {}
+
+    def _key(self, raw: Any) -> str:
+        raw = raw or ""
+        key = self._keys.get(raw)
+        if key is None:
+            key = self._keys[raw] = sys.intern(normalize_invoice_no(raw))
+        return key
+
+    def _gstin(self, raw: Any) -> str:
+        raw = raw or ""
+        gstin = self._gstins.get(raw)
+        if gstin is None:
+            gstin = self._gstins[raw] = sys.intern(normalize_gstin(raw))
+        return gstin
+
+    def _date(self, raw: Any) -> Optional[int]:
+        if raw not in self._dates:
+            self._dates[raw] = date_ordinal(raw)
+        return self._dates[raw]
+
+    def build(self, invoice: Dict) -> InvoiceRecord:
+        """Normalize a single parsed invoice dict"""
+        get = invoice.get
+        invoice_date = get("invoice_date")
+        return InvoiceRecord(
+            invoice["id"],
+            self._key(get("invoice_no")),
+            self._gstin(get("vendor_gstin")),
+            invoice_date,
+            self._date(invoice_date),
+            to_paise(get("taxable_value")),
+            to_paise(get("igst")),
+            to_paise(get("cgst")),
+            to_paise(get("sgst")),
+            to_paise(get("cess")),
+            to_paise(get("total_tax")),
+            get("row_number"),
+        )
+
+    def build_all(self, invoices: List[Dict]) -> List[InvoiceRecord]:
+        """Normalize a list of parsed invoice dicts"""
+        return [self.build(inv) for inv in invoices]
+
+
+def normalize_invoices(invoices: List[Dict]) -> List[InvoiceRecord]:
+    """Normalize a list of parsed invoice dicts into InvoiceRecords"""
+    return RecordBuilder().build_all(invoices)
@@ -0,0 +1,215 @@
+"""
+ITC Claim History
+Per-client index of every claimed invoice, to catch one vendor invoice claimed in two return periods
+"""
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator
+from itertools import islice
+from contextlib import contextmanager
+from hashlib import blake2b
+import fcntl
+import os
+import re
+import tempfile
+import threading
+import numpy as np
+
+from core.invoice_record import InvoiceRecord
+
+
+# A segment is merged into the one before it once it is at least this fraction of its size,
+# which keeps O(log n) segments and O(log n) amortized rewrites per row
+MERGE_RATIO = 0.5
+
+# Held shared by lookups and exclusively by appends, across processes sharing the directory
+LOCK_FILE = ".lock"
+
+# Claims hashed and looked up per chunk, so a register is checked as it streams in
+CLAIM_CHUNK_SIZE = 50000
+
+_SEGMENT = re.compile(r"^seg-(\d{8})\.hash\.npy$")
+_PERIOD = re.compile(r"^(\d{1,2})-(\d{4})$|^(\d{4})-(\d{1,2})$")
+
+# Threads of one process also serialize on a lock per client directory
+_locks: Dict[str, threading.RLock] = {}
+_locks_guard = threading.Lock()
+
+
+def period_number(return_period: Optional[str]) -> int:
+    """YYYYMM of a return period ('MM-YYYY' as stored on runs, or 'YYYY-MM'); 0 when unknown"""
+    match = _PERIOD.match((return_period or "").strip())
+    if not match:
+        return 0
+    month, year = (match.group(1), match.group(2)) if match.group(1) else (match.group(4), match.group(3))
+    return int(year) * 100 + int(month)
+
+
+def period_label(number: int) -> str:
+    """'MM-YYYY' of a YYYYMM period number"""
+    return f"{number % 100:02d}-{number // 100:04d}"
+
+
+def claim_hash(rec: InvoiceRecord) -> int:
+    """64-bit hash of a claim: normalized GSTIN + invoice no + taxable value"""
+    digest = blake2b(repr((rec.gstin, rec.key, rec.taxable)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class ItcHistoryIndex:
+    """
+    Append-only index of claim hashes for one client, with the first period
+    each claim was seen in.
+
+    Claims are stored in sorted segments (a hash array and a parallel period
+    array, one .npy each) that are memory-mapped for lookups, so a check is
+    a vectorized binary search per segment and never loads the history.
+    Each upload only writes its new hashes as a segment; a segment at least
+    half the size of the previous one is merged into it, so there are
+    O(log n) segments and each row is rewritten O(log n) times in total.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with _locks_guard:
+            self._lock = _locks.setdefault(os.path.abspath(directory), threading.RLock())
+
+    def lookup(self, hashes: np.ndarray) -> np.ndarray:
+        """First period (YYYYMM) of each hash, 0 where it was never claimed"""
+        with self._locked(exclusive=False):
+            return self._lookup(hashes)
+
+    def _lookup(self, hashes: np.ndarray) -> np.ndarray:
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        periods = np.zeros(len(hashes), dtype=np.uint32)
+        for seq in self._sequences():
+            self._probe(seq, hashes, periods)
+        return periods
+
+    def _probe(self, seq: int, hashes: np.ndarray, periods: np.ndarray) -> None:
+        """Fill in the periods of the hashes found in one segment"""
+        seg_hashes, seg_periods = self._load(seq)
+        pos = np.searchsorted(seg_hashes, hashes)
+        inside = pos < len(seg_hashes)
+        found = np.zeros(len(hashes), dtype=bool)
+        found[inside] = seg_hashes[pos[inside]] == hashes[inside]
+        periods[found] = seg_periods[pos[found]]
+
+    def record(self, hashes: np.ndarray, period: int) -> int:
+        """Add the claims of one period; returns how many were new"""
+        with self._locked(exclusive=True):
+            hashes = np.unique(np.asarray(hashes, dtype=np.uint64))
+            new = hashes[self._lookup(hashes) == 0]
+            if len(new):
+                self._write(self._next_sequence(), new, np.full(len(new), period, dtype=np.uint32))
+                self._compact()
+            return len(new)
+
+    def __len__(self) -> int:
+        with self._locked(exclusive=False):
+            return sum(len(self._load(seq)[0]) for seq in self._sequences())
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        """
+        Thread lock plus an flock on the directory's lock file, so API workers
+        in other processes never interleave appends or read a half-merged index
+        """
+        with self._lock:
+            if not exclusive and not os.path.isdir(self.directory):
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, LOCK_FILE), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # ============================================
+    # SEGMENTS
+    # ============================================
+
+    def _sequences(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(m.group(1)) for m in map(_SEGMENT.match, os.listdir(self.directory)) if m)
+
+    def _next_sequence(self) -> int:
+        sequences = self._sequences()
+        return sequences[-1] + 1 if sequences else 0
+
+    def _paths(self, seq: int) -> Tuple[str, str]:
+        base = os.path.join(self.directory, f"seg-{seq:08d}")
+        return base + ".hash.npy", base + ".period.npy"
+
+    def _load(self, seq: int) -> Tuple[np.ndarray, np.ndarray]:
+        hash_path, period_path = self._paths(seq)
+        return np.load(hash_path, mmap_mode="r"), np.load(period_path, mmap_mode="r")
+
+    def _write(self, seq: int, hashes: np.ndarray, periods: np.ndarray) -> None:
+        """Write a segment; the hash file is renamed in last, so a segment is never seen half-written"""
+        hash_path, period_path = self._paths(seq)
+        for path, values in ((period_path, periods), (hash_path, hashes)):
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, values)
+            os.replace(tmp, path)
+
+    def _compact(self) -> None:
+        """Merge trailing segments while the last one is comparable in size to the one before it"""
+        sequences = self._sequences()
+        while len(sequences) > 1:
+            older, newer = sequences[-2], sequences[-1]
+            older_hashes, older_periods = self._load(older)
+            newer_hashes, newer_periods = self._load(newer)
+            if len(newer_hashes) < len(older_hashes) * MERGE_RATIO:
+                break
+            hashes = np.concatenate([older_hashes, newer_hashes])
+            periods = np.concatenate([older_periods, newer_periods])
+            order = np.argsort(hashes, kind="stable")
+            merged = newer + 1
+            self._write(merged, hashes[order], periods[order])
+            del older_hashes, older_periods, newer_hashes, newer_periods
+            for seq in (older, newer):
+                for path in self._paths(seq):
+                    os.remove(path)
+            sequences = sequences[:-2] + [merged]
+
+
+def find_repeat_claims(
+    index: ItcHistoryIndex,
+    pr_records: Iterable[InvoiceRecord],
+    return_period: str
+) -> List[Dict]:
+    """
+    Check a period's Purchase Register against the client's claim history,
+    then add its claims. A PR invoice already claimed in another period is
+    reported with that period; re-checking the same period reports nothing.
+    The records may be any iterable; only their hashes are kept.
+    """
+    period = period_number(return_period)
+    if not period:
+        return []
+    records = (rec for rec in pr_records if rec.key)
+    repeats: List[Dict] = []
+    claimed: List[np.ndarray] = []
+    while True:
+        chunk = list(islice(records, CLAIM_CHUNK_SIZE))
+        if not chunk:
+            break
+        hashes = np.fromiter((claim_hash(rec) for rec in chunk), dtype=np.uint64, count=len(chunk))
+        first = index.lookup(hashes)
+        repeats.extend(
+            {
+                "pr_invoice_id": rec.id,
+                "vendor_gstin": rec.gstin,
+                "invoice_no": rec.key,
+                "first_claimed_period": period_label(int(first_period)),
+            }
+            for rec, first_period in zip(chunk, first)
+            if first_period and first_period != period
+        )
+        claimed.append(hashes)
+    if claimed:
+        index.record(np.concatenate(claimed), period)
+    return repeats
@@ -0,0 +1,222 @@
+"""
+Open Items Carry-Forward
+Per-client index of unmatched invoices, probed by later return periods to close them
+"""
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator
+from dataclasses import dataclass
+from hashlib import blake2b
+
+from core.reconciliation_engine import ReconciliationEngine, MatchResult, MatchStatus
+from core.invoice_record import InvoiceRecord, date_ordinal, to_paise, from_paise
+
+
+PR_SOURCE = "purchase_register"
+GSTR2B_SOURCE = "gstr2b"
+
+# Single-sided statuses that leave an item open, and the side it is open on
+OPEN_STATUSES = {MatchStatus.PR_ONLY: PR_SOURCE, MatchStatus.GSTR2B_ONLY: GSTR2B_SOURCE}
+
+# Match keys per lookup query when probing the stored index
+PROBE_CHUNK_SIZE = 200
+
+
+def match_key(gstin: str, key: str) -> str:
+    """Index key of an invoice: normalized GSTIN + normalized invoice no"""
+    return f"{gstin}|{key}"
+
+
+@dataclass
+class OpenItem:
+    """An invoice left unmatched in one return period (amounts in paise)"""
+    source: str  # "purchase_register" / "gstr2b"
+    match_key: str
+    item_hash: str  # Identifies the row within its side and period
+    return_period: str
+    vendor_gstin: str
+    invoice_no: str
+    invoice_date: Optional[str]
+    taxable: int
+    igst: int
+    cgst: int
+    sgst: int
+    cess: int
+    total_tax: int
+    id: Optional[str] = None  # Stored row id
+    invoice_id: Optional[str] = None  # Invoice the item was opened from
+
+    @classmethod
+    def from_record(cls, rec: InvoiceRecord, source: str, return_period: str) -> "OpenItem":
+        return cls(
+            source=source,
+            match_key=match_key(rec.gstin, rec.key),
+            item_hash=item_hash(rec, source, return_period),
+            return_period=return_period,
+            vendor_gstin=rec.gstin,
+            invoice_no=rec.key,
+            invoice_date=rec.invoice_date,
+            taxable=rec.taxable,
+            igst=rec.igst,
+            cgst=rec.cgst,
+            sgst=rec.sgst,
+            cess=rec.cess,
+            total_tax=rec.total_tax,
+            invoice_id=rec.id,
+        )
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "OpenItem":
+        """Item from a stored open_items row (amounts in rupees)"""
+        return cls(
+            source=row["source"],
+            match_key=row["match_key"],
+            item_hash=row["item_hash"],
+            return_period=row.get("return_period") or "",
+            vendor_gstin=row.get("vendor_gstin") or "",
+            invoice_no=row.get("invoice_no") or "",
+            invoice_date=row.get("invoice_date"),
+            taxable=to_paise(row.get("taxable_value")),
+            igst=to_paise(row.get("igst")),
+            cgst=to_paise(row.get("cgst")),
+            sgst=to_paise(row.get("sgst")),
+            cess=to_paise(row.get("cess")),
+            total_tax=to_paise(row.get("total_tax")),
+            id=row.get("id"),
+            invoice_id=row.get("invoice_id"),
+        )
+
+    def as_row(self, client_id: str) -> Dict:
+        """open_items row for this item (amounts in rupees)"""
+        return {
+            "client_id": client_id,
+            "source": self.source,
+            "match_key": self.match_key,
+            "item_hash": self.item_hash,
+            "return_period": self.return_period,
+            "vendor_gstin": self.vendor_gstin,
+            "invoice_no": self.invoice_no,
+            "invoice_date": self.invoice_date,
+            "taxable_value": from_paise(self.taxable),
+            "igst": from_paise(self.igst),
+            "cgst": from_paise(self.cgst),
+            "sgst": from_paise(self.sgst),
+            "cess": from_paise(self.cess),
+            "total_tax": from_paise(self.total_tax),
+            "invoice_id": self.invoice_id,
+        }
+
+    def record(self) -> InvoiceRecord:
+        """The item as an InvoiceRecord, for the engine's amount rules"""
+        gstin, key = self.match_key.split("|", 1)
+        return InvoiceRecord(
+            self.id or self.item_hash, key, gstin, self.invoice_date, date_ordinal(self.invoice_date),
+            self.taxable, self.igst, self.cgst, self.sgst, self.cess, self.total_tax
+        )
+
+
+def item_hash(rec: InvoiceRecord, source: str, return_period: str) -> str:
+    """Stable hash of a row's content within its side and return period"""
+    content = (
+        source, return_period, rec.gstin, rec.key, rec.date_ordinal,
+        rec.taxable, rec.igst, rec.cgst, rec.sgst, rec.cess, rec.total_tax
+    )
+    return blake2b(repr(content).encode(), digest_size=16).hexdigest()
+
+
+@dataclass
+class ClosedItem:
+    """An open item matched by an invoice of the current period"""
+    item: OpenItem
+    invoice_id: str  # Current period's invoice that closed it
+    return_period: str  # Current period
+
+    def as_dict(self) -> Dict:
+        return {
+            "open_item_id": self.item.id,
+            "source": self.item.source,
+            "opened_period": self.item.return_period,
+            "closed_period": self.return_period,
+            "vendor_gstin": self.item.vendor_gstin,
+            "invoice_no": self.item.invoice_no,
+            "invoice_date": self.item.invoice_date,
+            "taxable_value": from_paise(self.item.taxable),
+            "total_tax": from_paise(self.item.total_tax),
+            "opened_invoice_id": self.item.invoice_id,
+            "closed_by_invoice_id": self.invoice_id,
+        }
+
+
+class OpenItemsIndex:
+    """
+    Open items of one client, hashed by (GSTIN, invoice key) per side.
+    Only the items sharing a key with the current period's unmatched
+    invoices need to be loaded; each probe is then one dict lookup.
+    """
+
+    def __init__(self, items: Iterable[OpenItem] = ()):
+        self.items: Dict[Tuple[str, str], List[OpenItem]] = {}  # (source, match key) -> items, oldest first
+        for item in items:
+            self.add(item)
+
+    def add(self, item: OpenItem) -> None:
+        self.items.setdefault((item.source, item.match_key), []).append(item)
+
+    def take(self, source: str, key: str, rec: InvoiceRecord, engine: ReconciliationEngine) -> Optional[OpenItem]:
+        """Remove and return the oldest open item of `source` under `key` whose amounts match `rec`"""
+        items = self.items.get((source, key))
+        if not items:
+            return None
+        for i, item in enumerate(items):
+            pr, gstr2b = (item.record(), rec) if source == PR_SOURCE else (rec, item.record())
+            if engine.all_amounts_match(pr, gstr2b):
+                return items.pop(i)
+        return None
+
+
+def probe_keys(results: Iterable[MatchResult], records: Dict[str, InvoiceRecord]) -> List[str]:
+    """Match keys of the single-sided results, to load only the open items they can close"""
+    return sorted({match_key(rec.gstin, rec.key) for _, rec in _single_sided(results, records)})
+
+
+def carry_forward(
+    engine: ReconciliationEngine,
+    index: OpenItemsIndex,
+    results: Iterable[MatchResult],
+    records: Dict[str, InvoiceRecord],
+    return_period: str
+) -> Tuple[List[ClosedItem], List[OpenItem]]:
+    """
+    Probe the index with the current period's PR_ONLY / GSTR2B_ONLY invoices.
+    An invoice closes the oldest open item of the other side with the same
+    GSTIN + invoice key and amounts within the engine's tolerances (dates
+    are ignored: the periods differ by design); the others become new
+    open items.
+
+    `records` maps invoice ids of both registers to their records.
+
+    Returns: (closed items, new open items)
+    """
+    closed: List[ClosedItem] = []
+    opened: List[OpenItem] = []
+    for source, rec in _single_sided(results, records):
+        item = OpenItem.from_record(rec, source, return_period)
+        other = GSTR2B_SOURCE if source == PR_SOURCE else PR_SOURCE
+        match = index.take(other, item.match_key, rec, engine)
+        if match is not None:
+            closed.append(ClosedItem(match, rec.id, return_period))
+        else:
+            opened.append(item)
+    return closed, opened
+
+
+def _single_sided(
+    results: Iterable[MatchResult],
+    records: Dict[str, InvoiceRecord]
+) -> Iterator[Tuple[str, InvoiceRecord]]:
+    """(source, record) of every PR_ONLY / GSTR2B_ONLY result with an invoice number"""
+    for result in results:
+        source = OPEN_STATUSES.get(result.status)
+        if source is None:
+            continue
+        rec = records.get(result.pr_invoice_id or result.gstr2b_invoice_id)
+        if rec is not None and rec.key:
+            yield source, rec
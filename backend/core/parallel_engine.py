@@ -0,0 +1,316 @@
+"""
+Parallel Reconciliation Engine
+Shards reconciliation by vendor PAN across a pool of worker processes
+"""
+from typing import List, Dict, Tuple, Optional, Iterator
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import heapq
+from threading import BrokenBarrierError
+import multiprocessing
+import os
+import threading
+
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext, ReconciliationTotals, MatchResult
+from core.invoice_record import InvoiceRecord, RecordBuilder, normalize_gstin, gstin_pan
+from core.candidate_index import CandidateIndex, merge_bucket_stats
+from core.vendor_summary import VendorAggregate
+
+
+# Below this many invoices, process start-up and pickling cost more than they save
+PARALLEL_MIN_ROWS = 20000
+
+# Shards per worker; more shards even out skewed vendors at a small pickling cost
+SHARDS_PER_WORKER = 4
+
+# Workers start from a clean server process (not a fork of the threaded API process)
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Modules the fork server imports once, so every worker starts with them loaded
+PRELOAD_MODULES = ["core.reconciliation_engine", "core.candidate_index", "core.invoice_record", "core.parallel_engine"]
+
+# How long a warm-up task waits for the other workers to start
+WARM_TIMEOUT_SECONDS = 60
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+_warm_barrier = None  # In a worker: the pool's warm-up barrier
+
+
+def _preload_worker(barrier) -> None:
+    """Pool initializer: import the matching stack once per worker process"""
+    global _warm_barrier
+    _warm_barrier = barrier
+    import core.reconciliation_engine  # noqa: F401
+    import core.candidate_index  # noqa: F401
+    import core.invoice_record  # noqa: F401
+
+
+def start_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Create (or resize) the shared worker pool"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None and _pool_workers != workers:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            context = multiprocessing.get_context(POOL_START_METHOD)
+            if POOL_START_METHOD == "forkserver":
+                context.set_forkserver_preload(PRELOAD_MODULES)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=context,
+                initializer=_preload_worker,
+                initargs=(context.Barrier(workers),)
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def _warm_worker() -> int:
+    """Warm-up task: holds its worker until every worker has one, so each worker answers once"""
+    _warm_barrier.wait(WARM_TIMEOUT_SECONDS)
+    return os.getpid()
+
+
+def warm_process_pool(workers: int) -> int:
+    """
+    Start every worker of the shared pool now, one no-op each, so the first
+    reconciliation does not wait for them; blocks until they answer.
+    Returns the number of worker processes that answered.
+    """
+    pool = start_process_pool(workers)
+    futures = [pool.submit(_warm_worker) for _ in range(workers)]
+    started = set()
+    for future in futures:
+        try:
+            started.add(future.result())
+        except (BrokenBarrierError, BrokenProcessPool) as e:
+            print(f"⚠️ Reconciliation worker did not start: {e!r}")
+    return len(started)
+
+
+def shutdown_process_pool() -> None:
+    """Stop the shared worker pool, if one was started"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+            _pool_workers = 0
+
+
+@dataclass
+class ShardOutput:
+    """What a worker sends back for one shard; positions are shard-local"""
+    matched: List[Tuple[int, int, MatchResult]]  # (pass number, PR position, result)
+    pr_residue: List[Tuple[int, InvoiceRecord]]  # Unmatched PR records
+    gstr2b_residue: List[Tuple[int, InvoiceRecord]]  # Unclaimed GSTR-2B records
+    duplicates: List[Tuple[int, int, MatchResult]]  # (0 = PR / 1 = GSTR-2B, position, result)
+    bucket_stats: Dict
+    totals: ReconciliationTotals  # Side totals and the counts / ITC of the shard's pairs
+    vendors: Dict[Tuple[str, str], VendorAggregate]  # Vendor pre-pass aggregates
+
+
+def _reconcile_shard(
+    engine: ReconciliationEngine,
+    pass_numbers: List[int],
+    pr_invoices: List[Dict],
+    gstr2b_invoices: List[Dict]
+) -> ShardOutput:
+    """Worker task: split duplicates and run the vendor-scoped rule passes on one shard"""
+    builder = RecordBuilder()
+    pr_records = builder.build_all(pr_invoices)
+    gstr2b_records = builder.build_all(gstr2b_invoices)
+    pr_positions = {rec.id: i for i, rec in enumerate(pr_records)}
+    gstr2b_positions = {rec.id: i for i, rec in enumerate(gstr2b_records)}
+
+    # Duplicate groups share a GSTIN, so they never span shards
+    shard = ReconciliationContext()
+    shard.totals.add_records(shard.totals.pr_totals, pr_records)
+    shard.totals.add_records(shard.totals.gstr2b_totals, gstr2b_records)
+    pr_records, pr_duplicates = engine.split_duplicates(pr_records)
+    gstr2b_records, gstr2b_duplicates = engine.split_duplicates(gstr2b_records)
+    duplicates = [
+        (0, pr_positions[r.pr_invoice_id], r) if r.pr_invoice_id else (1, gstr2b_positions[r.gstr2b_invoice_id], r)
+        for r in engine.duplicate_results(pr_duplicates, gstr2b_duplicates, shard)
+    ]
+
+    # Vendors (GSTINs) never span shards either
+    paired = engine.balanced_vendor_pairs(pr_records, gstr2b_records, shard)
+    index = CandidateIndex(gstr2b_records, engine.AMOUNT_TOLERANCE_PAISE, engine.MAX_BUCKET_SIZE, paired)
+    claimed = [False] * len(gstr2b_records)
+    matched = []
+    for pass_no, pr_rec, pos in engine.iter_passes(pass_numbers, pr_records, index, claimed):
+        result = engine.pass_result(pass_no, pr_rec, gstr2b_records[pos])
+        shard.record_match(result, gstr2b_records[pos])
+        matched.append((pass_no, pr_positions[pr_rec.id], result))
+
+    return ShardOutput(
+        matched=matched,
+        pr_residue=[
+            (pr_positions[rec.id], rec) for rec in pr_records if rec.id not in shard.matched_pr_ids
+        ],
+        gstr2b_residue=[
+            (gstr2b_positions[rec.id], rec) for i, rec in enumerate(gstr2b_records) if not claimed[i]
+        ],
+        duplicates=duplicates,
+        bucket_stats=index.stats(),
+        totals=shard.totals,
+        vendors=shard.vendors,
+    )
+
+
+class ParallelReconciliationEngine(ReconciliationEngine):
+    """
+    Reconciliation sharded by vendor PAN (GSTIN characters 3-12).
+
+    Every vendor-scoped pass only pairs invoices of the same PAN (most of
+    them within one GSTIN, which belongs to exactly one PAN), so shards never
+    compete for candidates.
+    Shards run the leading vendor-scoped passes in worker processes; the
+    parent then runs the remaining passes, starting with the cross-vendor
+    GSTIN_MISMATCH pass, over the combined residue and merges all matches in
+    the single-engine order (pass, then PR file order). Output is identical
+    to ReconciliationEngine.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+
+    def reconcile_iter(
+        self,
+        pr_invoices: List[Dict],
+        gstr2b_invoices: List[Dict],
+        context: Optional[ReconciliationContext] = None
+    ) -> Iterator[MatchResult]:
+        """
+        Reconcile across worker processes, falling back to one process for a single shard.
+        Paired results are yielded once every shard has finished.
+        """
+        context = context if context is not None else ReconciliationContext()
+        shards = self._shard(pr_invoices, gstr2b_invoices)
+        if self.workers <= 1 or len(shards) <= 1:
+            yield from super().reconcile_iter(pr_invoices, gstr2b_invoices, context)
+            return
+
+        # Shards take every pass up to the first cross-vendor one; the parent the rest
+        split = next(
+            (i for i, rule_pass in enumerate(self.RULE_PASSES) if not rule_pass.vendor_scoped),
+            len(self.RULE_PASSES)
+        )
+        shard_passes = list(range(split))
+        final_passes = list(range(split, len(self.RULE_PASSES)))
+
+        try:
+            pool = start_process_pool(self.workers)
+            outputs = list(pool.map(
+                _reconcile_shard,
+                [self] * len(shards),
+                [shard_passes] * len(shards),
+                [[pr_invoices[i] for i in pr_positions] for pr_positions, _ in shards],
+                [[gstr2b_invoices[i] for i in gstr2b_positions] for _, gstr2b_positions in shards],
+            ))
+        except BrokenProcessPool as e:
+            print(f"⚠️ Reconciliation worker pool failed, running in-process: {e}")
+            shutdown_process_pool()
+            yield from super().reconcile_iter(pr_invoices, gstr2b_invoices, context)
+            return
+
+        # Deterministic merge: map shard-local positions back to global ones
+        tagged: List[Tuple[int, int, MatchResult]] = []
+        duplicates: List[Tuple[int, int, MatchResult]] = []
+        pr_residue: List[Tuple[int, InvoiceRecord]] = []
+        gstr2b_residue: List[Tuple[int, InvoiceRecord]] = []
+        for (pr_positions, gstr2b_positions), output in zip(shards, outputs):
+            context.totals.merge(output.totals)
+            context.vendors.update(output.vendors)
+            tagged.extend((pass_no, pr_positions[i], result) for pass_no, i, result in output.matched)
+            duplicates.extend(
+                (side, (pr_positions, gstr2b_positions)[side][i], result)
+                for side, i, result in output.duplicates
+            )
+            pr_residue.extend((pr_positions[i], rec) for i, rec in output.pr_residue)
+            gstr2b_residue.extend((gstr2b_positions[i], rec) for i, rec in output.gstr2b_residue)
+        context.bucket_stats = merge_bucket_stats([output.bucket_stats for output in outputs])
+
+        # Final step: remaining passes over the residue of every shard
+        pr_residue.sort(key=lambda item: item[0])
+        gstr2b_residue.sort(key=lambda item: item[0])
+        gstr2b_records = [rec for _, rec in gstr2b_residue]
+        index = CandidateIndex(gstr2b_records, self.AMOUNT_TOLERANCE_PAISE, self.MAX_BUCKET_SIZE)
+        claimed = [False] * len(gstr2b_records)
+        pr_global = {rec.id: pos for pos, rec in pr_residue}
+        pending = [rec for _, rec in pr_residue]
+        for pass_no, pr_rec, pos in self.iter_passes(final_passes, pending, index, claimed):
+            result = self.pass_result(pass_no, pr_rec, gstr2b_records[pos])
+            context.totals.add_pair(result.status, gstr2b_records[pos])
+            tagged.append((pass_no, pr_global[pr_rec.id], result))
+
+        tagged.sort(key=lambda item: (item[0], item[1]))
+        for _, _, result in tagged:
+            context.record_match(result)
+            yield result
+
+        # Split matching over the combined residue, as in the single-process engine
+        yield from self.split_results(
+            [rec for rec in pending if rec.id not in context.matched_pr_ids],
+            [rec for pos, rec in enumerate(gstr2b_records) if not claimed[pos]],
+            context
+        )
+
+        duplicates.sort(key=lambda item: (item[0], item[1]))
+        pr_duplicate_ids = {r.pr_invoice_id for side, _, r in duplicates if side == 0}
+        gstr2b_duplicate_ids = {r.gstr2b_invoice_id for side, _, r in duplicates if side == 1}
+        yield from self.unmatched_results(
+            [inv["id"] for inv in pr_invoices if inv["id"] not in pr_duplicate_ids],
+            [inv["id"] for inv in gstr2b_invoices if inv["id"] not in gstr2b_duplicate_ids],
+            context
+        )
+        for _, _, result in duplicates:
+            yield result
+
+    def _shard(
+        self,
+        pr_invoices: List[Dict],
+        gstr2b_invoices: List[Dict]
+    ) -> List[Tuple[List[int], List[int]]]:
+        """
+        Group invoice positions by vendor PAN and pack PANs into balanced shards.
+        Positions stay in file order inside each shard.
+        """
+        pans: Dict[str, str] = {}
+        groups: Dict[str, Tuple[List[int], List[int]]] = {}
+        for side, invoices in enumerate((pr_invoices, gstr2b_invoices)):
+            for pos, inv in enumerate(invoices):
+                raw = inv.get("vendor_gstin") or ""
+                pan = pans.get(raw)
+                if pan is None:
+                    pan = pans[raw] = gstin_pan(normalize_gstin(raw))
+                group = groups.get(pan)
+                if group is None:
+                    group = groups[pan] = ([], [])
+                group[side].append(pos)
+
+        shard_count = min(len(groups), self.workers * SHARDS_PER_WORKER)
+        if shard_count <= 1:
+            return [(list(range(len(pr_invoices))), list(range(len(gstr2b_invoices))))]
+
+        # Greedy largest-first packing onto the lightest shard (ties by shard number)
+        heap = [(0, n) for n in range(shard_count)]
+        members: List[List[str]] = [[] for _ in range(shard_count)]
+        by_size = sorted(groups.items(), key=lambda item: (-(len(item[1][0]) + len(item[1][1])), item[0]))
+        for pan, (pr_positions, gstr2b_positions) in by_size:
+            load, n = heapq.heappop(heap)
+            members[n].append(pan)
+            heapq.heappush(heap, (load + len(pr_positions) + len(gstr2b_positions), n))
+
+        shards = []
+        for pan_list in members:
+            pr_positions = sorted(i for pan in pan_list for i in groups[pan][0])
+            gstr2b_positions = sorted(i for pan in pan_list for i in groups[pan][1])
+            shards.append((pr_positions, gstr2b_positions))
+        return shards
@@ -2,11 +2,17 @@
 GST Reconciliation Engine
 Deterministic, rule-based matching logic for Purchase Register vs GSTR-2B
 """
-from typing import List, Dict, Tuple, Optional
-from dataclasses import dataclass
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Set, NamedTuple
+from dataclasses import dataclass, field
 from enum import Enum
-import re
-from decimal import Decimal, ROUND_HALF_UP
+
+from core.candidate_index import CandidateIndex, MAX_BUCKET_SIZE
+from core.fuzzy_index import DEFAULT_FUZZY_THRESHOLDS
+from core.split_matcher import SplitMatcher, SplitGroup, combined_record, SPLIT_MAX_GROUP, SPLIT_MAX_CANDIDATES
+from core.vendor_summary import VendorAggregate, aggregate_vendors, balanced_pairs
+from core.invoice_record import (
+    InvoiceRecord, RecordBuilder, normalize_invoice_no, normalize_gstin, gstin_pan, to_paise, from_paise
+)
 
 
 class MatchStatus(str, Enum):
@@ -14,6 +20,8 @@ class MatchStatus(str, Enum):
     AMOUNT_MISMATCH = "amount_mismatch"
     DATE_MISMATCH = "date_mismatch"
     GSTIN_MISMATCH = "gstin_mismatch"
+    INVOICE_MISMATCH = "invoice_mismatch"
+    SPLIT_MATCH = "split_match"
     PR_ONLY = "pr_only"
     GSTR2B_ONLY = "gstr2b_only"
     DUPLICATE = "duplicate"
@@ -32,54 +40,236 @@ class MatchResult:
     cgst_diff: float = 0
     sgst_diff: float = 0
     total_diff: float = 0
+    duplicate_of: Optional[str] = None  # DUPLICATE: id of the row kept for matching
+
+
+# Amount columns totalled per side, and tax heads tracked for ITC
+TOTAL_FIELDS = ("taxable", "igst", "cgst", "sgst", "cess", "total_tax")
+ITC_HEADS = ("igst", "cgst", "sgst", "cess", "total_tax")
+
+# Paired statuses whose GSTR-2B tax is claimable / at risk
+ITC_CLAIMABLE_STATUSES = frozenset({MatchStatus.EXACT_MATCH})
+ITC_AT_RISK_STATUSES = frozenset({
+    MatchStatus.AMOUNT_MISMATCH, MatchStatus.DATE_MISMATCH, MatchStatus.GSTIN_MISMATCH,
+    MatchStatus.INVOICE_MISMATCH, MatchStatus.SPLIT_MATCH
+})
+
+
+@dataclass
+class ReconciliationTotals:
+    """
+    Single-pass accumulator filled while matching: result counts per status,
+    amount totals per side and ITC claimable / at risk per tax head.
+    All amounts are integer paise.
+    """
+    status_counts: Dict[str, int] = field(default_factory=dict)
+    pr_totals: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(TOTAL_FIELDS, 0))
+    gstr2b_totals: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(TOTAL_FIELDS, 0))
+    itc_claimable: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(ITC_HEADS, 0))
+    itc_at_risk: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(ITC_HEADS, 0))
+    
+    def count(self, status: MatchStatus, n: int = 1) -> None:
+        """Count n results with the given status"""
+        self.status_counts[status.value] = self.status_counts.get(status.value, 0) + n
+    
+    def add_records(self, side_totals: Dict[str, int], records: Iterable[InvoiceRecord]) -> None:
+        """Add a side's invoice amounts (pr_totals or gstr2b_totals)"""
+        for rec in records:
+            for f in TOTAL_FIELDS:
+                side_totals[f] += getattr(rec, f)
+    
+    def add_pair(self, status: MatchStatus, gstr2b: InvoiceRecord) -> None:
+        """Count a paired result and book its GSTR-2B tax as claimable or at risk"""
+        self.count(status)
+        itc = self._itc_bucket(status)
+        if itc is not None:
+            itc["igst"] += gstr2b.igst
+            itc["cgst"] += gstr2b.cgst
+            itc["sgst"] += gstr2b.sgst
+            itc["cess"] += gstr2b.cess
+            itc["total_tax"] += gstr2b.total_tax
+    
+    def add_pair_amounts(self, status: MatchStatus, n: int, gstr2b_tax: Dict[str, int]) -> None:
+        """add_pair for n pairs at once, given the summed GSTR-2B tax per head"""
+        if not n:
+            return
+        self.count(status, n)
+        itc = self._itc_bucket(status)
+        if itc is not None:
+            for head in ITC_HEADS:
+                itc[head] += gstr2b_tax[head]
+    
+    def _itc_bucket(self, status: MatchStatus) -> Optional[Dict[str, int]]:
+        if status in ITC_CLAIMABLE_STATUSES:
+            return self.itc_claimable
+        if status in ITC_AT_RISK_STATUSES:
+            return self.itc_at_risk
+        return None
+    
+    def merge(self, other: "ReconciliationTotals") -> None:
+        """Add another accumulator (e.g. from a worker shard) into this one"""
+        for status, n in other.status_counts.items():
+            self.status_counts[status] = self.status_counts.get(status, 0) + n
+        for mine, theirs in (
+            (self.pr_totals, other.pr_totals),
+            (self.gstr2b_totals, other.gstr2b_totals),
+            (self.itc_claimable, other.itc_claimable),
+            (self.itc_at_risk, other.itc_at_risk),
+        ):
+            for key, value in theirs.items():
+                mine[key] += value
+    
+    def as_dict(self) -> Dict:
+        """Totals in rupees, for API responses"""
+        return {
+            "status_counts": dict(self.status_counts),
+            "pr_totals": {k: from_paise(v) for k, v in self.pr_totals.items()},
+            "gstr2b_totals": {k: from_paise(v) for k, v in self.gstr2b_totals.items()},
+            "itc_claimable": {k: from_paise(v) for k, v in self.itc_claimable.items()},
+            "itc_at_risk": {k: from_paise(v) for k, v in self.itc_at_risk.items()},
+        }
+
+
+@dataclass
+class ReconciliationContext:
+    """
+    Per-run reconciliation state.
+    
+    The engine itself holds only configuration; everything a run produces
+    lives here, so one engine instance can serve concurrent runs from
+    worker threads without locks. Pass a context to reconcile() to read
+    it back after the run.
+    """
+    matched_pr_ids: Set[str] = field(default_factory=set)
+    matched_gstr2b_ids: Set[str] = field(default_factory=set)
+    bucket_stats: Dict = field(default_factory=dict)
+    totals: ReconciliationTotals = field(default_factory=ReconciliationTotals)
+    vendors: Dict[Tuple[str, str], VendorAggregate] = field(default_factory=dict)  # By (GSTIN, period)
+    
+    def record_match(self, result: MatchResult, gstr2b: Optional[InvoiceRecord] = None) -> None:
+        """
+        Mark the invoices of a paired result as matched.
+        With the GSTR-2B record, the pair is also added to the totals.
+        """
+        self.matched_pr_ids.add(result.pr_invoice_id)
+        self.matched_gstr2b_ids.add(result.gstr2b_invoice_id)
+        if gstr2b is not None:
+            self.totals.add_pair(result.status, gstr2b)
+    
+    def vendor_summary(self) -> List[Dict]:
+        """Per-vendor, per-period summary rows (rupees), sorted by GSTIN and period"""
+        return [vendor.as_dict() for _, vendor in sorted(self.vendors.items())]
+
+
+class RulePass(NamedTuple):
+    """One matching rule, applied as a pass over the unmatched PR records"""
+    status: MatchStatus
+    finder: str  # ReconciliationEngine method returning the GSTR-2B position to pair
+    vendor_scoped: bool  # Only ever pairs invoices of the same vendor PAN
+    rule: Optional[Tuple[float, str]] = None  # (confidence, audit text) when not RULES[status]
 
 
 class ReconciliationEngine:
     """
     DETERMINISTIC GST Reconciliation Engine
     
-    Matching Rules (in order of priority):
-    1. Exact Match: GSTIN + Invoice No + Amount (all taxes)
-    2. Amount Mismatch: GSTIN + Invoice No match, amounts differ
-    3. Date Mismatch: GSTIN + Invoice No + Amount match, dates differ
-    4. GSTIN Mismatch: Invoice No + Amount match, GSTIN differs (potential data entry error)
-    5. PR Only: Invoice in Purchase Register, not found in GSTR-2B
-    6. GSTR-2B Only: Invoice in GSTR-2B, not found in Purchase Register
+    Matching Rules (in order of priority, each applied as a pass over unmatched invoices):
+    1. Exact Match: GSTIN + Invoice No + Amount (all taxes), dates within the date window
+    2. Date Mismatch: GSTIN + Invoice No + Amount match, dates outside the window
+    3. Amount Mismatch: GSTIN + Invoice No match, amounts differ
+    4. GSTIN Mismatch (cross-branch): Invoice No + Amount match, same PAN, GSTIN
+       differs (same legal entity billed from / booked under another state)
+    5. GSTIN Mismatch: Invoice No + Amount match, GSTIN differs (potential data entry error)
+    6. Invoice Mismatch (fuzzy): GSTIN + Amount match, invoice no similar
+       (one is the tail of the other, or one edit apart with the same digits)
+    7. Invoice Mismatch: GSTIN + Amount match, dated within the window, invoice no differs
+    8. Invoice Mismatch (amount only): GSTIN + invoice total match, any invoice no or date
+    9. Split Match: one invoice = several invoices of the same GSTIN on the
+       other side (summed amounts match), searched within each vendor's residue
+    10. PR Only: Invoice in Purchase Register, not found in GSTR-2B
+    11. GSTR-2B Only: Invoice in GSTR-2B, not found in Purchase Register
+    
+    Repeated rows within one register (same GSTIN + Invoice No + Amounts) are
+    split off first: the first row of each group is matched and the rest are
+    reported as DUPLICATE, pointing at that row.
     
     This engine is:
     - Deterministic: Same inputs always produce same outputs
     - Testable: Each rule can be unit tested
     - Auditable: Every decision is logged with the rule applied
+    - Reentrant: Per-run state lives in a ReconciliationContext, never on the engine
     """
     
-    # Tolerance for amount matching (in INR)
-    AMOUNT_TOLERANCE = Decimal("1.00")
+    # All amounts are integer paise (₹1 = 100 paise)
+    
+    # Tolerance for amount matching
+    AMOUNT_TOLERANCE_PAISE = 100  # ₹1
+    
+    # Percentage tolerance for large amounts, in basis points
+    PERCENTAGE_TOLERANCE_BPS = 100  # 1%
+    
+    # Amounts above this use the percentage tolerance
+    PERCENTAGE_THRESHOLD_PAISE = 1000000  # ₹10,000
+    
+    # Invoice dates this many days apart still count as the same date
+    DATE_TOLERANCE_DAYS = 30
+    
+    # Candidate buckets above this size are split further (skew protection)
+    MAX_BUCKET_SIZE = MAX_BUCKET_SIZE
+    
+    # Similar invoice number thresholds (Rule 6)
+    FUZZY_THRESHOLDS = DEFAULT_FUZZY_THRESHOLDS
     
-    # Percentage tolerance for large amounts
-    PERCENTAGE_TOLERANCE = Decimal("0.01")  # 1%
+    # Split / merged invoice stage, with its caps per invoice
+    SPLIT_MATCHING = True
+    SPLIT_MAX_GROUP = SPLIT_MAX_GROUP
+    SPLIT_MAX_CANDIDATES = SPLIT_MAX_CANDIDATES
     
-    def __init__(self):
-        self.matched_pr_ids = set()
-        self.matched_gstr2b_ids = set()
+    # Cross-branch GSTIN mismatch: same PAN, so the same legal entity
+    BRANCH_MISMATCH_RULE = (80.0, "GSTIN_MISMATCH: Invoice No + Amounts match, same PAN, branch GSTIN differs")
+    
+    # Rule passes in priority order
+    RULE_PASSES = (
+        RulePass(MatchStatus.EXACT_MATCH, "find_identical", True),
+        RulePass(MatchStatus.EXACT_MATCH, "find_exact", True),
+        RulePass(MatchStatus.DATE_MISMATCH, "find_date_mismatch", True),
+        RulePass(MatchStatus.AMOUNT_MISMATCH, "find_amount_mismatch", True),
+        RulePass(MatchStatus.GSTIN_MISMATCH, "find_branch_mismatch", True, BRANCH_MISMATCH_RULE),
+        RulePass(MatchStatus.GSTIN_MISMATCH, "find_gstin_mismatch", False),
+        RulePass(
+            MatchStatus.INVOICE_MISMATCH, "find_similar_invoice", True,
+            (65.0, "INVOICE_MISMATCH: GSTIN + Amounts match, Invoice No similar (fuzzy)")
+        ),
+        RulePass(MatchStatus.INVOICE_MISMATCH, "find_invoice_mismatch", True),
+        RulePass(
+            MatchStatus.INVOICE_MISMATCH, "find_amount_only", True,
+            (50.0, "INVOICE_MISMATCH: GSTIN + Invoice total match only (amount-only candidate)")
+        ),
+    )
+    
+    # Audit text of DUPLICATE results, followed by the register and row of the kept row
+    DUPLICATE_RULE = "DUPLICATE: Same GSTIN + Invoice No + Amounts as"
+    
+    # Confidence score and audit text per pairing rule
+    RULES = {
+        MatchStatus.EXACT_MATCH: (100.0, "EXACT_MATCH: GSTIN + Invoice No + All Amounts"),
+        MatchStatus.DATE_MISMATCH: (90.0, "DATE_MISMATCH: GSTIN + Invoice No + All Amounts match, dates differ"),
+        MatchStatus.AMOUNT_MISMATCH: (85.0, "AMOUNT_MISMATCH: GSTIN + Invoice No match, amounts differ"),
+        MatchStatus.GSTIN_MISMATCH: (70.0, "GSTIN_MISMATCH: Invoice No + Amounts match, GSTIN differs"),
+        MatchStatus.INVOICE_MISMATCH: (60.0, "INVOICE_MISMATCH: GSTIN + Amounts + Date window match, Invoice No differs"),
+        MatchStatus.SPLIT_MATCH: (75.0, "SPLIT_MATCH: GSTIN + summed Amounts match"),
+    }
     
     def normalize_invoice_no(self, invoice_no: str) -> str:
         """
         Normalize invoice number for matching.
         Removes spaces, special chars, converts to uppercase.
         """
-        if not invoice_no:
-            return ""
-        # Remove common prefixes/suffixes
-        normalized = invoice_no.upper().strip()
-        # Remove special characters except alphanumeric
-        normalized = re.sub(r'[^A-Z0-9]', '', normalized)
-        return normalized
+        return normalize_invoice_no(invoice_no)
     
     def normalize_gstin(self, gstin: str) -> str:
         """Normalize GSTIN for matching"""
-        if not gstin:
-            return ""
-        return gstin.upper().strip().replace(" ", "")
+        return normalize_gstin(gstin)
     
     def amounts_match(
         self, 
@@ -88,21 +278,28 @@ class ReconciliationEngine:
         use_percentage: bool = False
     ) -> bool:
         """
-        Check if two amounts match within tolerance.
+        Check if two rupee amounts match within tolerance.
         For small amounts: absolute tolerance
         For large amounts: percentage tolerance
         """
-        a1 = Decimal(str(amount1))
-        a2 = Decimal(str(amount2))
-        diff = abs(a1 - a2)
+        return self.paise_match(to_paise(amount1), to_paise(amount2), use_percentage)
+    
+    def paise_match(
+        self, 
+        paise1: int, 
+        paise2: int, 
+        use_percentage: bool = False
+    ) -> bool:
+        """amounts_match on integer paise (pure integer comparisons)"""
+        diff = abs(paise1 - paise2)
         
-        if use_percentage and (a1 > 10000 or a2 > 10000):
+        if use_percentage and (
+            paise1 > self.PERCENTAGE_THRESHOLD_PAISE or paise2 > self.PERCENTAGE_THRESHOLD_PAISE
+        ):
             # Use percentage for large amounts
-            max_val = max(a1, a2)
-            if max_val > 0:
-                return (diff / max_val) <= self.PERCENTAGE_TOLERANCE
+            return diff * 10000 <= max(paise1, paise2) * self.PERCENTAGE_TOLERANCE_BPS
         
-        return diff <= self.AMOUNT_TOLERANCE
+        return diff <= self.AMOUNT_TOLERANCE_PAISE
     
     def calculate_differences(
         self, 
@@ -110,16 +307,21 @@ class ReconciliationEngine:
         gstr2b_invoice: Dict
     ) -> Dict[str, float]:
         """Calculate all amount differences between invoices"""
+        builder = RecordBuilder()
+        return self.record_differences(builder.build(pr_invoice), builder.build(gstr2b_invoice))
+    
+    def record_differences(
+        self, 
+        pr: InvoiceRecord, 
+        gstr2b: InvoiceRecord
+    ) -> Dict[str, float]:
+        """Calculate all amount differences between two normalized records"""
         return {
-            "taxable_diff": float(pr_invoice.get("taxable_value", 0)) - float(gstr2b_invoice.get("taxable_value", 0)),
-            "igst_diff": float(pr_invoice.get("igst", 0)) - float(gstr2b_invoice.get("igst", 0)),
-            "cgst_diff": float(pr_invoice.get("cgst", 0)) - float(gstr2b_invoice.get("cgst", 0)),
-            "sgst_diff": float(pr_invoice.get("sgst", 0)) - float(gstr2b_invoice.get("sgst", 0)),
-            "total_diff": (
-                float(pr_invoice.get("taxable_value", 0)) + float(pr_invoice.get("total_tax", 0))
-            ) - (
-                float(gstr2b_invoice.get("taxable_value", 0)) + float(gstr2b_invoice.get("total_tax", 0))
-            )
+            "taxable_diff": from_paise(pr.taxable - gstr2b.taxable),
+            "igst_diff": from_paise(pr.igst - gstr2b.igst),
+            "cgst_diff": from_paise(pr.cgst - gstr2b.cgst),
+            "sgst_diff": from_paise(pr.sgst - gstr2b.sgst),
+            "total_diff": from_paise(pr.total - gstr2b.total),
         }
     
     def match_single_pair(
@@ -131,177 +333,490 @@ class ReconciliationEngine:
         Attempt to match a single pair of invoices.
         Returns MatchResult if they match, None otherwise.
         """
-        # Normalize for comparison
-        pr_inv_no = self.normalize_invoice_no(pr_invoice.get("invoice_no", ""))
-        gstr2b_inv_no = self.normalize_invoice_no(gstr2b_invoice.get("invoice_no", ""))
-        
-        pr_gstin = self.normalize_gstin(pr_invoice.get("vendor_gstin", ""))
-        gstr2b_gstin = self.normalize_gstin(gstr2b_invoice.get("vendor_gstin", ""))
-        
-        # Invoice numbers must match (after normalization)
-        if pr_inv_no != gstr2b_inv_no:
-            return None
-        
-        # Calculate amount differences
-        diffs = self.calculate_differences(pr_invoice, gstr2b_invoice)
-        
-        # Check GSTIN match
-        gstin_match = pr_gstin == gstr2b_gstin
-        
-        # Check amount matches
-        taxable_match = self.amounts_match(
-            pr_invoice.get("taxable_value", 0),
-            gstr2b_invoice.get("taxable_value", 0),
-            use_percentage=True
-        )
-        igst_match = self.amounts_match(
-            pr_invoice.get("igst", 0),
-            gstr2b_invoice.get("igst", 0)
-        )
-        cgst_match = self.amounts_match(
-            pr_invoice.get("cgst", 0),
-            gstr2b_invoice.get("cgst", 0)
+        builder = RecordBuilder()
+        return self.match_records(builder.build(pr_invoice), builder.build(gstr2b_invoice))
+    
+    def all_amounts_match(
+        self, 
+        pr: InvoiceRecord, 
+        gstr2b: InvoiceRecord
+    ) -> bool:
+        """Taxable value (with percentage tolerance) and every tax head match"""
+        return (
+            self.paise_match(pr.taxable, gstr2b.taxable, use_percentage=True)
+            and self.paise_match(pr.igst, gstr2b.igst)
+            and self.paise_match(pr.cgst, gstr2b.cgst)
+            and self.paise_match(pr.sgst, gstr2b.sgst)
         )
-        sgst_match = self.amounts_match(
-            pr_invoice.get("sgst", 0),
-            gstr2b_invoice.get("sgst", 0)
+    
+    def dates_match(
+        self, 
+        pr: InvoiceRecord, 
+        gstr2b: InvoiceRecord
+    ) -> bool:
+        """Invoice dates within DATE_TOLERANCE_DAYS (a missing date never disqualifies)"""
+        if pr.date_ordinal is None or gstr2b.date_ordinal is None:
+            return True
+        return abs(pr.date_ordinal - gstr2b.date_ordinal) <= self.DATE_TOLERANCE_DAYS
+    
+    def pair_result(
+        self, 
+        status: MatchStatus, 
+        pr: InvoiceRecord, 
+        gstr2b: InvoiceRecord,
+        rule: Optional[Tuple[float, str]] = None
+    ) -> MatchResult:
+        """Build the MatchResult for a pair resolved by the given rule (default: RULES[status])"""
+        confidence, rule = rule or self.RULES[status]
+        return MatchResult(
+            status=status,
+            pr_invoice_id=pr.id,
+            gstr2b_invoice_id=gstr2b.id,
+            confidence_score=confidence,
+            match_rule=rule,
+            **self.record_differences(pr, gstr2b)
         )
+    
+    def pass_result(
+        self, 
+        pass_no: int, 
+        pr: InvoiceRecord, 
+        gstr2b: InvoiceRecord
+    ) -> MatchResult:
+        """Build the MatchResult for a pair claimed by RULE_PASSES[pass_no]"""
+        rule_pass = self.RULE_PASSES[pass_no]
+        return self.pair_result(rule_pass.status, pr, gstr2b, rule_pass.rule)
+    
+    def match_records(
+        self, 
+        pr: InvoiceRecord, 
+        gstr2b: InvoiceRecord
+    ) -> Optional[MatchResult]:
+        """match_single_pair on normalized records"""
+        # Invoice numbers must match (after normalization)
+        if pr.key != gstr2b.key:
+            return None
         
-        all_amounts_match = taxable_match and igst_match and cgst_match and sgst_match
+        gstin_match = pr.gstin == gstr2b.gstin
+        all_amounts_match = self.all_amounts_match(pr, gstr2b)
         
         # Determine match status
-        if gstin_match and all_amounts_match:
-            # Rule 1: Exact Match
-            return MatchResult(
-                status=MatchStatus.EXACT_MATCH,
-                pr_invoice_id=pr_invoice["id"],
-                gstr2b_invoice_id=gstr2b_invoice["id"],
-                confidence_score=100.0,
-                match_rule="EXACT_MATCH: GSTIN + Invoice No + All Amounts",
-                **diffs
-            )
-        
+        if gstin_match and all_amounts_match and self.dates_match(pr, gstr2b):
+            return self.pair_result(MatchStatus.EXACT_MATCH, pr, gstr2b)
+        elif gstin_match and all_amounts_match:
+            return self.pair_result(MatchStatus.DATE_MISMATCH, pr, gstr2b)
         elif gstin_match and not all_amounts_match:
-            # Rule 2: Amount Mismatch
-            return MatchResult(
-                status=MatchStatus.AMOUNT_MISMATCH,
-                pr_invoice_id=pr_invoice["id"],
-                gstr2b_invoice_id=gstr2b_invoice["id"],
-                confidence_score=85.0,
-                match_rule="AMOUNT_MISMATCH: GSTIN + Invoice No match, amounts differ",
-                **diffs
-            )
-        
+            return self.pair_result(MatchStatus.AMOUNT_MISMATCH, pr, gstr2b)
+        elif not gstin_match and all_amounts_match and gstin_pan(pr.gstin) == gstin_pan(gstr2b.gstin):
+            return self.pair_result(MatchStatus.GSTIN_MISMATCH, pr, gstr2b, self.BRANCH_MISMATCH_RULE)
         elif not gstin_match and all_amounts_match:
-            # Rule 4: GSTIN Mismatch (potential data entry error)
-            return MatchResult(
-                status=MatchStatus.GSTIN_MISMATCH,
-                pr_invoice_id=pr_invoice["id"],
-                gstr2b_invoice_id=gstr2b_invoice["id"],
-                confidence_score=70.0,
-                match_rule="GSTIN_MISMATCH: Invoice No + Amounts match, GSTIN differs",
-                **diffs
-            )
+            return self.pair_result(MatchStatus.GSTIN_MISMATCH, pr, gstr2b)
         
         return None
     
     def reconcile(
         self, 
         pr_invoices: List[Dict], 
-        gstr2b_invoices: List[Dict]
+        gstr2b_invoices: List[Dict],
+        context: Optional[ReconciliationContext] = None
     ) -> List[MatchResult]:
         """
         Main reconciliation method.
         
         Algorithm:
-        1. Build index of GSTR-2B invoices by normalized invoice number
-        2. For each PR invoice, find potential matches
-        3. Apply matching rules in priority order
-        4. Mark unmatched invoices as PR_ONLY or GSTR2B_ONLY
+        1. Normalize every invoice once into an InvoiceRecord
+        2. Split off duplicate rows within each register in one hash pass
+        3. Aggregate both sides per (GSTIN, period); vendors whose counts and
+           totals balance exactly have their identical invoices paired directly
+        4. Index the remaining GSTR-2B records by (GSTIN, invoice no), invoice no
+           and (invoice no, tax band), and pair identical invoices by hash lookup
+        5. Apply each matching rule as a pass over the remaining PR records,
+           resolving candidates with direct index lookups
+        6. Match split / merged invoices within each vendor's residue
+        7. Mark unmatched invoices as PR_ONLY or GSTR2B_ONLY
+        8. Report the split-off rows as DUPLICATE
+        
+        Returns: List of MatchResult objects; run state (matched ids, index
+        stats) is written to `context` when one is given
+        """
+        return list(self.reconcile_iter(pr_invoices, gstr2b_invoices, context))
+    
+    def reconcile_iter(
+        self, 
+        pr_invoices: List[Dict], 
+        gstr2b_invoices: List[Dict],
+        context: Optional[ReconciliationContext] = None
+    ) -> Iterator[MatchResult]:
+        """
+        Streaming variant of reconcile: yields results as each phase produces
+        them (exact matches, then mismatches, then PR_ONLY and GSTR2B_ONLY),
+        in the same order reconcile returns them.
+        """
+        builder = RecordBuilder()
+        yield from self.iter_records(
+            builder.build_all(pr_invoices),
+            builder.build_all(gstr2b_invoices),
+            context
+        )
+    
+    def reconcile_records(
+        self, 
+        pr_records: List[InvoiceRecord], 
+        gstr2b_records: List[InvoiceRecord],
+        context: Optional[ReconciliationContext] = None
+    ) -> List[MatchResult]:
+        """reconcile on normalized records"""
+        return list(self.iter_records(pr_records, gstr2b_records, context))
+    
+    def iter_records(
+        self, 
+        pr_records: List[InvoiceRecord], 
+        gstr2b_records: List[InvoiceRecord],
+        context: Optional[ReconciliationContext] = None
+    ) -> Iterator[MatchResult]:
+        """reconcile_iter on normalized records"""
+        context = context if context is not None else ReconciliationContext()
+        context.totals.add_records(context.totals.pr_totals, pr_records)
+        context.totals.add_records(context.totals.gstr2b_totals, gstr2b_records)
+        
+        # Duplicate rows are reported, not matched: one representative per group stays
+        pr_records, pr_duplicates = self.split_duplicates(pr_records)
+        gstr2b_records, gstr2b_duplicates = self.split_duplicates(gstr2b_records)
+        
+        yield from self.iter_matches(pr_records, gstr2b_records, context)
+        yield from self.duplicate_results(pr_duplicates, gstr2b_duplicates, context)
+    
+    def iter_matches(
+        self, 
+        pr_records: List[InvoiceRecord], 
+        gstr2b_records: List[InvoiceRecord],
+        context: ReconciliationContext
+    ) -> Iterator[MatchResult]:
+        """Rule passes, split matching, then PR_ONLY / GSTR2B_ONLY, over de-duplicated records"""
+        paired = self.balanced_vendor_pairs(pr_records, gstr2b_records, context)
+        index = CandidateIndex(gstr2b_records, self.AMOUNT_TOLERANCE_PAISE, self.MAX_BUCKET_SIZE, paired)
+        context.bucket_stats = index.stats()
+        claimed = [False] * len(gstr2b_records)
         
-        Returns: List of MatchResult objects
+        for pass_no, pr_rec, pos in self.iter_passes(range(len(self.RULE_PASSES)), pr_records, index, claimed):
+            result = self.pass_result(pass_no, pr_rec, gstr2b_records[pos])
+            context.record_match(result, gstr2b_records[pos])
+            yield result
+        
+        yield from self.split_results(
+            [rec for rec in pr_records if rec.id not in context.matched_pr_ids],
+            [rec for pos, rec in enumerate(gstr2b_records) if not claimed[pos]],
+            context
+        )
+        
+        yield from self.unmatched_results(
+            [rec.id for rec in pr_records],
+            [rec.id for rec in gstr2b_records],
+            context
+        )
+    
+    def balanced_vendor_pairs(
+        self, 
+        pr_records: List[InvoiceRecord], 
+        gstr2b_records: List[InvoiceRecord],
+        context: ReconciliationContext
+    ) -> Dict[str, int]:
         """
-        results: List[MatchResult] = []
-        self.matched_pr_ids = set()
-        self.matched_gstr2b_ids = set()
+        Vendor pre-pass: aggregate both sides per (GSTIN, period) into
+        `context.vendors` and pair the invoices of exactly balanced vendors.
         
-        # Build GSTR-2B index by normalized invoice number
-        gstr2b_index: Dict[str, List[Dict]] = {}
-        for inv in gstr2b_invoices:
-            key = self.normalize_invoice_no(inv.get("invoice_no", ""))
-            if key:
-                if key not in gstr2b_index:
-                    gstr2b_index[key] = []
-                gstr2b_index[key].append(inv)
+        Returns: {PR record id: GSTR-2B position} for the identical-invoice rule
+        (none unless that rule is the first pass, as pre-pairing assumes)
+        """
+        context.vendors = aggregate_vendors(pr_records, gstr2b_records)
+        if not self.RULE_PASSES or self.RULE_PASSES[0].finder != "find_identical":
+            return {}
+        return balanced_pairs(pr_records, gstr2b_records, context.vendors)
+    
+    # ============================================
+    # DUPLICATES
+    # ============================================
+    
+    def split_duplicates(
+        self, 
+        records: List[InvoiceRecord]
+    ) -> Tuple[List[InvoiceRecord], List[Tuple[InvoiceRecord, InvoiceRecord]]]:
+        """
+        Group rows of one register by duplicate_key in a single hash pass.
         
-        # Phase 1: Match PR invoices against GSTR-2B
-        for pr_inv in pr_invoices:
-            pr_key = self.normalize_invoice_no(pr_inv.get("invoice_no", ""))
-            
-            if not pr_key:
+        Returns: (first row of every group, in file order,
+                  [(duplicate row, first row of its group)], in file order)
+        """
+        first: Dict[Tuple, InvoiceRecord] = {}
+        kept: List[InvoiceRecord] = []
+        duplicates: List[Tuple[InvoiceRecord, InvoiceRecord]] = []
+        for rec in records:
+            if not rec.key:
+                kept.append(rec)
                 continue
-            
-            # Find potential matches
-            potential_matches = gstr2b_index.get(pr_key, [])
-            
-            best_match: Optional[MatchResult] = None
-            
-            for gstr2b_inv in potential_matches:
-                # Skip already matched
-                if gstr2b_inv["id"] in self.matched_gstr2b_ids:
-                    continue
-                
-                match = self.match_single_pair(pr_inv, gstr2b_inv)
-                
-                if match:
-                    # Keep the best match (highest confidence)
-                    if best_match is None or match.confidence_score > best_match.confidence_score:
-                        best_match = match
-            
-            if best_match:
-                results.append(best_match)
-                self.matched_pr_ids.add(best_match.pr_invoice_id)
-                self.matched_gstr2b_ids.add(best_match.gstr2b_invoice_id)
+            original = first.setdefault(rec.duplicate_key, rec)
+            if original is rec:
+                kept.append(rec)
+            else:
+                duplicates.append((rec, original))
+        return kept, duplicates
+    
+    def duplicate_results(
+        self, 
+        pr_duplicates: List[Tuple[InvoiceRecord, InvoiceRecord]], 
+        gstr2b_duplicates: List[Tuple[InvoiceRecord, InvoiceRecord]],
+        context: ReconciliationContext
+    ) -> Iterator[MatchResult]:
+        """DUPLICATE results pointing at the row each duplicate repeats"""
+        for duplicates, source, is_pr in (
+            (pr_duplicates, "Purchase Register", True),
+            (gstr2b_duplicates, "GSTR-2B", False),
+        ):
+            for rec, original in duplicates:
+                context.totals.count(MatchStatus.DUPLICATE)
+                original_row = original.row_number if original.row_number is not None else original.id
+                yield MatchResult(
+                    status=MatchStatus.DUPLICATE,
+                    pr_invoice_id=rec.id if is_pr else None,
+                    gstr2b_invoice_id=None if is_pr else rec.id,
+                    confidence_score=100.0,
+                    match_rule=f"{self.DUPLICATE_RULE} {source} row {original_row}",
+                    duplicate_of=original.id
+                )
+    
+    # ============================================
+    # RULE PASSES
+    # ============================================
+    
+    def iter_passes(
+        self, 
+        pass_numbers: Iterable[int], 
+        pending: List[InvoiceRecord], 
+        index: CandidateIndex, 
+        claimed: List[bool]
+    ) -> Iterator[Tuple[int, InvoiceRecord, int]]:
+        """
+        Apply the given RULE_PASSES, in order, to the pending PR records.
+        Each pass pairs a PR record with the GSTR-2B position its finder returns.
         
-        # Phase 2: Mark unmatched PR invoices as PR_ONLY
-        for pr_inv in pr_invoices:
-            if pr_inv["id"] not in self.matched_pr_ids:
-                results.append(MatchResult(
+        Yields: (pass number, PR record, GSTR-2B position) as each pair is claimed
+        """
+        for pass_no in pass_numbers:
+            finder = getattr(self, self.RULE_PASSES[pass_no].finder)
+            remaining = []
+            for pr_rec in pending:
+                pos = finder(pr_rec, index, claimed)
+                if pos is None:
+                    remaining.append(pr_rec)
+                else:
+                    claimed[pos] = True
+                    yield pass_no, pr_rec, pos
+            pending = remaining
+    
+    def stages(self) -> List[Tuple[bool, List[int]]]:
+        """
+        RULE_PASSES cut into stages of consecutive passes with the same scope:
+        (vendor scoped, pass numbers) per stage. The first and last stage are
+        vendor scoped, as they also handle duplicates and split matching.
+        """
+        stages: List[Tuple[bool, List[int]]] = []
+        for pass_no, rule_pass in enumerate(self.RULE_PASSES):
+            if stages and stages[-1][0] == rule_pass.vendor_scoped:
+                stages[-1][1].append(pass_no)
+            else:
+                stages.append((rule_pass.vendor_scoped, [pass_no]))
+        if not stages or not stages[0][0]:
+            stages.insert(0, (True, []))
+        if not stages[-1][0]:
+            stages.append((True, []))
+        return stages
+    
+    def find_identical(self, pr_rec: InvoiceRecord, index: CandidateIndex, claimed: List[bool]) -> Optional[int]:
+        """Rule 1 fast path: identical normalized tuple (pre-paired for balanced vendors)"""
+        pos = index.paired.get(pr_rec.id)
+        if pos is not None:
+            return pos
+        return index.first_identical(pr_rec, claimed)
+    
+    def find_exact(self, pr_rec: InvoiceRecord, index: CandidateIndex, claimed: List[bool]) -> Optional[int]:
+        """Rule 1: same GSTIN + invoice no, all amounts within tolerance, dates within the window"""
+        for pos in index.same_gstin_invoice(pr_rec, claimed):
+            gstr2b_rec = index.records[pos]
+            if self.all_amounts_match(pr_rec, gstr2b_rec) and self.dates_match(pr_rec, gstr2b_rec):
+                return pos
+        return None
+    
+    def find_date_mismatch(self, pr_rec: InvoiceRecord, index: CandidateIndex, claimed: List[bool]) -> Optional[int]:
+        """Rule 2: same GSTIN + invoice no, all amounts within tolerance, any date"""
+        for pos in index.same_gstin_invoice(pr_rec, claimed):
+            if self.all_amounts_match(pr_rec, index.records[pos]):
+                return pos
+        return None
+    
+    def find_amount_mismatch(self, pr_rec: InvoiceRecord, index: CandidateIndex, claimed: List[bool]) -> Optional[int]:
+        """Rule 3: first unclaimed invoice with the same GSTIN + invoice no"""
+        return index.first_same_gstin_invoice(pr_rec, claimed)
+    
+    def find_branch_mismatch(self, pr_rec: InvoiceRecord, index: CandidateIndex, claimed: List[bool]) -> Optional[int]:
+        """Rule 4: same PAN + invoice no, all amounts within tolerance, different GSTIN"""
+        for pos in index.same_pan_invoice(pr_rec, claimed):
+            gstr2b_rec = index.records[pos]
+            if gstr2b_rec.gstin != pr_rec.gstin and self.all_amounts_match(pr_rec, gstr2b_rec):
+                return pos
+        return None
+    
+    def find_gstin_mismatch(self, pr_rec: InvoiceRecord, index: CandidateIndex, claimed: List[bool]) -> Optional[int]:
+        """Rule 5: same invoice no, all amounts within tolerance, different GSTIN"""
+        for pos in index.same_invoice_amount(pr_rec, claimed):
+            gstr2b_rec = index.records[pos]
+            if gstr2b_rec.gstin != pr_rec.gstin and self.all_amounts_match(pr_rec, gstr2b_rec):
+                return pos
+        return None
+    
+    def find_similar_invoice(self, pr_rec: InvoiceRecord, index: CandidateIndex, claimed: List[bool]) -> Optional[int]:
+        """Rule 6: same GSTIN, all amounts within tolerance, similar invoice no (any date)"""
+        for pos in index.similar_invoice(pr_rec, claimed, self.FUZZY_THRESHOLDS):
+            if self.all_amounts_match(pr_rec, index.records[pos]):
+                return pos
+        return None
+    
+    def find_invoice_mismatch(self, pr_rec: InvoiceRecord, index: CandidateIndex, claimed: List[bool]) -> Optional[int]:
+        """Rule 7: same GSTIN, all amounts within tolerance, nearest date within the window, invoice no differs"""
+        for pos in index.same_gstin_date_window(pr_rec, self.DATE_TOLERANCE_DAYS, claimed):
+            gstr2b_rec = index.records[pos]
+            if gstr2b_rec.key != pr_rec.key and self.all_amounts_match(pr_rec, gstr2b_rec):
+                return pos
+        return None
+    
+    def find_amount_only(self, pr_rec: InvoiceRecord, index: CandidateIndex, claimed: List[bool]) -> Optional[int]:
+        """Rule 8: same GSTIN, invoice total within the absolute tolerance (any invoice no or date)"""
+        for pos in index.same_gstin_total(pr_rec, claimed):
+            if abs(pr_rec.total - index.records[pos].total) <= self.AMOUNT_TOLERANCE_PAISE:
+                return pos
+        return None
+    
+    # ============================================
+    # SPLIT / MERGED INVOICES
+    # ============================================
+    
+    def split_results(
+        self, 
+        pr_residue: List[InvoiceRecord], 
+        gstr2b_residue: List[InvoiceRecord],
+        context: ReconciliationContext
+    ) -> Iterator[MatchResult]:
+        """
+        SPLIT_MATCH results for the residue left by the rule passes: one result
+        per (invoice, part) pair. The group's amount differences are reported
+        on its first result so that differences still add up per run.
+        """
+        for group in self.split_groups(pr_residue, gstr2b_residue):
+            yield from self.split_group_results(group, context)
+    
+    def split_groups(
+        self, 
+        pr_residue: List[InvoiceRecord], 
+        gstr2b_residue: List[InvoiceRecord]
+    ) -> List[SplitGroup]:
+        """Split / merged groups in the residue (none when SPLIT_MATCHING is off)"""
+        if not self.SPLIT_MATCHING:
+            return []
+        return SplitMatcher(self, self.SPLIT_MAX_GROUP, self.SPLIT_MAX_CANDIDATES).match(pr_residue, gstr2b_residue)
+    
+    def split_group_results(
+        self, 
+        group: SplitGroup, 
+        context: ReconciliationContext
+    ) -> Iterator[MatchResult]:
+        """SPLIT_MATCH results of one group, recorded in `context`"""
+        confidence, rule = self.RULES[MatchStatus.SPLIT_MATCH]
+        n = len(group.parts)
+        combined = combined_record(group.parts)
+        if group.single_is_pr:
+            description = f"1 Purchase Register invoice = {n} GSTR-2B invoices"
+            pairs = [(group.single, part) for part in group.parts]
+            differences = self.record_differences(group.single, combined)
+        else:
+            description = f"{n} Purchase Register invoices = 1 GSTR-2B invoice"
+            pairs = [(part, group.single) for part in group.parts]
+            differences = self.record_differences(combined, group.single)
+        
+        for i, (pr, gstr2b) in enumerate(pairs):
+            result = MatchResult(
+                status=MatchStatus.SPLIT_MATCH,
+                pr_invoice_id=pr.id,
+                gstr2b_invoice_id=gstr2b.id,
+                confidence_score=confidence,
+                match_rule=f"{rule} ({description})",
+                **(differences if i == 0 else {})
+            )
+            if group.single_is_pr or i == 0:
+                context.record_match(result, gstr2b)
+            else:
+                # Merged group: the one GSTR-2B invoice's tax is booked once
+                context.record_match(result)
+                context.totals.count(MatchStatus.SPLIT_MATCH)
+            yield result
+    
+    def unmatched_results(
+        self, 
+        pr_ids: List[str], 
+        gstr2b_ids: List[str], 
+        context: ReconciliationContext
+    ) -> Iterator[MatchResult]:
+        """PR_ONLY / GSTR2B_ONLY results for every invoice not matched in `context`, in file order"""
+        matched_pr_ids = context.matched_pr_ids
+        matched_gstr2b_ids = context.matched_gstr2b_ids
+        totals = context.totals
+        
+        # Mark unmatched PR invoices as PR_ONLY
+        for pr_id in pr_ids:
+            if pr_id not in matched_pr_ids:
+                totals.count(MatchStatus.PR_ONLY)
+                yield MatchResult(
                     status=MatchStatus.PR_ONLY,
-                    pr_invoice_id=pr_inv["id"],
+                    pr_invoice_id=pr_id,
                     gstr2b_invoice_id=None,
                     confidence_score=100.0,
                     match_rule="PR_ONLY: Invoice not found in GSTR-2B"
-                ))
+                )
         
-        # Phase 3: Mark unmatched GSTR-2B invoices as GSTR2B_ONLY
-        for gstr2b_inv in gstr2b_invoices:
-            if gstr2b_inv["id"] not in self.matched_gstr2b_ids:
-                results.append(MatchResult(
+        # Mark unmatched GSTR-2B invoices as GSTR2B_ONLY
+        for gstr2b_id in gstr2b_ids:
+            if gstr2b_id not in matched_gstr2b_ids:
+                totals.count(MatchStatus.GSTR2B_ONLY)
+                yield MatchResult(
                     status=MatchStatus.GSTR2B_ONLY,
                     pr_invoice_id=None,
-                    gstr2b_invoice_id=gstr2b_inv["id"],
+                    gstr2b_invoice_id=gstr2b_id,
                     confidence_score=100.0,
                     match_rule="GSTR2B_ONLY: Invoice not found in Purchase Register"
-                ))
-        
-        return results
+                )
     
-    def get_stats(self, results: List[MatchResult]) -> Dict:
+    def get_stats(self, results: Iterable[MatchResult]) -> Dict:
         """Calculate reconciliation statistics"""
+        status_counts: Dict[str, int] = {}
+        for r in results:
+            status_counts[r.status.value] = status_counts.get(r.status.value, 0) + 1
+        return self.stats_from_counts(status_counts)
+    
+    def stats_from_counts(self, status_counts: Dict[str, int]) -> Dict:
+        """Calculate reconciliation statistics from per-status result counts"""
         stats = {
-            "total_records": len(results),
+            "total_records": sum(status_counts.values()),
             "exact_match": 0,
             "amount_mismatch": 0,
             "date_mismatch": 0,
             "gstin_mismatch": 0,
+            "invoice_mismatch": 0,
+            "split_match": 0,
             "pr_only": 0,
             "gstr2b_only": 0,
             "duplicate": 0
         }
         
-        for r in results:
-            stats[r.status.value] = stats.get(r.status.value, 0) + 1
+        for status, count in status_counts.items():
+            stats[status] = stats.get(status, 0) + count
         
         # Calculate match rate
         auto_matched = stats["exact_match"]
@@ -311,7 +826,10 @@ class ReconciliationEngine:
         # Pending review = mismatches + single-sided
         stats["pending_review"] = (
             stats["amount_mismatch"] + 
+            stats["date_mismatch"] + 
             stats["gstin_mismatch"] + 
+            stats["invoice_mismatch"] + 
+            stats["split_match"] + 
             stats["pr_only"] + 
             stats["gstr2b_only"]
         )
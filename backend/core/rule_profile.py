@@ -0,0 +1,279 @@
+"""
+Per-Client Rule Profiles
+Tolerances, enabled rules and scores stored with a client, compiled once into an engine class
+"""
+from typing import List, Dict, Tuple, Optional, Any, Type, Callable
+from dataclasses import dataclass
+from hashlib import blake2b
+import json
+import threading
+from cachetools import LRUCache
+
+from core.reconciliation_engine import ReconciliationEngine, RulePass, MatchStatus
+from core.fuzzy_index import FuzzyThresholds, DEFAULT_FUZZY_THRESHOLDS
+from core.invoice_record import InvoiceRecord, to_paise, from_paise
+
+
+# Compiled engine classes kept in memory, by (profile digest, base engine class)
+PROFILE_CACHE_SIZE = 64
+
+# Confidence of the split / merged invoice rule, which is not a rule pass
+SPLIT_RULE = "split"
+
+
+def rule_name(finder: str) -> str:
+    """Profile name of a rule pass: its finder without the 'find_' prefix"""
+    return finder[len("find_"):]
+
+
+# Rule passes of the base engine, by profile name, in default order
+DEFAULT_RULES = tuple(rule_name(rule_pass.finder) for rule_pass in ReconciliationEngine.RULE_PASSES)
+
+
+@dataclass(frozen=True)
+class RuleProfile:
+    """
+    Matching rules of one client (amounts in paise). Defaults are the
+    engine's class constants, so an empty profile reconciles like the
+    plain engine.
+    """
+    amount_tolerance_paise: int = ReconciliationEngine.AMOUNT_TOLERANCE_PAISE
+    percentage_tolerance_bps: int = ReconciliationEngine.PERCENTAGE_TOLERANCE_BPS
+    percentage_threshold_paise: int = ReconciliationEngine.PERCENTAGE_THRESHOLD_PAISE
+    date_tolerance_days: int = ReconciliationEngine.DATE_TOLERANCE_DAYS
+    rules: Tuple[str, ...] = DEFAULT_RULES  # Enabled rule passes, in priority order
+    confidence: Tuple[Tuple[str, float], ...] = ()  # (rule, score) overrides, sorted by rule
+    split_matching: bool = ReconciliationEngine.SPLIT_MATCHING
+    fuzzy: FuzzyThresholds = DEFAULT_FUZZY_THRESHOLDS
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "RuleProfile":
+        """
+        Profile from its stored JSON (amounts in rupees, percentage in percent);
+        missing keys keep the defaults. Raises ValueError on unknown keys or rules.
+        """
+        data = dict(data or {})
+        unknown = set(data) - set(PROFILE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown rule profile fields: {sorted(unknown)}")
+
+        values: Dict[str, Any] = {}
+        if data.get("amount_tolerance") is not None:
+            values["amount_tolerance_paise"] = to_paise(_non_negative(data, "amount_tolerance"))
+        if data.get("percentage_tolerance") is not None:
+            values["percentage_tolerance_bps"] = round(_non_negative(data, "percentage_tolerance") * 100)
+        if data.get("percentage_threshold") is not None:
+            values["percentage_threshold_paise"] = to_paise(_non_negative(data, "percentage_threshold"))
+        if data.get("date_tolerance_days") is not None:
+            values["date_tolerance_days"] = int(_non_negative(data, "date_tolerance_days"))
+        if data.get("rules") is not None:
+            rules = tuple(data["rules"])
+            _check_rules(rules, DEFAULT_RULES)
+            if len(set(rules)) != len(rules):
+                raise ValueError("Rule profile lists a rule more than once")
+            values["rules"] = rules
+        if data.get("confidence") is not None:
+            confidence = dict(data["confidence"])
+            _check_rules(confidence, DEFAULT_RULES + (SPLIT_RULE,))
+            for name in confidence:
+                if _non_negative(confidence, name) > 100:
+                    raise ValueError(f"Confidence of rule '{name}' must be between 0 and 100")
+            values["confidence"] = tuple(sorted((name, float(score)) for name, score in confidence.items()))
+        if data.get("split_matching") is not None:
+            values["split_matching"] = bool(data["split_matching"])
+        if data.get("fuzzy") is not None:
+            fuzzy = dict(data["fuzzy"])
+            unknown = set(fuzzy) - set(FuzzyThresholds._fields)
+            if unknown:
+                raise ValueError(f"Unknown fuzzy thresholds: {sorted(unknown)}")
+            for name in fuzzy:
+                if int(_non_negative(fuzzy, name)) < 1:
+                    raise ValueError(f"Fuzzy threshold '{name}' must be at least 1")
+            values["fuzzy"] = DEFAULT_FUZZY_THRESHOLDS._replace(**{k: int(v) for k, v in fuzzy.items()})
+        return cls(**values)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Stored JSON of the profile (amounts in rupees, percentage in percent)"""
+        return {
+            "amount_tolerance": from_paise(self.amount_tolerance_paise),
+            "percentage_tolerance": self.percentage_tolerance_bps / 100,
+            "percentage_threshold": from_paise(self.percentage_threshold_paise),
+            "date_tolerance_days": self.date_tolerance_days,
+            "rules": list(self.rules),
+            "confidence": dict(self.confidence),
+            "split_matching": self.split_matching,
+            "fuzzy": self.fuzzy._asdict(),
+        }
+
+    @property
+    def digest(self) -> str:
+        """Hash of the profile's canonical form (equal profiles share compiled engines)"""
+        canonical = json.dumps(self.as_dict(), sort_keys=True, separators=(",", ":"))
+        return blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+PROFILE_FIELDS = (
+    "amount_tolerance", "percentage_tolerance", "percentage_threshold", "date_tolerance_days",
+    "rules", "confidence", "split_matching", "fuzzy"
+)
+
+
+def _non_negative(data: Dict[str, Any], name: str) -> float:
+    value = data[name]
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f"Rule profile field '{name}' must be a non-negative number")
+    return value
+
+
+def _check_rules(names, known: Tuple[str, ...]) -> None:
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError(f"Unknown rules {unknown} (expected some of {list(known)})")
+
+
+# ============================================
+# COMPILATION
+# ============================================
+
+_cache: LRUCache = LRUCache(maxsize=PROFILE_CACHE_SIZE)
+_cache_lock = threading.Lock()
+
+
+def profile_engine_class(
+    profile: RuleProfile,
+    base: Type[ReconciliationEngine] = ReconciliationEngine
+) -> Type[ReconciliationEngine]:
+    """
+    Engine class specialized for a profile: a subclass of `base` with the
+    profile's constants, rule passes and amount / date checks built in.
+    Compiled once per (profile, base) and kept in an LRU cache.
+    """
+    key = (profile.digest, base)
+    with _cache_lock:
+        engine_class = _cache.get(key)
+    if engine_class is None:
+        engine_class = compile_profile(profile, base)
+        with _cache_lock:
+            engine_class = _cache.setdefault(key, engine_class)
+    return engine_class
+
+
+def profile_engine(
+    profile: Optional[RuleProfile],
+    base: Type[ReconciliationEngine] = ReconciliationEngine,
+    *args
+) -> ReconciliationEngine:
+    """Instance of `base` (constructor `args`) compiled for the profile; the plain engine without one"""
+    if profile is None:
+        return base(*args)
+    return profile_engine_class(profile, base)(*args)
+
+
+def clear_profile_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def compile_profile(
+    profile: RuleProfile,
+    base: Type[ReconciliationEngine] = ReconciliationEngine
+) -> Type[ReconciliationEngine]:
+    """
+    Build the engine class of a profile (uncached).
+
+    The profile is resolved here, not per pair: disabled passes are dropped
+    from RULE_PASSES, confidence overrides are baked into each pass's rule,
+    and the amount / date checks are closures over the tolerances as locals,
+    so a custom profile runs the same per-pair code as the hard-coded rules.
+    """
+    passes = {rule_name(rule_pass.finder): rule_pass for rule_pass in base.RULE_PASSES}
+    _check_rules(profile.rules, tuple(passes))
+    confidence = dict(profile.confidence)
+
+    rule_passes: List[RulePass] = []
+    for name in profile.rules:
+        rule_pass = passes[name]
+        if name in confidence:
+            _, text = rule_pass.rule or base.RULES[rule_pass.status]
+            rule_pass = rule_pass._replace(rule=(confidence[name], text))
+        rule_passes.append(rule_pass)
+
+    rules = dict(base.RULES)
+    if SPLIT_RULE in confidence:
+        rules[MatchStatus.SPLIT_MATCH] = (confidence[SPLIT_RULE], rules[MatchStatus.SPLIT_MATCH][1])
+
+    attrs: Dict[str, Any] = {
+        "__module__": __name__,
+        "__doc__": f"{base.__name__} compiled for rule profile {profile.digest}",
+        "__reduce__": _reduce,
+        "RULE_PROFILE": profile,
+        "PROFILE_BASE": base,
+        "AMOUNT_TOLERANCE_PAISE": profile.amount_tolerance_paise,
+        "PERCENTAGE_TOLERANCE_BPS": profile.percentage_tolerance_bps,
+        "PERCENTAGE_THRESHOLD_PAISE": profile.percentage_threshold_paise,
+        "DATE_TOLERANCE_DAYS": profile.date_tolerance_days,
+        "RULE_PASSES": tuple(rule_passes),
+        "RULES": rules,
+        "SPLIT_MATCHING": profile.split_matching,
+        "FUZZY_THRESHOLDS": profile.fuzzy,
+    }
+    attrs.update(_evaluators(profile))
+    return type(f"{base.__name__}_{profile.digest[:12]}", (base,), attrs)
+
+
+def _evaluators(profile: RuleProfile) -> Dict[str, Callable]:
+    """Amount and date checks with the profile's tolerances bound as closure constants"""
+    tolerance = profile.amount_tolerance_paise
+    bps = profile.percentage_tolerance_bps
+    threshold = profile.percentage_threshold_paise
+    days = profile.date_tolerance_days
+
+    def paise_match(self, paise1: int, paise2: int, use_percentage: bool = False) -> bool:
+        diff = abs(paise1 - paise2)
+        if use_percentage and (paise1 > threshold or paise2 > threshold):
+            return diff * 10000 <= max(paise1, paise2) * bps
+        return diff <= tolerance
+
+    def all_amounts_match(self, pr: InvoiceRecord, gstr2b: InvoiceRecord) -> bool:
+        taxable1, taxable2 = pr.taxable, gstr2b.taxable
+        diff = abs(taxable1 - taxable2)
+        if taxable1 > threshold or taxable2 > threshold:
+            if diff * 10000 > max(taxable1, taxable2) * bps:
+                return False
+        elif diff > tolerance:
+            return False
+        return (
+            abs(pr.igst - gstr2b.igst) <= tolerance
+            and abs(pr.cgst - gstr2b.cgst) <= tolerance
+            and abs(pr.sgst - gstr2b.sgst) <= tolerance
+        )
+
+    def dates_match(self, pr: InvoiceRecord, gstr2b: InvoiceRecord) -> bool:
+        day1, day2 = pr.date_ordinal, gstr2b.date_ordinal
+        return day1 is None or day2 is None or abs(day1 - day2) <= days
+
+    return {"paise_match": paise_match, "all_amounts_match": all_amounts_match, "dates_match": dates_match}
+
+
+def _reduce(engine: ReconciliationEngine):
+    """Pickle a compiled engine as (profile, base, state): worker processes recompile the class"""
+    return _restore, (engine.RULE_PROFILE, engine.PROFILE_BASE, engine.__dict__)
+
+
+def _restore(profile: RuleProfile, base: Type[ReconciliationEngine], state: Dict) -> ReconciliationEngine:
+    engine_class = profile_engine_class(profile, base)
+    engine = engine_class.__new__(engine_class)
+    engine.__dict__.update(state)
+    return engine
+
+
+def client_rule_profile(client: Optional[Dict[str, Any]]) -> Optional[RuleProfile]:
+    """Rule profile stored on a client row; None (plain engine) when unset or invalid"""
+    data = (client or {}).get("rule_profile")
+    if not data:
+        return None
+    try:
+        return RuleProfile.from_dict(data)
+    except (ValueError, TypeError) as e:
+        print(f"⚠️ Ignoring invalid rule profile of client {client.get('id')}: {e}")
+        return None
@@ -0,0 +1,172 @@
+"""
+Split / Merged Invoice Matching
+Pairs one invoice with a group of invoices on the other side, per vendor residue
+"""
+from typing import List, Dict, Tuple, Optional, Sequence, TYPE_CHECKING
+from dataclasses import dataclass
+from bisect import bisect_left, bisect_right
+
+from core.invoice_record import InvoiceRecord
+
+if TYPE_CHECKING:
+    from core.reconciliation_engine import ReconciliationEngine
+
+
+# Most invoices one invoice may be split into (or merged from)
+SPLIT_MAX_GROUP = 4
+
+# Candidate parts searched per invoice: the largest totals below its own
+SPLIT_MAX_CANDIDATES = 20
+
+
+@dataclass
+class SplitGroup:
+    """One invoice matched to the group of invoices its amounts were spread over"""
+    single: InvoiceRecord
+    parts: List[InvoiceRecord]  # File order
+    single_is_pr: bool  # True: one PR invoice = several GSTR-2B rows; False: the reverse
+
+
+def combined_record(parts: Sequence[InvoiceRecord]) -> InvoiceRecord:
+    """A record carrying the summed amounts of the parts (identity of the first part)"""
+    first = parts[0]
+    return InvoiceRecord(
+        first.id,
+        first.key,
+        first.gstin,
+        first.invoice_date,
+        first.date_ordinal,
+        sum(p.taxable for p in parts),
+        sum(p.igst for p in parts),
+        sum(p.cgst for p in parts),
+        sum(p.sgst for p in parts),
+        sum(p.cess for p in parts),
+        sum(p.total_tax for p in parts),
+        first.row_number,
+    )
+
+
+class SplitMatcher:
+    """
+    Finds one-to-many (one PR invoice reported as several GSTR-2B rows) and
+    many-to-one groups within each vendor's unmatched residue.
+
+    For every unmatched invoice, candidate parts are the same GSTIN's
+    unmatched invoices on the other side with a smaller positive total,
+    capped at the `max_candidates` largest. Each GSTIN's unmatched parts are
+    kept sorted by total, so the window is found by bisection. Groups of 2 to
+    `max_group` parts whose invoice totals add up within tolerance are found
+    by meet-in-the-middle: subsets of each half of the candidates are summed,
+    one side is sorted, and each subset of the other half bisects for its
+    complement. Every match is then verified head-by-head with the engine's
+    amount rule. Cost per invoice is bounded by the caps, not the vendor size.
+
+    Preference: fewest parts, then smallest total difference, then earliest candidates.
+    """
+
+    def __init__(
+        self,
+        engine: "ReconciliationEngine",
+        max_group: int = SPLIT_MAX_GROUP,
+        max_candidates: int = SPLIT_MAX_CANDIDATES
+    ):
+        self.engine = engine
+        self.max_group = max_group
+        self.max_candidates = max_candidates
+
+    def match(
+        self,
+        pr_residue: List[InvoiceRecord],
+        gstr2b_residue: List[InvoiceRecord]
+    ) -> List[SplitGroup]:
+        """Split groups (PR invoice = GSTR-2B rows) first, then merged groups, each in file order"""
+        pr_used = [False] * len(pr_residue)
+        gstr2b_used = [False] * len(gstr2b_residue)
+        groups: List[SplitGroup] = []
+
+        for singles, single_used, parts, part_used, single_is_pr in (
+            (pr_residue, pr_used, gstr2b_residue, gstr2b_used, True),
+            (gstr2b_residue, gstr2b_used, pr_residue, pr_used, False),
+        ):
+            # Per GSTIN, the unused parts as parallel (total, position) lists sorted by total
+            by_gstin: Dict[str, Tuple[List[int], List[int]]] = {}
+            for i in sorted(range(len(parts)), key=lambda i: (parts[i].total, i)):
+                if parts[i].total > 0 and not part_used[i]:
+                    totals, positions = by_gstin.setdefault(parts[i].gstin, ([], []))
+                    totals.append(parts[i].total)
+                    positions.append(i)
+
+            for s, single in enumerate(singles):
+                if single_used[s] or single.total <= 0 or single.gstin not in by_gstin:
+                    continue
+                totals, positions = by_gstin[single.gstin]
+                chosen = self._find_group(single, parts, totals, positions, single_is_pr)
+                if chosen is None:
+                    continue
+                single_used[s] = True
+                for i in chosen:
+                    part_used[i] = True
+                    k = bisect_left(totals, parts[i].total)
+                    k = positions.index(i, k)
+                    del totals[k], positions[k]
+                groups.append(SplitGroup(single, [parts[i] for i in chosen], single_is_pr))
+
+        return groups
+
+    def _find_group(
+        self,
+        single: InvoiceRecord,
+        parts: List[InvoiceRecord],
+        totals: List[int],
+        positions: List[int],
+        single_is_pr: bool
+    ) -> Optional[List[int]]:
+        """
+        Positions (in file order) of the best group of parts adding up to
+        `single`, if any. `totals` / `positions` are the GSTIN's unused parts
+        sorted by total.
+        """
+        tolerance = self.engine.AMOUNT_TOLERANCE_PAISE
+        target = single.total
+        high = bisect_left(totals, target + tolerance)
+        low = max(0, high - self.max_candidates)
+        if high - low < 2:
+            return None
+        # Even the largest allowed group falls short
+        if sum(totals[max(low, high - self.max_group):high]) < target - tolerance:
+            return None
+        candidates = sorted(positions[low:high])
+
+        half = len(candidates) // 2
+        left = self._subset_sums([parts[i].total for i in candidates[:half]], 0)
+        right = self._subset_sums([parts[i].total for i in candidates[half:]], half)
+        right.sort()
+        right_sums = [total for total, _ in right]
+
+        best: Optional[Tuple[int, int, Tuple[int, ...]]] = None
+        for left_total, left_members in left:
+            low = bisect_left(right_sums, target - left_total - tolerance)
+            high = bisect_right(right_sums, target - left_total + tolerance)
+            for right_total, right_members in right[low:high]:
+                size = len(left_members) + len(right_members)
+                if not 2 <= size <= self.max_group:
+                    continue
+                members = left_members + right_members
+                rank = (size, abs(target - left_total - right_total), members)
+                if best is not None and rank >= best:
+                    continue
+                combined = combined_record([parts[candidates[m]] for m in members])
+                pr, gstr2b = (single, combined) if single_is_pr else (combined, single)
+                if self.engine.all_amounts_match(pr, gstr2b):
+                    best = rank
+
+        if best is None:
+            return None
+        return sorted(candidates[m] for m in best[2])
+
+    def _subset_sums(self, totals: List[int], offset: int) -> List[Tuple[int, Tuple[int, ...]]]:
+        """(sum, candidate numbers) for every subset of up to max_group totals"""
+        sums: List[Tuple[int, Tuple[int, ...]]] = [(0, ())]
+        for c, total in enumerate(totals, offset):
+            sums += [(s + total, members + (c,)) for s, members in sums if len(members) < self.max_group]
+        return sums
@@ -0,0 +1,399 @@
+"""
+SQL Pushdown Reconciliation
+Runs the exact-match and key-join rules as set-based SQL next to the invoices table
+"""
+from typing import List, Dict, Tuple, Optional, Any, Iterable, Iterator
+from dataclasses import dataclass, field
+import re
+
+from core.reconciliation_engine import (
+    ReconciliationEngine, ReconciliationContext, MatchResult, MatchStatus, TOTAL_FIELDS, ITC_HEADS
+)
+from core.invoice_record import normalize_invoice_no, normalize_gstin
+
+
+# Leading rule passes the SQL reproduces, in RULE_PASSES order
+PUSHDOWN_FINDERS = ("find_identical", "find_exact", "find_date_mismatch", "find_amount_mismatch")
+
+# Residue results are written back in batches of this size
+RESULT_BATCH_SIZE = 1000
+
+PR_SOURCE = "purchase_register"
+GSTR2B_SOURCE = "gstr2b"
+
+# Per dialect: bind parameter style and the day number (days since 1970-01-01) of a date column
+DIALECTS = {
+    "postgres": {"param": r"%(\1)s", "day": "({} - DATE '1970-01-01')"},
+    "sqlite": {"param": r":\1", "day": "CAST(julianday(substr({}, 1, 10)) - 2440587.5 AS INTEGER)"},
+}
+
+_PARAM = re.compile(r"(?<![\w:]):([a-z_]\w*)")
+
+
+# ============================================
+# RULE SQL
+# ============================================
+# Written in the subset Postgres and SQLite share. norm_gstin / norm_invoice_no
+# are SQL functions in Postgres (migration 006) and Python functions in SQLite.
+# "File order" is (row_number, id).
+
+_STAGE_SQL = """
+CREATE TEMP TABLE pushdown_rows AS
+WITH base AS (
+    SELECT
+        id,
+        run_id,
+        source,
+        row_number AS row_no,
+        norm_gstin(vendor_gstin) AS gstin,
+        norm_invoice_no(invoice_no) AS inv_key,
+        DAY_NUMBER(invoice_date) AS day,
+        CAST(ROUND(COALESCE(taxable_value, 0) * 100) AS BIGINT) AS taxable,
+        CAST(ROUND(COALESCE(igst, 0) * 100) AS BIGINT) AS igst,
+        CAST(ROUND(COALESCE(cgst, 0) * 100) AS BIGINT) AS cgst,
+        CAST(ROUND(COALESCE(sgst, 0) * 100) AS BIGINT) AS sgst,
+        CAST(ROUND(COALESCE(cess, 0) * 100) AS BIGINT) AS cess,
+        CAST(ROUND(COALESCE(total_tax, 0) * 100) AS BIGINT) AS total_tax
+    FROM invoices
+    WHERE run_id = :run_id
+)
+SELECT
+    base.*,
+    CASE WHEN inv_key = '' THEN 1 ELSE ROW_NUMBER() OVER duplicates END AS dup_rank,
+    FIRST_VALUE(id) OVER duplicates AS dup_of,
+    FIRST_VALUE(row_no) OVER duplicates AS dup_row
+FROM base
+WINDOW duplicates AS (PARTITION BY source, gstin, inv_key, taxable, igst, cgst, sgst ORDER BY row_no, id)
+"""
+
+# Rule 1 fast path: after de-duplication every full normalized tuple is unique
+# per side, so identical invoices pair one-to-one with a plain equi-join
+_IDENTICAL_SQL = """
+CREATE TEMP TABLE pushdown_pairs AS
+SELECT p.id AS pr_id, g.id AS gstr2b_id, 0 AS pass_no
+FROM pushdown_rows p
+JOIN pushdown_rows g
+    ON g.source = 'gstr2b' AND g.dup_rank = 1
+    AND g.gstin = p.gstin AND g.inv_key = p.inv_key
+    AND (g.day = p.day OR (g.day IS NULL AND p.day IS NULL))
+    AND g.taxable = p.taxable AND g.igst = p.igst AND g.cgst = p.cgst AND g.sgst = p.sgst
+WHERE p.source = 'purchase_register' AND p.dup_rank = 1 AND p.inv_key <> ''
+"""
+
+# Rules 1-3 for (GSTIN, invoice no) keys left with exactly one invoice per
+# side: nothing else can claim either of them, so the rule that pairs them
+# depends only on the pair itself
+_KEY_JOIN_SQL = """
+WITH open_rows AS (
+    SELECT * FROM pushdown_rows
+    WHERE dup_rank = 1 AND inv_key <> ''
+    AND id NOT IN (SELECT pr_id FROM pushdown_pairs)
+    AND id NOT IN (SELECT gstr2b_id FROM pushdown_pairs)
+), one_to_one AS (
+    SELECT gstin, inv_key
+    FROM open_rows
+    GROUP BY gstin, inv_key
+    HAVING SUM(CASE WHEN source = 'purchase_register' THEN 1 ELSE 0 END) = 1
+    AND SUM(CASE WHEN source = 'gstr2b' THEN 1 ELSE 0 END) = 1
+), candidates AS (
+    SELECT
+        p.id AS pr_id,
+        g.id AS gstr2b_id,
+        CASE WHEN p.taxable > :percentage_threshold OR g.taxable > :percentage_threshold
+            THEN ABS(p.taxable - g.taxable) * 10000
+                <= (CASE WHEN p.taxable > g.taxable THEN p.taxable ELSE g.taxable END) * :percentage_bps
+            ELSE ABS(p.taxable - g.taxable) <= :amount_tolerance
+        END
+        AND ABS(p.igst - g.igst) <= :amount_tolerance
+        AND ABS(p.cgst - g.cgst) <= :amount_tolerance
+        AND ABS(p.sgst - g.sgst) <= :amount_tolerance AS amounts_match,
+        p.day IS NULL OR g.day IS NULL OR ABS(p.day - g.day) <= :date_tolerance AS dates_match
+    FROM one_to_one k
+    JOIN open_rows p ON p.source = 'purchase_register' AND p.gstin = k.gstin AND p.inv_key = k.inv_key
+    JOIN open_rows g ON g.source = 'gstr2b' AND g.gstin = k.gstin AND g.inv_key = k.inv_key
+)
+INSERT INTO pushdown_pairs (pr_id, gstr2b_id, pass_no)
+SELECT
+    pr_id,
+    gstr2b_id,
+    CASE WHEN amounts_match AND dates_match THEN 1 WHEN amounts_match THEN 2 ELSE 3 END
+FROM candidates
+"""
+
+_PAIR_RESULTS_SQL = """
+INSERT INTO match_results (
+    run_id, pr_invoice_id, gstr2b_invoice_id, match_status, confidence_score, match_rule_applied,
+    taxable_diff, igst_diff, cgst_diff, sgst_diff, total_diff
+)
+SELECT
+    p.run_id,
+    p.id,
+    g.id,
+    CASE x.pass_no WHEN 0 THEN :status_0 WHEN 1 THEN :status_1 WHEN 2 THEN :status_2 ELSE :status_3 END,
+    CASE x.pass_no WHEN 0 THEN :confidence_0 WHEN 1 THEN :confidence_1 WHEN 2 THEN :confidence_2 ELSE :confidence_3 END,
+    CASE x.pass_no WHEN 0 THEN :rule_0 WHEN 1 THEN :rule_1 WHEN 2 THEN :rule_2 ELSE :rule_3 END,
+    (p.taxable - g.taxable) / 100.0,
+    (p.igst - g.igst) / 100.0,
+    (p.cgst - g.cgst) / 100.0,
+    (p.sgst - g.sgst) / 100.0,
+    ((p.taxable + p.total_tax) - (g.taxable + g.total_tax)) / 100.0
+FROM pushdown_pairs x
+JOIN pushdown_rows p ON p.id = x.pr_id
+JOIN pushdown_rows g ON g.id = x.gstr2b_id
+"""
+
+_DUPLICATE_RESULTS_SQL = """
+INSERT INTO match_results (
+    run_id, pr_invoice_id, gstr2b_invoice_id, match_status, confidence_score, match_rule_applied,
+    taxable_diff, igst_diff, cgst_diff, sgst_diff, total_diff
+)
+SELECT
+    run_id,
+    CASE WHEN source = 'purchase_register' THEN id END,
+    CASE WHEN source = 'gstr2b' THEN id END,
+    :duplicate_status,
+    100.0,
+    :duplicate_rule
+        || CASE WHEN source = 'purchase_register' THEN ' Purchase Register row ' ELSE ' GSTR-2B row ' END
+        || COALESCE(CAST(dup_row AS TEXT), CAST(dup_of AS TEXT)),
+    0, 0, 0, 0, 0
+FROM pushdown_rows
+WHERE dup_rank > 1
+"""
+
+_PAIR_TOTALS_SQL = """
+SELECT x.pass_no, COUNT(*), SUM(g.igst), SUM(g.cgst), SUM(g.sgst), SUM(g.cess), SUM(g.total_tax)
+FROM pushdown_pairs x
+JOIN pushdown_rows g ON g.id = x.gstr2b_id
+GROUP BY x.pass_no
+"""
+
+_SIDE_TOTALS_SQL = """
+SELECT
+    source,
+    COUNT(*),
+    SUM(CASE WHEN dup_rank > 1 THEN 1 ELSE 0 END),
+    SUM(taxable), SUM(igst), SUM(cgst), SUM(sgst), SUM(cess), SUM(total_tax)
+FROM pushdown_rows
+GROUP BY source
+"""
+
+_RESIDUE_SQL = """
+SELECT i.*
+FROM invoices i
+JOIN pushdown_rows r ON r.id = i.id
+WHERE r.source = :source AND r.dup_rank = 1
+AND r.id NOT IN (SELECT pr_id FROM pushdown_pairs)
+AND r.id NOT IN (SELECT gstr2b_id FROM pushdown_pairs)
+ORDER BY r.row_no, r.id
+"""
+
+_INSERT_RESULT_SQL = """
+INSERT INTO match_results (
+    run_id, pr_invoice_id, gstr2b_invoice_id, match_status, confidence_score, match_rule_applied,
+    taxable_diff, igst_diff, cgst_diff, sgst_diff, total_diff
+) VALUES (
+    :run_id, :pr_invoice_id, :gstr2b_invoice_id, :match_status, :confidence_score, :match_rule_applied,
+    :taxable_diff, :igst_diff, :cgst_diff, :sgst_diff, :total_diff
+)
+"""
+
+# Every PR row of the run, for the cross-period ITC claim check
+_CLAIMS_SQL = """
+SELECT id, vendor_gstin, invoice_no, taxable_value
+FROM invoices
+WHERE run_id = :run_id AND source = 'purchase_register'
+ORDER BY row_number, id
+"""
+
+_DROP_SQL = ("DROP TABLE IF EXISTS pushdown_pairs", "DROP TABLE IF EXISTS pushdown_rows")
+
+
+def register_sqlite_functions(conn: Any) -> None:
+    """Make the normalization functions the rule SQL calls available on a sqlite3 connection"""
+    conn.create_function("norm_gstin", 1, normalize_gstin, deterministic=True)
+    conn.create_function("norm_invoice_no", 1, normalize_invoice_no, deterministic=True)
+
+
+def connect_postgres(database_url: str) -> Any:
+    """
+    Direct Postgres connection for pushdown (psycopg is only needed in this mode).
+    Parameters are bound client-side, since CREATE TABLE AS cannot take server-side ones.
+    """
+    try:
+        import psycopg
+    except ImportError:
+        raise RuntimeError("SQL pushdown needs psycopg: pip install 'psycopg[binary]'")
+    return psycopg.connect(database_url, cursor_factory=psycopg.ClientCursor)
+
+
+@dataclass
+class PushdownResidue:
+    """
+    What a pushdown run reads back into Python, kept for the checks across
+    return periods (open items carry-forward, repeat ITC claims)
+    """
+    with_claims: bool = False  # Also read the claim fields of every PR row
+    invoices: List[Dict] = field(default_factory=list)  # Residue invoice rows of both sides
+    open_results: List[MatchResult] = field(default_factory=list)  # Their PR_ONLY / GSTR2B_ONLY results
+    claims: List[Dict] = field(default_factory=list)  # id, vendor_gstin, invoice_no, taxable_value per PR row
+
+
+class SqlPushdown:
+    """
+    Reconciles a stored run inside the database.
+
+    The rule SQL splits off duplicate rows, pairs identical invoices, and
+    pairs (GSTIN, invoice no) keys left with one invoice per side (Rules 1-3),
+    writing their match_results server-side in a few set-based statements.
+    Only the residue is read back and reconciled by the engine, so the
+    result set equals a full in-memory run over the invoices in file order.
+
+    Works on any DB-API connection: Postgres (psycopg) in production, SQLite
+    (after register_sqlite_functions) as a local stand-in. The caller commits.
+    """
+
+    def __init__(self, engine: ReconciliationEngine, dialect: str = "postgres"):
+        if not self.supports(engine):
+            raise ValueError(f"SQL pushdown needs the rule passes to start with {PUSHDOWN_FINDERS}")
+        if dialect not in DIALECTS:
+            raise ValueError(f"Unknown SQL dialect '{dialect}' (expected one of {sorted(DIALECTS)})")
+        self.engine = engine
+        self.dialect = dialect
+
+    @staticmethod
+    def supports(engine: ReconciliationEngine) -> bool:
+        """The engine's leading rule passes are the ones the SQL reproduces"""
+        finders = tuple(rule_pass.finder for rule_pass in engine.RULE_PASSES[:len(PUSHDOWN_FINDERS)])
+        return finders == PUSHDOWN_FINDERS
+
+    def sql(self, statement: str) -> str:
+        """Render a rule statement for the connection's dialect"""
+        dialect = DIALECTS[self.dialect]
+        statement = re.sub(r"DAY_NUMBER\((\w+)\)", lambda m: dialect["day"].format(m.group(1)), statement)
+        return _PARAM.sub(dialect["param"], statement)
+
+    def parameters(self, run_id: Any) -> Dict[str, Any]:
+        """Tolerances and rule outcomes of the engine, as bind parameters"""
+        engine = self.engine
+        params: Dict[str, Any] = {
+            "run_id": run_id,
+            "amount_tolerance": engine.AMOUNT_TOLERANCE_PAISE,
+            "percentage_bps": engine.PERCENTAGE_TOLERANCE_BPS,
+            "percentage_threshold": engine.PERCENTAGE_THRESHOLD_PAISE,
+            "date_tolerance": engine.DATE_TOLERANCE_DAYS,
+            "duplicate_status": MatchStatus.DUPLICATE.value,
+            "duplicate_rule": engine.DUPLICATE_RULE,
+        }
+        for pass_no, rule_pass in enumerate(engine.RULE_PASSES[:len(PUSHDOWN_FINDERS)]):
+            confidence, rule = rule_pass.rule or engine.RULES[rule_pass.status]
+            params[f"status_{pass_no}"] = rule_pass.status.value
+            params[f"confidence_{pass_no}"] = confidence
+            params[f"rule_{pass_no}"] = rule
+        return params
+
+    def reconcile_run(
+        self,
+        conn: Any,
+        run_id: Any,
+        context: Optional[ReconciliationContext] = None,
+        residue_engine: Optional[ReconciliationEngine] = None,
+        residue: Optional[PushdownResidue] = None
+    ) -> Tuple[int, int]:
+        """
+        Reconcile every invoice of the run and write all its match_results
+        over `conn`. Counts and totals are accumulated in `context`, and the
+        rows read back for the residue passes are kept in `residue`.
+
+        Returns: (PR invoices, GSTR-2B invoices) in the run
+        """
+        context = context if context is not None else ReconciliationContext()
+        params = self.parameters(run_id)
+        cur = conn.cursor()
+        try:
+            for statement in _DROP_SQL:
+                cur.execute(statement)
+            for statement in (_STAGE_SQL, _IDENTICAL_SQL, _KEY_JOIN_SQL, _PAIR_RESULTS_SQL, _DUPLICATE_RESULTS_SQL):
+                cur.execute(self.sql(statement), params)
+            counts = self._add_totals(cur, context)
+
+            rows = [self._fetch_dicts(cur, _RESIDUE_SQL, {"source": source}) for source in (PR_SOURCE, GSTR2B_SOURCE)]
+            if residue is not None and residue.with_claims:
+                residue.claims.extend(self._fetch_dicts(cur, _CLAIMS_SQL, {"run_id": run_id}))
+
+            residue_context = ReconciliationContext()
+            engine = residue_engine or self.engine
+            results = engine.reconcile_iter(rows[0], rows[1], residue_context)
+            if residue is not None:
+                residue.invoices.extend(rows[0])
+                residue.invoices.extend(rows[1])
+                results = _keep_open_results(results, residue.open_results)
+            self._insert_results(cur, run_id, results)
+            # Side totals were taken over every row above; only the residue's results are added
+            residue_context.totals.pr_totals = dict.fromkeys(TOTAL_FIELDS, 0)
+            residue_context.totals.gstr2b_totals = dict.fromkeys(TOTAL_FIELDS, 0)
+            context.totals.merge(residue_context.totals)
+            context.bucket_stats = residue_context.bucket_stats
+            context.vendors = residue_context.vendors
+
+            for statement in _DROP_SQL:
+                cur.execute(statement)
+        finally:
+            cur.close()
+        return counts
+
+    def _fetch_dicts(self, cur: Any, statement: str, params: Dict[str, Any]) -> List[Dict]:
+        cur.execute(self.sql(statement), params)
+        columns = [column[0] for column in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    def _add_totals(self, cur: Any, context: ReconciliationContext) -> Tuple[int, int]:
+        """Add the SQL-settled pairs, duplicates and side totals to the context; returns side row counts"""
+        totals = context.totals
+        cur.execute(_PAIR_TOTALS_SQL)
+        for pass_no, n, *tax in cur.fetchall():
+            status = self.engine.RULE_PASSES[pass_no].status
+            totals.add_pair_amounts(status, int(n), {head: int(v or 0) for head, v in zip(ITC_HEADS, tax)})
+
+        rows = {PR_SOURCE: 0, GSTR2B_SOURCE: 0}
+        cur.execute(_SIDE_TOTALS_SQL)
+        for source, n, duplicates, *amounts in cur.fetchall():
+            rows[source] = int(n)
+            if duplicates:
+                totals.count(MatchStatus.DUPLICATE, int(duplicates))
+            side_totals = totals.pr_totals if source == PR_SOURCE else totals.gstr2b_totals
+            for f, v in zip(TOTAL_FIELDS, amounts):
+                side_totals[f] += int(v or 0)
+        return rows[PR_SOURCE], rows[GSTR2B_SOURCE]
+
+    def _insert_results(self, cur: Any, run_id: Any, results: Iterable[MatchResult]) -> None:
+        """Write residue results in batches"""
+        statement = self.sql(_INSERT_RESULT_SQL)
+        batch: List[Dict] = []
+        for r in results:
+            batch.append({
+                "run_id": run_id,
+                "pr_invoice_id": r.pr_invoice_id,
+                "gstr2b_invoice_id": r.gstr2b_invoice_id,
+                "match_status": r.status.value,
+                "confidence_score": r.confidence_score,
+                "match_rule_applied": r.match_rule,
+                "taxable_diff": r.taxable_diff,
+                "igst_diff": r.igst_diff,
+                "cgst_diff": r.cgst_diff,
+                "sgst_diff": r.sgst_diff,
+                "total_diff": r.total_diff,
+            })
+            if len(batch) >= RESULT_BATCH_SIZE:
+                cur.executemany(statement, batch)
+                batch = []
+        if batch:
+            cur.executemany(statement, batch)
+
+
+def _keep_open_results(results: Iterable[MatchResult], kept: List[MatchResult]) -> Iterator[MatchResult]:
+    """Pass results through, keeping the PR_ONLY / GSTR2B_ONLY ones in `kept`"""
+    for result in results:
+        if result.status in (MatchStatus.PR_ONLY, MatchStatus.GSTR2B_ONLY):
+            kept.append(result)
+        yield result
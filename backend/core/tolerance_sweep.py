@@ -0,0 +1,426 @@
+"""
+Tolerance What-If Sweep
+Reclassify a finished run's candidate pairs under other tolerance settings, without re-matching
+"""
+from typing import List, Dict, Tuple, Optional, Iterable
+from dataclasses import dataclass
+import numpy as np
+
+from core.reconciliation_engine import (
+    ReconciliationEngine, MatchResult, MatchStatus, ITC_HEADS, ITC_CLAIMABLE_STATUSES, ITC_AT_RISK_STATUSES
+)
+from core.invoice_record import InvoiceRecord, from_paise
+from core.split_matcher import combined_record
+from core.columnar_engine import ColumnarReconciliationEngine, InvoiceColumns
+
+
+# Candidates per unpaired PR invoice and rule, among the invoices it could still be paired with
+SWEEP_MAX_CANDIDATES = 8
+
+# What a candidate pair needs to stay paired under a setting
+KEEP_KEY = 0  # Same GSTIN + invoice no: always paired, as exact / date / amount mismatch
+KEEP_AMOUNTS = 1  # All amounts within tolerance
+KEEP_AMOUNTS_DATE = 2  # All amounts within tolerance, dates within the window
+KEEP_TOTAL = 3  # Invoice total within the absolute tolerance
+KEEP_AMOUNTS_DATE_OR_TOTAL = 4  # Either of the two above (unpaired invoices of one vendor)
+KEEP_SPLIT = 5  # Invoice totals and all summed amounts within tolerance
+KEEP_ALWAYS = 6  # Pairs of rules the sweep does not model
+
+# Requirement of the pairs each rule pass claims
+FINDER_REQUIREMENTS = {
+    "find_identical": KEEP_KEY,
+    "find_exact": KEEP_KEY,
+    "find_date_mismatch": KEEP_KEY,
+    "find_amount_mismatch": KEEP_KEY,
+    "find_branch_mismatch": KEEP_AMOUNTS,
+    "find_gstin_mismatch": KEEP_AMOUNTS,
+    "find_similar_invoice": KEEP_AMOUNTS,
+    "find_invoice_mismatch": KEEP_AMOUNTS_DATE,
+    "find_amount_only": KEEP_TOTAL,
+}
+
+_STATUSES = list(MatchStatus)
+_CODES = {status: code for code, status in enumerate(_STATUSES)}
+
+
+@dataclass(frozen=True)
+class ToleranceSetting:
+    """One what-if point, in the units of the engine's tolerance constants"""
+    amount_tolerance_paise: int
+    percentage_tolerance_bps: int
+    percentage_threshold_paise: int
+    date_tolerance_days: int
+
+    @classmethod
+    def from_engine(cls, engine: ReconciliationEngine, **overrides: Optional[int]) -> "ToleranceSetting":
+        """The engine's own setting, with any non-None field overridden"""
+        values = {
+            "amount_tolerance_paise": engine.AMOUNT_TOLERANCE_PAISE,
+            "percentage_tolerance_bps": engine.PERCENTAGE_TOLERANCE_BPS,
+            "percentage_threshold_paise": engine.PERCENTAGE_THRESHOLD_PAISE,
+            "date_tolerance_days": engine.DATE_TOLERANCE_DAYS,
+        }
+        values.update({name: value for name, value in overrides.items() if value is not None})
+        return cls(**values)
+
+    def as_dict(self) -> Dict:
+        """The setting in rupees / percent, for API responses"""
+        return {
+            "amount_tolerance": from_paise(self.amount_tolerance_paise),
+            "percentage_tolerance": self.percentage_tolerance_bps / 100,
+            "percentage_threshold": from_paise(self.percentage_threshold_paise),
+            "date_tolerance_days": self.date_tolerance_days,
+        }
+
+
+def stored_results(rows: Iterable[Dict]) -> List[MatchResult]:
+    """MatchResults of a stored run, from its match_results rows"""
+    return [
+        MatchResult(
+            status=MatchStatus(row["match_status"]),
+            pr_invoice_id=row.get("pr_invoice_id"),
+            gstr2b_invoice_id=row.get("gstr2b_invoice_id"),
+            confidence_score=row.get("confidence_score") or 0,
+            match_rule=row.get("match_rule_applied") or "",
+        )
+        for row in rows
+    ]
+
+
+class ToleranceSweep:
+    """
+    Candidate pairs of one finished run, with their per-head differences,
+    materialized once as columns so that any number of tolerance settings
+    can be evaluated as array operations.
+
+    Candidates are the run's own pairs and split groups, plus pairs among
+    the invoices a setting can leave unpaired (PR_ONLY / GSTR2B_ONLY and
+    those of pairs that need a tolerance check) sharing an invoice no with
+    another GSTIN, or a GSTIN with the nearest invoice totals. Under each
+    setting:
+
+    - same GSTIN + invoice no pairs stay paired and are reclassified as
+      exact / date / amount mismatch
+    - other pairs and split groups stay paired while they pass their rule's
+      tolerance checks
+    - the remaining candidates that pass are paired first-come (rule order,
+      then PR file order, then nearest total), as the rule passes would
+
+    The rule passes are never re-run and no new split groups are searched,
+    so this is an estimate that is closest for settings near the run's own
+    (which reproduces the run's counts exactly).
+    """
+
+    def __init__(
+        self,
+        engine: ReconciliationEngine,
+        pr_records: List[InvoiceRecord],
+        gstr2b_records: List[InvoiceRecord],
+        results: Iterable[MatchResult]
+    ):
+        self.engine = engine
+        pr_rows = list(pr_records)
+        gstr2b_rows = list(gstr2b_records)
+        pr_positions = {rec.id: pos for pos, rec in enumerate(pr_rows)}
+        gstr2b_positions = {rec.id: pos for pos, rec in enumerate(gstr2b_rows)}
+        # Run pairs are traced back to their rule pass by the audit text
+        requirements = {
+            (rule_pass.rule or engine.RULES[rule_pass.status])[1]:
+                FINDER_REQUIREMENTS.get(rule_pass.finder, KEEP_ALWAYS)
+            for rule_pass in engine.RULE_PASSES
+        }
+
+        # Run candidates: (PR row, GSTR-2B row, requirement, status code) and the rows they pair
+        candidates: List[Tuple[int, int, int, int]] = []
+        members: List[Tuple[Tuple[int, ...], Tuple[int, ...]]] = []
+        splits: List[Tuple[int, int]] = []
+        pr_open: set = set()
+        gstr2b_open: set = set()
+        self.duplicates = 0
+        pr_duplicates = gstr2b_duplicates = 0
+
+        for result in results:
+            pr = pr_positions.get(result.pr_invoice_id)
+            gstr2b = gstr2b_positions.get(result.gstr2b_invoice_id)
+            if result.status == MatchStatus.DUPLICATE:
+                self.duplicates += 1
+                pr_duplicates += pr is not None
+                gstr2b_duplicates += gstr2b is not None
+            elif result.status == MatchStatus.PR_ONLY:
+                if pr is not None:
+                    pr_open.add(pr)
+            elif result.status == MatchStatus.GSTR2B_ONLY:
+                if gstr2b is not None:
+                    gstr2b_open.add(gstr2b)
+            elif pr is not None and gstr2b is not None:
+                if result.status == MatchStatus.SPLIT_MATCH:
+                    splits.append((pr, gstr2b))
+                    continue
+                requirement = requirements.get(result.match_rule, KEEP_ALWAYS)
+                candidates.append((pr, gstr2b, requirement, _CODES[result.status]))
+                members.append(((pr,), (gstr2b,)))
+                if requirement not in (KEEP_KEY, KEEP_ALWAYS):
+                    pr_open.add(pr)
+                    gstr2b_open.add(gstr2b)
+
+        # Split groups are compared as their summed records
+        for pr_parts, gstr2b_parts in self._split_groups(splits):
+            rows = []
+            for parts, records in ((pr_parts, pr_rows), (gstr2b_parts, gstr2b_rows)):
+                if len(parts) == 1:
+                    rows.append(parts[0])
+                else:
+                    records.append(combined_record([records[pos] for pos in parts]))
+                    rows.append(len(records) - 1)
+            candidates.append((rows[0], rows[1], KEEP_SPLIT, _CODES[MatchStatus.SPLIT_MATCH]))
+            members.append((tuple(pr_parts), tuple(gstr2b_parts)))
+            pr_open.update(pr_parts)
+            gstr2b_open.update(gstr2b_parts)
+
+        self.pr_row_count, self.gstr2b_row_count = len(pr_rows), len(gstr2b_rows)
+        self.pr_count = len(pr_records) - pr_duplicates
+        self.gstr2b_count = len(gstr2b_records) - gstr2b_duplicates
+        self.run_count = len(candidates)
+
+        pr = InvoiceColumns(pr_rows)
+        gstr2b = InvoiceColumns(gstr2b_rows)
+        run = np.array(candidates, dtype=np.int64).reshape(-1, 4)
+        pr_open_rows = np.array(sorted(pr_open), dtype=np.int64)
+        gstr2b_open_rows = np.array(sorted(gstr2b_open), dtype=np.int64)
+        cross_pr, cross_gstr2b = self._same_invoice(pr, gstr2b, pr_open_rows, gstr2b_open_rows)
+        vendor_pr, vendor_gstr2b = self._nearest_totals(pr, gstr2b, pr_open_rows, gstr2b_open_rows)
+        n_cross, n_vendor = len(cross_pr), len(vendor_pr)
+
+        self.pr_idx = np.concatenate([run[:, 0], cross_pr, vendor_pr])
+        self.gstr2b_idx = np.concatenate([run[:, 1], cross_gstr2b, vendor_gstr2b])
+        self.requirement = np.concatenate([
+            run[:, 2],
+            np.full(n_cross, KEEP_AMOUNTS, dtype=np.int64),
+            np.full(n_vendor, KEEP_AMOUNTS_DATE_OR_TOTAL, dtype=np.int64),
+        ])
+        self.status = np.concatenate([
+            run[:, 3],
+            np.full(n_cross, _CODES[MatchStatus.GSTIN_MISMATCH], dtype=np.int64),
+            np.full(n_vendor, _CODES[MatchStatus.INVOICE_MISMATCH], dtype=np.int64),
+        ])
+        # Invoices used per side when paired, and results reported (split groups: one per part)
+        single = np.ones(n_cross + n_vendor, dtype=np.int64)
+        self.pr_used = np.concatenate([[len(m[0]) for m in members], single]).astype(np.int64)
+        self.gstr2b_used = np.concatenate([[len(m[1]) for m in members], single]).astype(np.int64)
+        self.results = np.maximum(self.pr_used, self.gstr2b_used)
+        # Rows of the run candidates other candidates compete with, and their candidate
+        competing = [pos for pos in range(self.run_count) if run[pos, 2] != KEEP_KEY]
+        self.member_pr = np.array([row for pos in competing for row in members[pos][0]], dtype=np.int64)
+        self.member_pr_of = np.array([pos for pos in competing for _ in members[pos][0]], dtype=np.int64)
+        self.member_gstr2b = np.array([row for pos in competing for row in members[pos][1]], dtype=np.int64)
+        self.member_gstr2b_of = np.array([pos for pos in competing for _ in members[pos][1]], dtype=np.int64)
+        self._materialize(pr, gstr2b)
+
+    @staticmethod
+    def _split_groups(splits: List[Tuple[int, int]]) -> List[Tuple[List[int], List[int]]]:
+        """Split groups of the run from their SPLIT_MATCH pairs: (PR rows, GSTR-2B rows)"""
+        # The single invoice of a group is the one repeated across its pairs
+        pr_pairs: Dict[int, int] = {}
+        for pr, _ in splits:
+            pr_pairs[pr] = pr_pairs.get(pr, 0) + 1
+        groups: Dict[Tuple[bool, int], Tuple[List[int], List[int]]] = {}
+        for pr, gstr2b in splits:
+            if pr_pairs[pr] > 1:
+                groups.setdefault((True, pr), ([pr], []))[1].append(gstr2b)
+            else:
+                groups.setdefault((False, gstr2b), ([], [gstr2b]))[0].append(pr)
+        return list(groups.values())
+
+    # ============================================
+    # CANDIDATES
+    # ============================================
+
+    @staticmethod
+    def _same_invoice(
+        pr: InvoiceColumns,
+        gstr2b: InvoiceColumns,
+        pr_rows: np.ndarray,
+        gstr2b_rows: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Unpaired invoices with the same invoice no and another GSTIN
+        (first SWEEP_MAX_CANDIDATES per PR invoice, GSTR-2B file order)
+        """
+        pr_rows = pr_rows[pr.keys[pr_rows] != ""]
+        pr_codes, gstr2b_codes = ColumnarReconciliationEngine._factorize(pr.keys[pr_rows], gstr2b.keys[gstr2b_rows])
+        order = np.argsort(gstr2b_codes, kind="stable")
+        sorted_codes = gstr2b_codes[order]
+        starts = np.searchsorted(sorted_codes, pr_codes, side="left")
+        counts = np.minimum(np.searchsorted(sorted_codes, pr_codes, side="right") - starts, SWEEP_MAX_CANDIDATES)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pr_idx = np.repeat(pr_rows, counts)
+        gstr2b_idx = gstr2b_rows[order[np.repeat(starts, counts) + within]]
+        other = pr.gstins[pr_idx] != gstr2b.gstins[gstr2b_idx]
+        return pr_idx[other], gstr2b_idx[other]
+
+    @staticmethod
+    def _nearest_totals(
+        pr: InvoiceColumns,
+        gstr2b: InvoiceColumns,
+        pr_rows: np.ndarray,
+        gstr2b_rows: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Unpaired invoices of the same GSTIN with another invoice no, the
+        SWEEP_MAX_CANDIDATES nearest by invoice total around each PR invoice
+        (nearest first)
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if len(pr_rows) == 0 or len(gstr2b_rows) == 0:
+            return empty, empty
+        pr_codes, gstr2b_codes = ColumnarReconciliationEngine._factorize(pr.gstins[pr_rows], gstr2b.gstins[gstr2b_rows])
+        pr_totals = pr.paise["taxable"][pr_rows] + pr.paise["total_tax"][pr_rows]
+        gstr2b_totals = gstr2b.paise["taxable"][gstr2b_rows] + gstr2b.paise["total_tax"][gstr2b_rows]
+        # (GSTIN, total) as one sortable key: totals replaced by their rank
+        pr_ranks, gstr2b_ranks = ColumnarReconciliationEngine._factorize(pr_totals, gstr2b_totals)
+        span = int(max(pr_ranks.max(initial=0), gstr2b_ranks.max(initial=0))) + 1
+        gstr2b_keys = gstr2b_codes * span + gstr2b_ranks
+        order = np.argsort(gstr2b_keys, kind="stable")
+        sorted_keys = gstr2b_keys[order]
+
+        group_start = np.searchsorted(sorted_keys, pr_codes * span, side="left")
+        group_end = np.searchsorted(sorted_keys, (pr_codes + 1) * span, side="left")
+        pos = np.searchsorted(sorted_keys, pr_codes * span + pr_ranks, side="left")
+        low = np.maximum(group_start, pos - SWEEP_MAX_CANDIDATES // 2)
+        window = low[:, None] + np.arange(SWEEP_MAX_CANDIDATES)
+        valid = window < group_end[:, None]
+
+        pr_order = np.repeat(np.arange(len(pr_rows)), SWEEP_MAX_CANDIDATES)[valid.ravel()]
+        gstr2b_pos = order[window[valid]]
+        pr_idx, gstr2b_idx = pr_rows[pr_order], gstr2b_rows[gstr2b_pos]
+        distance = np.abs(pr_totals[pr_order] - gstr2b_totals[gstr2b_pos])
+        nearest = np.lexsort((distance, pr_order))
+        pr_idx, gstr2b_idx = pr_idx[nearest], gstr2b_idx[nearest]
+        other = pr.keys[pr_idx] != gstr2b.keys[gstr2b_idx]
+        return pr_idx[other], gstr2b_idx[other]
+
+    def _materialize(self, pr: InvoiceColumns, gstr2b: InvoiceColumns) -> None:
+        """Per-candidate columns: absolute differences, date gap and GSTR-2B tax"""
+        def diff(field: str) -> np.ndarray:
+            return np.abs(pr.paise[field][self.pr_idx] - gstr2b.paise[field][self.gstr2b_idx])
+
+        self.taxable_diff = diff("taxable")
+        self.taxable_max = np.maximum(pr.paise["taxable"][self.pr_idx], gstr2b.paise["taxable"][self.gstr2b_idx])
+        self.head_diff = np.maximum.reduce([diff("igst"), diff("cgst"), diff("sgst")])
+        self.total_diff = np.abs(
+            pr.paise["taxable"][self.pr_idx] + pr.paise["total_tax"][self.pr_idx]
+            - gstr2b.paise["taxable"][self.gstr2b_idx] - gstr2b.paise["total_tax"][self.gstr2b_idx]
+        )
+        # Days between invoice dates, -1 where either is missing (a missing date never disqualifies)
+        pr_dates = pr.dates[self.pr_idx]
+        gstr2b_dates = gstr2b.dates[self.gstr2b_idx]
+        self.date_gap = np.where((pr_dates == 0) | (gstr2b_dates == 0), -1, np.abs(pr_dates - gstr2b_dates))
+        # Summed over a split group's parts; a merged group's one GSTR-2B invoice is booked once
+        self.gstr2b_tax = np.stack([gstr2b.paise[head][self.gstr2b_idx] for head in ITC_HEADS], axis=1)
+
+    # ============================================
+    # SWEEP
+    # ============================================
+
+    def classify(self, settings: List[ToleranceSetting]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluate every candidate under every setting at once.
+
+        Returns: (passes, status code) arrays of shape (settings, candidates)
+        """
+        def param(name: str) -> np.ndarray:
+            return np.array([getattr(s, name) for s in settings], dtype=np.int64)[:, None]
+
+        amount = param("amount_tolerance_paise")
+        large = self.taxable_max > param("percentage_threshold_paise")
+        taxable_ok = np.where(
+            large,
+            self.taxable_diff * 10000 <= self.taxable_max * param("percentage_tolerance_bps"),
+            self.taxable_diff <= amount
+        )
+        amounts_ok = taxable_ok & (self.head_diff <= amount)
+        dates_ok = (self.date_gap < 0) | (self.date_gap <= param("date_tolerance_days"))
+        total_ok = self.total_diff <= amount
+
+        requirement = self.requirement
+        always = np.ones_like(amounts_ok)
+        passes = np.select(
+            [
+                requirement == KEEP_KEY,
+                requirement == KEEP_AMOUNTS,
+                requirement == KEEP_AMOUNTS_DATE,
+                requirement == KEEP_TOTAL,
+                requirement == KEEP_AMOUNTS_DATE_OR_TOTAL,
+                requirement == KEEP_SPLIT,
+            ],
+            [
+                always,
+                amounts_ok,
+                amounts_ok & dates_ok,
+                total_ok,
+                (amounts_ok & dates_ok) | total_ok,
+                amounts_ok & total_ok,
+            ],
+            always
+        )
+        reclassified = np.where(
+            amounts_ok & dates_ok,
+            _CODES[MatchStatus.EXACT_MATCH],
+            np.where(amounts_ok, _CODES[MatchStatus.DATE_MISMATCH], _CODES[MatchStatus.AMOUNT_MISMATCH])
+        )
+        status = np.where(requirement == KEEP_KEY, reclassified, self.status)
+        return passes, status
+
+    def sweep(self, settings: List[ToleranceSetting]) -> List[Dict]:
+        """Status counts and ITC claimable / at risk (rupees per tax head) for each setting"""
+        if not settings:
+            return []
+        passes, status = self.classify(settings)
+        claimable_codes = [_CODES[s] for s in ITC_CLAIMABLE_STATUSES]
+        at_risk_codes = [_CODES[s] for s in ITC_AT_RISK_STATUSES]
+
+        summaries = []
+        for i, setting in enumerate(settings):
+            paired = self._pair(passes[i])
+            counts = np.bincount(status[i][paired], weights=self.results[paired], minlength=len(_STATUSES))
+            status_counts = {_STATUSES[code].value: int(n) for code, n in enumerate(counts) if n}
+            for single, n in (
+                (MatchStatus.PR_ONLY, self.pr_count - int(self.pr_used[paired].sum())),
+                (MatchStatus.GSTR2B_ONLY, self.gstr2b_count - int(self.gstr2b_used[paired].sum())),
+                (MatchStatus.DUPLICATE, self.duplicates),
+            ):
+                if n:
+                    status_counts[single.value] = n
+
+            claimable = self.gstr2b_tax[paired & np.isin(status[i], claimable_codes)].sum(axis=0)
+            at_risk = self.gstr2b_tax[paired & np.isin(status[i], at_risk_codes)].sum(axis=0)
+            summaries.append({
+                "setting": setting.as_dict(),
+                "status_counts": status_counts,
+                "stats": self.engine.stats_from_counts(status_counts),
+                "itc_claimable": {head: from_paise(int(claimable[h])) for h, head in enumerate(ITC_HEADS)},
+                "itc_at_risk": {head: from_paise(int(at_risk[h])) for h, head in enumerate(ITC_HEADS)},
+            })
+        return summaries
+
+    def _pair(self, passes: np.ndarray) -> np.ndarray:
+        """
+        Candidates paired under one setting: the run's candidates that pass,
+        then the other passing candidates first-come, each invoice once
+        """
+        paired = passes.copy()
+        paired[self.run_count:] = False
+        taken_pr = np.zeros(self.pr_row_count, dtype=bool)
+        taken_gstr2b = np.zeros(self.gstr2b_row_count, dtype=bool)
+        taken_pr[self.member_pr[paired[self.member_pr_of]]] = True
+        taken_gstr2b[self.member_gstr2b[paired[self.member_gstr2b_of]]] = True
+
+        others = np.flatnonzero(passes[self.run_count:]) + self.run_count
+        others = others[~taken_pr[self.pr_idx[others]] & ~taken_gstr2b[self.gstr2b_idx[others]]]
+        taken_pr = bytearray(taken_pr.tobytes())
+        taken_gstr2b = bytearray(taken_gstr2b.tobytes())
+        for pos, pr, gstr2b in zip(others.tolist(), self.pr_idx[others].tolist(), self.gstr2b_idx[others].tolist()):
+            if not taken_pr[pr] and not taken_gstr2b[gstr2b]:
+                taken_pr[pr] = taken_gstr2b[gstr2b] = 1
+                paired[pos] = True
+        return paired
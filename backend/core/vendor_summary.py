@@ -0,0 +1,148 @@
+"""
+Vendor Summary
+Per-vendor, per-period aggregates of both registers, built in one vectorized pass
+"""
+from typing import List, Dict, Tuple, Optional
+from collections import deque
+from dataclasses import dataclass
+from datetime import date
+import numpy as np
+import pandas as pd
+
+from core.invoice_record import InvoiceRecord, from_paise
+
+
+SUMMARY_FIELDS = ("taxable", "igst", "cgst", "sgst", "cess", "total_tax")
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@dataclass
+class VendorAggregate:
+    """Invoice count and amount totals (paise) of one GSTIN for one period, per side"""
+    gstin: str
+    period: str  # "YYYY-MM" of the invoice date, "" when undated
+    pr_count: int
+    gstr2b_count: int
+    pr_totals: Dict[str, int]
+    gstr2b_totals: Dict[str, int]
+
+    @property
+    def balanced(self) -> bool:
+        """Same number of invoices and identical totals on both sides"""
+        return self.pr_count == self.gstr2b_count and self.pr_totals == self.gstr2b_totals
+
+    def as_dict(self) -> Dict:
+        """Summary row in rupees; deltas are PR minus GSTR-2B"""
+        return {
+            "vendor_gstin": self.gstin,
+            "period": self.period,
+            "pr_count": self.pr_count,
+            "gstr2b_count": self.gstr2b_count,
+            "pr_taxable": from_paise(self.pr_totals["taxable"]),
+            "gstr2b_taxable": from_paise(self.gstr2b_totals["taxable"]),
+            "taxable_delta": from_paise(self.pr_totals["taxable"] - self.gstr2b_totals["taxable"]),
+            "pr_tax": from_paise(self.pr_totals["total_tax"]),
+            "gstr2b_tax": from_paise(self.gstr2b_totals["total_tax"]),
+            "tax_delta": from_paise(self.pr_totals["total_tax"] - self.gstr2b_totals["total_tax"]),
+            "balanced": self.balanced,
+        }
+
+
+def period_of(ordinal: Optional[int]) -> str:
+    """"YYYY-MM" of a date ordinal, "" when missing"""
+    if not ordinal:
+        return ""
+    day = date.fromordinal(ordinal)
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def _periods(ordinals: List[Optional[int]]) -> np.ndarray:
+    """"YYYY-MM" per date ordinal ("" for missing dates), vectorized"""
+    days = np.array([o or 0 for o in ordinals], dtype=np.int64)
+    months = (days - _EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]").astype(str)
+    return np.where(days > 0, months, "")
+
+
+def _side_frame(records: List[InvoiceRecord], prefix: str) -> pd.DataFrame:
+    """Count and per-field sums of one side, grouped by (GSTIN, period)"""
+    frame = pd.DataFrame({
+        "gstin": [rec.gstin for rec in records],
+        "period": _periods([rec.date_ordinal for rec in records]),
+        **{f: np.array([getattr(rec, f) for rec in records], dtype=np.int64) for f in SUMMARY_FIELDS},
+    })
+    grouped = frame.groupby(["gstin", "period"], sort=False).agg(
+        count=("taxable", "size"), **{f: (f, "sum") for f in SUMMARY_FIELDS}
+    )
+    return grouped.add_prefix(prefix)
+
+
+def aggregate_vendors(
+    pr_records: List[InvoiceRecord],
+    gstr2b_records: List[InvoiceRecord]
+) -> Dict[Tuple[str, str], VendorAggregate]:
+    """Aggregate both sides per (GSTIN, period) with a groupby each and one outer join, sorted by key"""
+    table = _side_frame(pr_records, "pr_").join(_side_frame(gstr2b_records, "gstr2b_"), how="outer")
+    table = table.fillna(0).astype(np.int64).sort_index()
+
+    vendors: Dict[Tuple[str, str], VendorAggregate] = {}
+    for (gstin, period), row in zip(table.index, table.to_dict("records")):
+        vendors[(gstin, period)] = VendorAggregate(
+            gstin=gstin,
+            period=period,
+            pr_count=row["pr_count"],
+            gstr2b_count=row["gstr2b_count"],
+            pr_totals={f: row["pr_" + f] for f in SUMMARY_FIELDS},
+            gstr2b_totals={f: row["gstr2b_" + f] for f in SUMMARY_FIELDS},
+        )
+    return vendors
+
+
+def balanced_pairs(
+    pr_records: List[InvoiceRecord],
+    gstr2b_records: List[InvoiceRecord],
+    vendors: Dict[Tuple[str, str], VendorAggregate]
+) -> Dict[str, int]:
+    """
+    Fast path for balanced vendors: pair every invoice of a balanced
+    (GSTIN, period) with an identical GSTR-2B invoice (same exact_key, first
+    in file order, PR order), as the identical-invoice rule would.
+    Vendor periods where any invoice is left over are not paired here and go
+    through the rule passes instead.
+
+    Returns: {PR record id: GSTR-2B position}
+    """
+    balanced = {key for key, vendor in vendors.items() if vendor.balanced}
+    if not balanced:
+        return {}
+
+    periods: Dict[Optional[int], str] = {}
+
+    def group(rec: InvoiceRecord) -> Tuple[str, str]:
+        period = periods.get(rec.date_ordinal)
+        if period is None:
+            period = periods[rec.date_ordinal] = period_of(rec.date_ordinal)
+        return (rec.gstin, period)
+
+    by_exact_key: Dict[Tuple, deque] = {}
+    for pos, rec in enumerate(gstr2b_records):
+        if rec.key and group(rec) in balanced:
+            by_exact_key.setdefault(rec.exact_key, deque()).append(pos)
+
+    pairs: Dict[Tuple[str, str], List[Tuple[str, int]]] = {}
+    failed = set()
+    for rec in pr_records:
+        key = group(rec)
+        if key not in balanced or key in failed:
+            continue
+        candidates = by_exact_key.get(rec.exact_key) if rec.key else None
+        if not candidates:
+            failed.add(key)
+            continue
+        pairs.setdefault(key, []).append((rec.id, candidates.popleft()))
+
+    return {
+        pr_id: pos
+        for key, group_pairs in pairs.items() if key not in failed
+        for pr_id, pos in group_pairs
+    }
@@ -4,9 +4,11 @@ Main FastAPI Application
 """
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
 
 from config import get_settings
+from core.parallel_engine import warm_process_pool, shutdown_process_pool
 from api.routes import reconciliation, files, ai, clients, auth, reconcile, email_generator, admin, simple_clients
 
 
@@ -15,8 +17,13 @@ async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
     print("🚀 Finto GST Reconciliation API starting...")
+    workers = get_settings().reconcile_workers
+    if workers > 1:
+        started = await run_in_threadpool(warm_process_pool, workers)
+        print(f"⚙️ Reconciliation worker pool started ({started}/{workers} processes)")
     yield
     # Shutdown
+    shutdown_process_pool()
     print("👋 Finto GST Reconciliation API shutting down...")
 
 
@@ -2,7 +2,7 @@
 Pydantic Models/Schemas for API requests and responses
 """
 from pydantic import BaseModel, Field
-from typing import Optional, List, Any
+from typing import Optional, List, Dict, Any
 from datetime import date, datetime
 from enum import Enum
 
@@ -36,6 +36,8 @@ class MatchStatus(str, Enum):
     AMOUNT_MISMATCH = "amount_mismatch"
     DATE_MISMATCH = "date_mismatch"
     GSTIN_MISMATCH = "gstin_mismatch"
+    INVOICE_MISMATCH = "invoice_mismatch"
+    SPLIT_MATCH = "split_match"
     PR_ONLY = "pr_only"
     GSTR2B_ONLY = "gstr2b_only"
     DUPLICATE = "duplicate"
@@ -60,6 +62,7 @@ class ClientBase(BaseModel):
     email: Optional[str] = None
     phone: Optional[str] = None
     address: Optional[str] = None
+    rule_profile: Optional[Dict[str, Any]] = None  # Matching rules (core.rule_profile.RuleProfile JSON)
 
 
 class ClientCreate(ClientBase):
@@ -169,6 +172,17 @@ class ReconciliationStartRequest(BaseModel):
     run_id: str
 
 
+class ToleranceSettingRequest(BaseModel):
+    """One what-if tolerance setting; omitted fields keep the engine's value"""
+    amount_tolerance: Optional[float] = Field(None, ge=0)  # Rupees
+    percentage_tolerance: Optional[float] = Field(None, ge=0)  # Percent, for large amounts
+    date_tolerance_days: Optional[int] = Field(None, ge=0)
+
+
+class ToleranceSweepRequest(BaseModel):
+    settings: List[ToleranceSettingRequest] = Field(..., min_length=1, max_length=50)
+
+
 class ReconciliationStats(BaseModel):
     total_records: int
     auto_matched: int
@@ -2,9 +2,71 @@
 Invoice Matching Engine
 Matches Purchase Register invoices with GSTR-2B invoices
 """
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterator
 from datetime import datetime, timedelta
+from bisect import bisect_left
 from models.schemas import MatchStatus
+from core.invoice_record import date_ordinal
+
+
+class _AmountSortedCandidates:
+    """
+    Unmatched GSTR-2B invoices of one GSTIN, sorted by taxable value.
+    Claimed entries are skipped through path-compressed next/previous
+    pointers, so removal is O(1) amortized and never shifts the list.
+    """
+    
+    def __init__(self, entries: List[Tuple[float, int, str, Dict]]):
+        entries.sort(key=lambda e: (e[0], e[1]))
+        self.amounts = [e[0] for e in entries]
+        self.entries = entries
+        n = len(entries)
+        self._next = list(range(n + 1))  # _next[i]: first unclaimed index >= i (n = none)
+        self._prev = list(range(n + 1))  # _prev[i + 1]: last unclaimed index <= i, plus one (0 = none)
+    
+    @staticmethod
+    def _find(pointers: List[int], i: int) -> int:
+        root = i
+        while pointers[root] != root:
+            root = pointers[root]
+        while pointers[i] != root:
+            pointers[i], i = root, pointers[i]
+        return root
+    
+    def claim(self, i: int) -> None:
+        """Remove entry i from future lookups"""
+        self._next[i] = i + 1
+        self._prev[i + 1] = i
+    
+    def _rightward(self, i: int) -> Iterator[int]:
+        """Unclaimed indexes >= i, ascending"""
+        i = self._find(self._next, i)
+        while i < len(self.entries):
+            yield i
+            i = self._find(self._next, i + 1)
+    
+    def _leftward(self, i: int) -> Iterator[int]:
+        """Unclaimed indexes < i, descending"""
+        i = self._find(self._prev, i)
+        while i > 0:
+            yield i - 1
+            i = self._find(self._prev, i - 1)
+    
+    def nearest(self, amount: float, max_diff: float) -> Optional[int]:
+        """
+        Unclaimed entry closest to `amount` within `max_diff`; ties go to the
+        earliest candidate. Only entries inside the band are visited.
+        """
+        best = None
+        start = bisect_left(self.amounts, amount)
+        for side in (self._rightward(start), self._leftward(start)):
+            for i in side:
+                diff = abs(amount - self.amounts[i])
+                if diff > max_diff or (best is not None and diff > best[0]):
+                    break
+                if best is None or (diff, self.entries[i][1]) < best:
+                    best = (diff, self.entries[i][1], i)
+        return best[2] if best is not None else None
 
 
 class MatchingEngine:
@@ -57,9 +119,10 @@ class MatchingEngine:
         if self.fuzzy_invoice_match:
             unmatched_pr = {k: v for k, v in pr_map.items() if k not in matched_pr}
             unmatched_gstr2b = {k: v for k, v in gstr2b_map.items() if k not in matched_gstr2b}
+            candidates = self._group_fuzzy_candidates(unmatched_gstr2b)
             
             for pr_key, pr_inv in unmatched_pr.items():
-                best_match = self._find_fuzzy_match(pr_inv, unmatched_gstr2b)
+                best_match = self._find_fuzzy_match(pr_inv, candidates)
                 if best_match:
                     gstr2b_key, gstr2b_inv, score = best_match
                     result = self._compare_invoices(pr_inv, gstr2b_inv)
@@ -152,10 +215,10 @@ class MatchingEngine:
             status = MatchStatus.AMOUNT_MISMATCH.value
             confidence = max(50, 100 - (total_diff / 100))
         
-        # Check date mismatch
-        pr_date = pr_inv.get("invoice_date")
-        gstr2b_date = gstr2b_inv.get("invoice_date")
-        if pr_date and gstr2b_date and pr_date != gstr2b_date:
+        # Check date mismatch (beyond the date tolerance)
+        pr_date = date_ordinal(pr_inv.get("invoice_date"))
+        gstr2b_date = date_ordinal(gstr2b_inv.get("invoice_date"))
+        if pr_date and gstr2b_date and abs(pr_date - gstr2b_date) > self.date_tolerance_days:
             if status == MatchStatus.EXACT_MATCH.value:
                 status = MatchStatus.DATE_MISMATCH.value
                 confidence = 85
@@ -173,39 +236,45 @@ class MatchingEngine:
             "total_diff": total_diff
         }
     
+    def _group_fuzzy_candidates(
+        self, 
+        candidates: Dict[str, Dict]
+    ) -> Dict[str, _AmountSortedCandidates]:
+        """Group fuzzy-match candidates by normalized GSTIN, each sorted by taxable value"""
+        groups: Dict[str, List[Tuple[float, int, str, Dict]]] = {}
+        for order, (key, gstr2b_inv) in enumerate(candidates.items()):
+            gstin = self._normalize_gstin(gstr2b_inv.get("vendor_gstin", ""))
+            amount = gstr2b_inv.get("taxable_value", 0) or 0
+            groups.setdefault(gstin, []).append((amount, order, key, gstr2b_inv))
+        return {gstin: _AmountSortedCandidates(entries) for gstin, entries in groups.items()}
+    
     def _find_fuzzy_match(
         self, 
         pr_inv: Dict, 
-        candidates: Dict[str, Dict]
+        candidates: Dict[str, _AmountSortedCandidates]
     ) -> Optional[Tuple[str, Dict, float]]:
-        """Find best fuzzy match for an invoice"""
-        
+        """
+        Find (and claim) the best fuzzy match for an invoice: same GSTIN,
+        closest taxable value within 10%. Only the GSTIN's amount band is searched.
+        """
         pr_gstin = self._normalize_gstin(pr_inv.get("vendor_gstin", ""))
-        pr_amount = pr_inv.get("taxable_value", 0)
+        pr_amount = pr_inv.get("taxable_value", 0) or 0
         
-        best_match = None
-        best_score = 0
+        group = candidates.get(pr_gstin)
+        if group is None or pr_amount < 0:
+            return None
         
-        for key, gstr2b_inv in candidates.items():
-            gstr2b_gstin = self._normalize_gstin(gstr2b_inv.get("vendor_gstin", ""))
-            gstr2b_amount = gstr2b_inv.get("taxable_value", 0)
-            
-            # Must have same GSTIN
-            if pr_gstin != gstr2b_gstin:
-                continue
-            
-            # Calculate similarity score
-            amount_diff = abs(pr_amount - gstr2b_amount)
-            if amount_diff > pr_amount * 0.1:  # More than 10% difference
-                continue
-            
-            score = 100 - (amount_diff / max(pr_amount, 1) * 100)
-            
-            if score > best_score and score >= 70:
-                best_score = score
-                best_match = (key, gstr2b_inv, score)
+        i = group.nearest(pr_amount, pr_amount * 0.1)  # More than 10% difference never matches
+        if i is None:
+            return None
+        
+        amount, _, key, gstr2b_inv = group.entries[i]
+        score = 100 - (abs(pr_amount - amount) / max(pr_amount, 1) * 100)
+        if score < 70:
+            return None
         
-        return best_match
+        group.claim(i)
+        return (key, gstr2b_inv, score)
     
     def get_summary_stats(self, results: List[Dict]) -> Dict:
         """Calculate summary statistics from match results"""
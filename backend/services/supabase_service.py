@@ -3,7 +3,16 @@ Supabase Service - Database operations
 """
 from supabase import create_client, Client
 from config import get_settings
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+from core.open_items import PROBE_CHUNK_SIZE
+
+
+# Invoices per request when paging through a run's invoices
+INVOICE_PAGE_SIZE = 1000
+
+# Ids per `in` filter when deleting rows by id (keeps request URLs short)
+ID_CHUNK_SIZE = 200
 
 
 class SupabaseService:
@@ -91,6 +100,23 @@ class SupabaseService:
         response = self.client.table("invoices").insert(invoices).execute()
         return response.data
     
+    async def upsert_invoices(self, invoices: List[Dict]) -> None:
+        """Insert or replace invoices by id (a revised file's new rows and moved rows)"""
+        for start in range(0, len(invoices), INVOICE_PAGE_SIZE):
+            self.client.table("invoices").upsert(
+                invoices[start:start + INVOICE_PAGE_SIZE], on_conflict="id"
+            ).execute()
+    
+    async def delete_invoices(self, invoice_ids: List[str]) -> None:
+        """Delete invoices by id"""
+        for start in range(0, len(invoice_ids), ID_CHUNK_SIZE):
+            (
+                self.client.table("invoices")
+                .delete()
+                .in_("id", invoice_ids[start:start + ID_CHUNK_SIZE])
+                .execute()
+            )
+    
     async def get_invoices_for_run(self, run_id: str, source: Optional[str] = None) -> List[Dict]:
         """Get all invoices for a run, optionally filtered by source"""
         query = self.client.table("invoices").select("*").eq("run_id", run_id)
@@ -99,6 +125,39 @@ class SupabaseService:
         response = query.execute()
         return response.data
     
+    async def count_invoices_for_run(self, run_id: str, source: str) -> int:
+        """Number of invoices of a run on one side, without reading them"""
+        response = (
+            self.client.table("invoices")
+            .select("id", count="exact", head=True)
+            .eq("run_id", run_id)
+            .eq("source", source)
+            .execute()
+        )
+        return response.count or 0
+    
+    def iter_invoices_for_run(self, run_id: str, source: str, page_size: int = INVOICE_PAGE_SIZE) -> Iterator[Dict]:
+        """
+        Invoices of a run on one side in file order (row number, id), read one
+        page at a time; blocking, so consume it off the event loop
+        """
+        start = 0
+        while True:
+            response = (
+                self.client.table("invoices")
+                .select("*")
+                .eq("run_id", run_id)
+                .eq("source", source)
+                .order("row_number")
+                .order("id")
+                .range(start, start + page_size - 1)
+                .execute()
+            )
+            yield from response.data
+            if len(response.data) < page_size:
+                return
+            start += page_size
+    
     # ============================================
     # MATCH RESULTS
     # ============================================
@@ -108,13 +167,53 @@ class SupabaseService:
         response = self.client.table("match_results").insert(results).execute()
         return response.data
     
+    async def delete_match_results(self, run_id: str, keys: List[Tuple[Optional[str], Optional[str]]]) -> None:
+        """
+        Delete a run's match results by (PR invoice id, GSTR-2B invoice id).
+        A PR invoice is in one result of a run, so results with a PR side are
+        deleted by it; the rest by their GSTR-2B invoice.
+        """
+        pr_ids = [pr_id for pr_id, _ in keys if pr_id]
+        gstr2b_ids = [gstr2b_id for pr_id, gstr2b_id in keys if not pr_id and gstr2b_id]
+        for start in range(0, len(pr_ids), ID_CHUNK_SIZE):
+            (
+                self.client.table("match_results")
+                .delete()
+                .eq("run_id", run_id)
+                .in_("pr_invoice_id", pr_ids[start:start + ID_CHUNK_SIZE])
+                .execute()
+            )
+        for start in range(0, len(gstr2b_ids), ID_CHUNK_SIZE):
+            (
+                self.client.table("match_results")
+                .delete()
+                .eq("run_id", run_id)
+                .is_("pr_invoice_id", "null")
+                .in_("gstr2b_invoice_id", gstr2b_ids[start:start + ID_CHUNK_SIZE])
+                .execute()
+            )
+    
     async def get_match_results_for_run(self, run_id: str, status: Optional[str] = None) -> List[Dict]:
         """Get all match results for a run"""
-        query = self.client.table("match_results").select("*").eq("run_id", run_id)
-        if status:
-            query = query.eq("match_status", status)
-        response = query.execute()
-        return response.data
+        return list(self.iter_match_results_for_run(run_id, status))
+    
+    def iter_match_results_for_run(
+        self, run_id: str, status: Optional[str] = None, page_size: int = INVOICE_PAGE_SIZE
+    ) -> Iterator[Dict]:
+        """
+        Match results of a run (optionally one status) in id order, read one
+        page at a time; blocking, so consume it off the event loop
+        """
+        start = 0
+        while True:
+            query = self.client.table("match_results").select("*").eq("run_id", run_id)
+            if status:
+                query = query.eq("match_status", status)
+            response = query.order("id").range(start, start + page_size - 1).execute()
+            yield from response.data
+            if len(response.data) < page_size:
+                return
+            start += page_size
     
     async def get_match_result(self, result_id: str) -> Optional[Dict]:
         """Get a single match result with related invoices"""
@@ -132,6 +231,60 @@ class SupabaseService:
         response = self.client.table("match_results").update(data).eq("id", result_id).execute()
         return response.data[0]
     
+    # ============================================
+    # OPEN ITEMS
+    # ============================================
+    
+    async def get_open_items(self, client_id: str, match_keys: List[str]) -> List[Dict]:
+        """Open items of a client under the given match keys, oldest first per key"""
+        items = []
+        for start in range(0, len(match_keys), PROBE_CHUNK_SIZE):
+            response = (
+                self.client.table("open_items")
+                .select("*")
+                .eq("client_id", client_id)
+                .eq("status", "open")
+                .in_("match_key", match_keys[start:start + PROBE_CHUNK_SIZE])
+                .order("created_at")
+                .execute()
+            )
+            items.extend(response.data)
+        return items
+    
+    async def reset_open_items_for_period(self, client_id: str, return_period: str) -> None:
+        """Undo an earlier run of the period: drop the items it opened, reopen the ones it closed"""
+        (
+            self.client.table("open_items")
+            .delete()
+            .eq("client_id", client_id)
+            .eq("return_period", return_period)
+            .eq("status", "open")
+            .execute()
+        )
+        (
+            self.client.table("open_items")
+            .update({"status": "open", "closed_period": None, "closed_by_invoice_id": None, "closed_at": None})
+            .eq("client_id", client_id)
+            .eq("closed_period", return_period)
+            .execute()
+        )
+    
+    async def close_open_items(self, items: List[Dict]) -> None:
+        """Close open items in one request (full rows with id and closing fields, upserted on id)"""
+        if items:
+            self.client.table("open_items").upsert(
+                [{**item, "status": "closed"} for item in items], on_conflict="id"
+            ).execute()
+    
+    async def bulk_insert_open_items(self, items: List[Dict]) -> List[Dict]:
+        """Bulk insert open items (rows already stored for the period are skipped)"""
+        response = (
+            self.client.table("open_items")
+            .upsert(items, on_conflict="client_id,item_hash", ignore_duplicates=True)
+            .execute()
+        )
+        return response.data
+    
     # ============================================
     # CLASSIFICATIONS
     # ============================================
@@ -0,0 +1,52 @@
+"""
+Random Purchase Register / GSTR-2B registers for engine tests
+"""
+from typing import List, Dict, Tuple
+import random
+
+
+def make_registers(n_pr: int, n_gstr2b: int, seed: int = 0, n_vendors: int = 5) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Invoice dicts for both registers. Most GSTR-2B rows copy a PR row with
+    a perturbed amount, date, invoice number or GSTIN, so every rule fires.
+    """
+    rnd = random.Random(seed)
+    gstins = [f"{rnd.randint(10, 37)}ABCDE{1000 + i}F1Z{i % 10}" for i in range(n_vendors)]
+    n_keys = max(1, n_pr // 2)
+
+    def invoice(i: int, source: str) -> Dict:
+        taxable = round(rnd.choice([rnd.uniform(0, 200), rnd.uniform(9000, 20000), 100.10, 10000.0]), 2)
+        igst = round(rnd.choice([0, taxable * 0.18, 18.0]), 2)
+        cgst = round(rnd.choice([0, taxable * 0.09, 9.0]), 2)
+        return {
+            "id": f"{source}_{i}",
+            "invoice_no": rnd.choice(["INV-", "inv/", ""]) + str(rnd.randint(1, n_keys)),
+            "vendor_gstin": rnd.choice(gstins) + rnd.choice(["", " "]),
+            "invoice_date": f"2024-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}",
+            "taxable_value": taxable,
+            "igst": igst,
+            "cgst": cgst,
+            "sgst": cgst,
+            "cess": 0.0,
+            "total_tax": round(igst + 2 * cgst, 2),
+            "row_number": i + 2,
+        }
+
+    pr = [invoice(i, "pr") for i in range(n_pr)]
+    gstr2b = []
+    for i in range(n_gstr2b):
+        if pr and rnd.random() < 0.7:
+            inv = dict(rnd.choice(pr), id=f"gstr2b_{i}", row_number=i + 2)
+            change = rnd.random()
+            if change < 0.15:
+                inv["taxable_value"] = round(inv["taxable_value"] + rnd.choice([0.5, 3, 250]), 2)
+            elif change < 0.3:
+                inv["invoice_date"] = f"2024-1{rnd.randint(0, 2)}-0{rnd.randint(1, 9)}"
+            elif change < 0.4:
+                inv["invoice_no"] = "X" + inv["invoice_no"]
+            elif change < 0.5:
+                inv["vendor_gstin"] = rnd.choice(gstins)
+            gstr2b.append(inv)
+        else:
+            gstr2b.append(invoice(i, "gstr2b"))
+    return pr, gstr2b
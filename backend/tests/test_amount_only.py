@@ -0,0 +1,69 @@
+"""
+Amount-only rule tier: same GSTIN and invoice total within tolerance, any invoice number or date
+"""
+import random
+
+import pytest
+
+from core.candidate_index import CandidateIndex
+from core.invoice_record import normalize_invoices
+from core.reconciliation_engine import ReconciliationEngine, MatchStatus
+
+GSTIN = "27ABCDE1234F1Z5"
+
+
+def _invoice(id, invoice_no, taxable, igst=0.0, cgst=0.0, sgst=0.0, gstin=GSTIN, invoice_date="2024-07-01"):
+    return {
+        "id": id, "vendor_gstin": gstin, "invoice_no": invoice_no, "invoice_date": invoice_date,
+        "taxable_value": taxable, "igst": igst, "cgst": cgst, "sgst": sgst, "cess": 0.0,
+        "total_tax": round(igst + cgst + sgst, 2),
+    }
+
+
+def _pr_result(pr, gstr2b, pr_id="pr_0"):
+    return next(r for r in ReconciliationEngine().reconcile(pr, gstr2b) if r.pr_invoice_id == pr_id)
+
+
+def test_reissued_invoice_pairs_on_total_only():
+    # New number, date outside the window and the tax re-split: only the total agrees
+    pr = [_invoice("pr_0", "A-100", 1000.0, igst=180.0)]
+    gstr2b = [_invoice("gstr2b_0", "REISSUE-9", 1000.5, cgst=90.0, sgst=89.5, invoice_date="2024-11-20")]
+    result = _pr_result(pr, gstr2b)
+    assert result.status == MatchStatus.INVOICE_MISMATCH
+    assert result.gstr2b_invoice_id == "gstr2b_0"
+    assert result.confidence_score == 50.0
+
+
+@pytest.mark.parametrize("gstr2b_total_tax, pairs", [(181.0, True), (181.01, False)])
+def test_total_tolerance_is_inclusive(gstr2b_total_tax, pairs):
+    pr = [_invoice("pr_0", "A-100", 1000.0, igst=180.0)]
+    gstr2b = [_invoice("gstr2b_0", "B-7", 1000.0, cgst=gstr2b_total_tax / 2, sgst=gstr2b_total_tax / 2)]
+    assert (_pr_result(pr, gstr2b).status == MatchStatus.INVOICE_MISMATCH) is pairs
+
+
+def test_other_gstin_never_pairs_on_total():
+    pr = [_invoice("pr_0", "A-100", 1000.0, igst=180.0)]
+    gstr2b = [_invoice("gstr2b_0", "B-7", 1000.0, igst=180.0, gstin="29ABCDE1234F1Z5", invoice_date="2024-11-20")]
+    assert _pr_result(pr, gstr2b).status == MatchStatus.PR_ONLY
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_total_bands_find_every_candidate_within_tolerance(seed):
+    rnd = random.Random(seed)
+    tolerance = ReconciliationEngine.AMOUNT_TOLERANCE_PAISE
+    gstins = [GSTIN, "29ABCDE1234F1Z5"]
+    records = normalize_invoices([
+        _invoice(f"g{i}", str(i), round(rnd.uniform(0, 30), 2), gstin=rnd.choice(gstins)) for i in range(300)
+    ])
+    probes = normalize_invoices([
+        _invoice(f"p{i}", str(i), round(rnd.uniform(0, 30), 2), gstin=rnd.choice(gstins)) for i in range(100)
+    ])
+    claimed = [rnd.random() < 0.2 for _ in records]
+    index = CandidateIndex(records, tolerance)
+    for probe in probes:
+        found = set(index.same_gstin_total(probe, claimed))
+        expected = {
+            pos for pos, rec in enumerate(records)
+            if rec.gstin == probe.gstin and not claimed[pos] and abs(rec.total - probe.total) <= tolerance
+        }
+        assert expected <= found
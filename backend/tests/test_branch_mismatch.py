@@ -0,0 +1,79 @@
+"""
+Cross-branch GSTIN mismatches: same PAN and invoice, GSTIN registered in another state
+"""
+import random
+
+import pytest
+
+from core.reconciliation_engine import ReconciliationEngine, MatchStatus
+from core.columnar_engine import ColumnarReconciliationEngine
+from core.parallel_engine import ParallelReconciliationEngine, shutdown_process_pool
+from tests.factories import make_registers
+
+BRANCH_CONFIDENCE, BRANCH_TEXT = ReconciliationEngine.BRANCH_MISMATCH_RULE
+
+
+@pytest.fixture(scope="module", autouse=True)
+def process_pool():
+    yield
+    shutdown_process_pool()
+
+
+def _invoice(id, gstin, invoice_no="INV-1"):
+    return {
+        "id": id, "vendor_gstin": gstin, "invoice_no": invoice_no, "invoice_date": "2024-07-01",
+        "taxable_value": 1000.0, "igst": 180.0, "cgst": 0.0, "sgst": 0.0, "cess": 0.0, "total_tax": 180.0,
+    }
+
+
+def _by_pr(results):
+    return {r.pr_invoice_id: r for r in results if r.pr_invoice_id}
+
+
+def _with_branches(gstr2b, seed):
+    """Move a share of GSTR-2B rows to another state code of the same PAN"""
+    rnd = random.Random(seed)
+    for inv in gstr2b:
+        if rnd.random() < 0.15:
+            inv["vendor_gstin"] = f"{rnd.randint(10, 37)}{inv['vendor_gstin'].strip()[2:]}"
+    return gstr2b
+
+
+def test_same_pan_other_state_is_a_branch_mismatch():
+    result = _by_pr(ReconciliationEngine().reconcile(
+        [_invoice("pr_0", "27ABCDE1234F1Z5")], [_invoice("gstr2b_0", "29ABCDE1234F1Z5")]
+    ))["pr_0"]
+    assert result.status == MatchStatus.GSTIN_MISMATCH
+    assert (result.confidence_score, result.match_rule) == (BRANCH_CONFIDENCE, BRANCH_TEXT)
+
+
+def test_other_pan_is_a_plain_gstin_mismatch():
+    result = _by_pr(ReconciliationEngine().reconcile(
+        [_invoice("pr_0", "27ABCDE1234F1Z5")], [_invoice("gstr2b_0", "27PQRST9876K1Z2")]
+    ))["pr_0"]
+    assert result.status == MatchStatus.GSTIN_MISMATCH
+    assert result.match_rule != BRANCH_TEXT
+
+
+def test_branch_candidate_wins_over_other_pan():
+    pr = [_invoice("pr_0", "27ABCDE1234F1Z5")]
+    gstr2b = [_invoice("gstr2b_0", "27PQRST9876K1Z2"), _invoice("gstr2b_1", "29ABCDE1234F1Z5")]
+    assert _by_pr(ReconciliationEngine().reconcile(pr, gstr2b))["pr_0"].gstr2b_invoice_id == "gstr2b_1"
+
+
+def test_match_single_pair_tags_branch_mismatch():
+    result = ReconciliationEngine().match_single_pair(
+        _invoice("pr_0", "27ABCDE1234F1Z5"), _invoice("gstr2b_0", "29ABCDE1234F1Z5")
+    )
+    assert result.status == MatchStatus.GSTIN_MISMATCH
+    assert result.match_rule == BRANCH_TEXT
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_engines_agree_with_branch_gstins(seed):
+    pr, gstr2b = make_registers(300, 280, seed=seed, n_vendors=8)
+    gstr2b = _with_branches(gstr2b, seed)
+    expected = ReconciliationEngine().reconcile(pr, gstr2b)
+    assert any(r.match_rule == BRANCH_TEXT for r in expected)
+    assert ColumnarReconciliationEngine().reconcile(pr, gstr2b) == expected
+    assert ParallelReconciliationEngine(2).reconcile(pr, gstr2b) == expected
@@ -0,0 +1,25 @@
+"""
+ColumnarReconciliationEngine against the row engine it replaces on large runs
+"""
+import pytest
+
+from core.reconciliation_engine import ReconciliationEngine
+from core.columnar_engine import ColumnarReconciliationEngine, select_engine, COLUMNAR_MIN_ROWS
+from tests.factories import make_registers
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_columnar_engine_matches_row_engine(seed):
+    pr, gstr2b = make_registers(150 + 50 * seed, 140 + 50 * seed, seed=seed, n_vendors=seed + 1)
+    assert ColumnarReconciliationEngine().reconcile(pr, gstr2b) == ReconciliationEngine().reconcile(pr, gstr2b)
+
+
+def test_columnar_engine_one_side_empty():
+    pr, gstr2b = make_registers(40, 30, seed=1)
+    for args in ((pr, []), ([], gstr2b), ([], [])):
+        assert ColumnarReconciliationEngine().reconcile(*args) == ReconciliationEngine().reconcile(*args)
+
+
+def test_select_engine_by_size():
+    assert type(select_engine(COLUMNAR_MIN_ROWS, 0)) is ColumnarReconciliationEngine
+    assert type(select_engine(COLUMNAR_MIN_ROWS - 1, 0)) is ReconciliationEngine
@@ -0,0 +1,46 @@
+"""
+One shared ReconciliationEngine serving concurrent runs (as the API routes do via run_in_threadpool)
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext
+from core.columnar_engine import ColumnarReconciliationEngine
+from tests.factories import make_registers
+
+RUNS = 16
+
+
+def _fresh_run(engine_class, pr, gstr2b):
+    context = ReconciliationContext()
+    return engine_class().reconcile(pr, gstr2b, context), context
+
+
+def _check_shared_engine(engine_class):
+    registers = [make_registers(150 + 10 * i, 140 + 10 * i, seed=i) for i in range(RUNS)]
+    expected = [_fresh_run(engine_class, pr, gstr2b) for pr, gstr2b in registers]
+
+    engine = engine_class()
+
+    def run(i):
+        context = ReconciliationContext()
+        pr, gstr2b = registers[i]
+        return engine.reconcile(pr, gstr2b, context), context
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        # Every run twice, interleaved, so the same inputs also race each other
+        actual = list(pool.map(run, [i % RUNS for i in range(2 * RUNS)]))
+
+    for i, (results, context) in enumerate(actual):
+        expected_results, expected_context = expected[i % RUNS]
+        assert results == expected_results
+        assert context.totals == expected_context.totals
+        assert context.matched_pr_ids == expected_context.matched_pr_ids
+        assert context.matched_gstr2b_ids == expected_context.matched_gstr2b_ids
+
+
+def test_shared_row_engine_concurrent_runs():
+    _check_shared_engine(ReconciliationEngine)
+
+
+def test_shared_columnar_engine_concurrent_runs():
+    _check_shared_engine(ColumnarReconciliationEngine)
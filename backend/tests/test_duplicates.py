@@ -0,0 +1,57 @@
+"""
+Duplicate rows of one register are split off as DUPLICATE results before matching
+"""
+import pytest
+
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext, MatchStatus
+from core.columnar_engine import ColumnarReconciliationEngine
+from tests.factories import make_registers
+
+
+def _invoice(id: str, invoice_no: str = "INV-1", taxable: float = 1000.0, row_number: int = 2) -> dict:
+    return {
+        "id": id, "vendor_gstin": "27ABCDE1234F1Z5", "invoice_no": invoice_no, "invoice_date": "2024-07-01",
+        "taxable_value": taxable, "igst": 180.0, "cgst": 0.0, "sgst": 0.0, "cess": 0.0, "total_tax": 180.0,
+        "row_number": row_number,
+    }
+
+
+def _by_status(results):
+    by_status = {}
+    for r in results:
+        by_status.setdefault(r.status, []).append(r)
+    return by_status
+
+
+def test_repeated_row_is_reported_once_as_duplicate():
+    pr = [_invoice("pr_0", row_number=2), _invoice("pr_1", row_number=3)]
+    gstr2b = [_invoice("gstr2b_0")]
+    context = ReconciliationContext()
+    by_status = _by_status(ReconciliationEngine().reconcile(pr, gstr2b, context))
+
+    [exact] = by_status[MatchStatus.EXACT_MATCH]
+    assert (exact.pr_invoice_id, exact.gstr2b_invoice_id) == ("pr_0", "gstr2b_0")
+    [duplicate] = by_status[MatchStatus.DUPLICATE]
+    assert (duplicate.pr_invoice_id, duplicate.gstr2b_invoice_id) == ("pr_1", None)
+    assert duplicate.duplicate_of == "pr_0"
+    assert duplicate.match_rule.endswith("Purchase Register row 2")
+    assert MatchStatus.PR_ONLY not in by_status
+    assert context.totals.status_counts[MatchStatus.DUPLICATE.value] == 1
+
+
+def test_rows_without_invoice_number_or_with_other_amounts_are_not_duplicates():
+    pr = [_invoice("pr_0", invoice_no=""), _invoice("pr_1", invoice_no=""), _invoice("pr_2", taxable=1001.0)]
+    gstr2b = [_invoice("gstr2b_0", taxable=5.0, invoice_no="OTHER")]
+    by_status = _by_status(ReconciliationEngine().reconcile(pr, gstr2b))
+    assert MatchStatus.DUPLICATE not in by_status
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_columnar_engine_reports_the_same_duplicates(seed):
+    pr, gstr2b = make_registers(200, 190, seed=seed)
+    # Repeat a slice of each register further down the file
+    pr += [dict(inv, id=f"pr_dup_{i}", row_number=1000 + i) for i, inv in enumerate(pr[:30])]
+    gstr2b += [dict(inv, id=f"gstr2b_dup_{i}", row_number=1000 + i) for i, inv in enumerate(gstr2b[:30])]
+    expected = ReconciliationEngine().reconcile(pr, gstr2b)
+    assert any(r.status == MatchStatus.DUPLICATE for r in expected)
+    assert ColumnarReconciliationEngine().reconcile(pr, gstr2b) == expected
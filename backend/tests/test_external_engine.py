@@ -0,0 +1,76 @@
+"""
+ExternalReconciliationEngine (sorted runs on disk) against the in-memory row engine
+"""
+import json
+
+import pytest
+
+from api.routes.reconcile import _stream_json
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext
+from core.columnar_engine import select_engine
+from core.external_engine import ExternalReconciliationEngine, SpillSorter, IN_MEMORY_ROW_BYTES
+from tests.factories import make_registers
+
+
+class TinyBudgetEngine(ExternalReconciliationEngine):
+    """Spills every few dozen rows and reconciles a handful of partitions at a time"""
+    run_rows = 37
+    batch_rows = 50
+
+
+@pytest.fixture
+def spills(monkeypatch):
+    """Number of run files written"""
+    written = []
+    write = SpillSorter._write
+
+    def counting_write(self, rows):
+        written.append(1)
+        return write(self, rows)
+
+    monkeypatch.setattr(SpillSorter, "_write", counting_write)
+    return written
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_external_engine_matches_row_engine_when_spilling(seed, spills, tmp_path):
+    pr, gstr2b = make_registers(300 + 50 * seed, 280 + 50 * seed, seed=seed, n_vendors=8)
+    expected_context, context = ReconciliationContext(), ReconciliationContext()
+    expected = ReconciliationEngine().reconcile(pr, gstr2b, expected_context)
+
+    # Generators, as with paged database reads
+    results = list(TinyBudgetEngine(1, str(tmp_path)).reconcile_iter(iter(pr), iter(gstr2b), context))
+    assert results == expected
+    assert len(spills) > 10
+    assert context.totals.status_counts == expected_context.totals.status_counts
+    assert context.totals.itc_claimable == expected_context.totals.itc_claimable
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_external_engine_in_memory_budget():
+    pr, gstr2b = make_registers(400, 380, seed=5)
+    assert ExternalReconciliationEngine(64).reconcile(pr, gstr2b) == ReconciliationEngine().reconcile(pr, gstr2b)
+
+
+def test_spill_sorter_merges_runs(tmp_path):
+    sorter = SpillSorter(7, str(tmp_path))
+    rows = [((i * 7919) % 1000, i) for i in range(1000)]
+    for row in rows:
+        sorter.add(row)
+    assert list(sorter) == sorted(rows)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_select_engine_out_of_core_over_budget():
+    rows = 1024 * 1024 // IN_MEMORY_ROW_BYTES
+    assert type(select_engine(rows, 1, memory_budget_mb=1)) is ExternalReconciliationEngine
+    assert type(select_engine(rows - 1, 1, memory_budget_mb=1)) is not ExternalReconciliationEngine
+    assert type(select_engine(rows, 1)) is not ExternalReconciliationEngine
+
+
+def test_streamed_response_is_the_same_json():
+    head = {"success": True, "stats": {"total_records": 2}}
+    items = [{"id": "a", "total_diff": 0.1}, {"id": "b", "pr_invoice": None}]
+    body = b"".join(_stream_json(head, "results", iter(items)))
+    assert json.loads(body) == dict(head, results=items)
+    assert json.loads(b"".join(_stream_json(head, "results", iter([])))) == dict(head, results=[])
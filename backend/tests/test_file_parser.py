@@ -0,0 +1,38 @@
+"""
+FileParser amounts: parsed straight to paise, totals summed in paise
+"""
+import pytest
+
+from core.file_parser import FileParser
+from core.invoice_record import to_paise
+
+GSTIN = "27ABCDE1234F1Z5"
+
+
+@pytest.mark.parametrize("value, paise", [
+    ("0.1", 10), ("1.005", 101), ("₹1,234.565", 123457), ("-2.5", -250), (0.1, 10), (1.005, 101), (12, 1200),
+    ("", 0), ("abc", 0), ("nan", 0), ("Infinity", 0), (None, 0), (float("nan"), 0),
+])
+def test_parse_paise(value, paise):
+    assert FileParser()._parse_paise(value) == paise
+
+
+def _csv(*rows):
+    header = "Invoice No,GSTIN,Invoice Date,Taxable Value,IGST,CGST,SGST,Cess"
+    return "\n".join((header,) + rows).encode()
+
+
+@pytest.mark.parametrize("cgst, sgst", [("0.1", "0.2"), ('"₹0.1"', '"₹0.2"')])
+def test_purchase_register_totals_are_exact(cgst, sgst):
+    content = _csv(f"INV-1,{GSTIN},2024-07-01,0.7,0,{cgst},{sgst},0")
+    [invoice], _ = FileParser().parse_purchase_register(content, "pr.csv")
+    assert invoice["total_tax"] == 0.3
+    assert invoice["invoice_value"] == 1.0
+    assert to_paise(invoice["total_tax"]) == 30
+
+
+def test_gstr2b_totals_are_exact():
+    content = _csv(*(f"INV-{i},{GSTIN},2024-07-01,0.1,0.1,0.1,0.1,0.1" for i in range(3)))
+    invoices, _ = FileParser().parse_gstr2b(content, "gstr2b.csv")
+    assert [inv["total_tax"] for inv in invoices] == [0.4] * 3
+    assert [inv["invoice_value"] for inv in invoices] == [0.5] * 3
@@ -0,0 +1,69 @@
+"""
+Fuzzy invoice-number similarity and the FuzzyKeyIndex that finds it without pairwise comparison
+"""
+import random
+
+import pytest
+
+from core.fuzzy_index import FuzzyKeyIndex, invoice_keys_similar
+from core.invoice_record import normalize_invoices
+from core.reconciliation_engine import ReconciliationEngine, MatchStatus
+
+
+@pytest.mark.parametrize("a, b, similar", [
+    ("INV2024001", "001", True),  # Serial without its series prefix
+    ("INV001", "IN001", True),  # One deletion, same digits
+    ("INV001", "NIV001", True),  # Adjacent swap
+    ("INV001", "INV002", False),  # Digits differ
+    ("AB12", "AB13", False),
+    ("01", "A01", False),  # Tail too short
+    ("ABC", "XABC", False),  # Tail without digits
+    ("INV001", "INV001", False),  # Equal keys are not fuzzy
+    ("", "001", False),
+])
+def test_invoice_keys_similar(a, b, similar):
+    assert invoice_keys_similar(a, b) is similar
+    assert invoice_keys_similar(b, a) is similar
+
+
+def _invoice(id, invoice_no, gstin="27ABCDE1234F1Z5", invoice_date="2024-07-01"):
+    return {
+        "id": id, "vendor_gstin": gstin, "invoice_no": invoice_no, "invoice_date": invoice_date,
+        "taxable_value": 1000.0, "igst": 180.0, "cgst": 0.0, "sgst": 0.0, "cess": 0.0, "total_tax": 180.0,
+    }
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_index_candidates_equal_pairwise_scan(seed):
+    rnd = random.Random(seed)
+    gstins = ["27ABCDE1234F1Z5", "29ABCDE1234F1Z5"]
+
+    def key():
+        return rnd.choice(["INV", "IN", "NIV", "", "2024"]) + str(rnd.randint(1, 60)).zfill(rnd.choice([1, 3, 4]))
+
+    records = normalize_invoices([_invoice(f"g{i}", key(), rnd.choice(gstins)) for i in range(120)])
+    probes = normalize_invoices([_invoice(f"p{i}", key(), rnd.choice(gstins)) for i in range(120)])
+    claimed = [rnd.random() < 0.2 for _ in records]
+    index = FuzzyKeyIndex(records, range(len(records)))
+
+    for probe in probes:
+        expected = [
+            pos for pos, rec in enumerate(records)
+            if rec.gstin == probe.gstin and not claimed[pos] and invoice_keys_similar(probe.key, rec.key)
+        ]
+        assert index.candidates(probe, claimed) == expected
+
+
+def test_engine_pairs_similar_invoice_numbers_within_a_gstin():
+    pr = [_invoice("pr_0", "INV/001234"), _invoice("pr_1", "INV-777")]
+    gstr2b = [
+        _invoice("gstr2b_0", "001234", invoice_date="2024-12-01"),
+        _invoice("gstr2b_1", "INV-778", invoice_date="2024-12-01"),
+    ]
+    results = {r.pr_invoice_id: r for r in ReconciliationEngine().reconcile(pr, gstr2b) if r.pr_invoice_id}
+    assert results["pr_0"].status == MatchStatus.INVOICE_MISMATCH
+    assert results["pr_0"].gstr2b_invoice_id == "gstr2b_0"
+    assert results["pr_0"].confidence_score == 65.0
+    # Not similar enough for the fuzzy tier; only the amount-only tier can claim it
+    assert results["pr_1"].gstr2b_invoice_id == "gstr2b_1"
+    assert results["pr_1"].confidence_score == 50.0
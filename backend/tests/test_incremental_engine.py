@@ -0,0 +1,143 @@
+"""
+IncrementalReconciliation: revised registers against a full ReconciliationEngine run
+"""
+import gzip
+import json
+import random
+import uuid
+
+import pytest
+
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext
+from core.incremental_engine import IncrementalReconciliation, result_key
+from tests.factories import make_registers
+
+
+def _revised(invoices, seed):
+    """Some amounts changed, a slice removed and a few rows appended (same ids otherwise)"""
+    rnd = random.Random(seed)
+    revised = [dict(inv) for inv in invoices]
+    for inv in rnd.sample(revised, 20):
+        inv["taxable_value"] = round(inv["taxable_value"] * 1.3, 2)
+    del revised[10:30]
+    revised += [dict(inv, id=f"new_{i}") for i, inv in enumerate(rnd.sample(invoices, 5))]
+    for row_number, inv in enumerate(revised, start=2):
+        inv["row_number"] = row_number
+    return revised
+
+
+def _run(pr, gstr2b):
+    context = ReconciliationContext()
+    return ReconciliationEngine().reconcile(pr, gstr2b, context), context
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_update_matches_full_run(seed):
+    pr, gstr2b = make_registers(400, 380, seed=seed, n_vendors=6)
+    incremental = IncrementalReconciliation()
+    assert incremental.reconcile(pr, gstr2b) == _run(pr, gstr2b)[0]
+
+    pr2, gstr2b2 = _revised(pr, seed), _revised(gstr2b, seed + 100)
+    context = ReconciliationContext()
+    incremental.update(pr2, None, context)
+    incremental.update(None, gstr2b2, context)
+
+    expected, expected_context = _run(pr2, gstr2b2)
+    assert incremental.results() == expected
+    assert context.totals == expected_context.totals
+
+
+def test_delta_turns_stored_results_into_new_results():
+    pr, gstr2b = make_registers(400, 380, seed=7, n_vendors=6)
+    incremental = IncrementalReconciliation()
+    stored = {result_key(r): r for r in incremental.reconcile(pr, gstr2b)}
+
+    pr2 = _revised(pr, 7)
+    delta = incremental.update(pr2, None)
+    assert 0 < delta.partitions
+    # Changed rows are replaced: their old version is removed and the new one added
+    kept = {inv["id"]: inv["taxable_value"] for inv in pr2}
+    replaced = {inv["id"] for inv in pr if kept.get(inv["id"], inv["taxable_value"]) != inv["taxable_value"]}
+    assert set(delta.removed_invoice_ids) == {inv["id"] for inv in pr if inv["id"] not in kept} | replaced
+    assert {inv["id"] for inv in delta.added_invoices} == {f"new_{i}" for i in range(5)} | replaced
+
+    for key in delta.deleted + [result_key(r) for r in delta.upserted]:
+        stored.pop(key, None)
+    stored.update((result_key(r), r) for r in delta.upserted)
+    assert sorted(stored.values(), key=repr) == sorted(incremental.results(), key=repr)
+
+
+def test_fresh_ids_keep_stored_identity():
+    pr, gstr2b = make_registers(200, 180, seed=2)
+    incremental = IncrementalReconciliation()
+    incremental.reconcile(pr, gstr2b)
+
+    # The same file uploaded again, under new ids
+    delta = incremental.update([dict(inv, id=str(uuid.uuid4())) for inv in pr], None)
+    assert delta.empty
+    assert delta.partitions == 0
+
+    # One changed amount: only that row is new
+    revised = [dict(inv, id=str(uuid.uuid4())) for inv in pr]
+    revised[5]["taxable_value"] += 1000
+    delta = incremental.update(revised, None)
+    assert [inv["id"] for inv in delta.added_invoices] == [revised[5]["id"]]
+    assert delta.removed_invoice_ids == [pr[5]["id"]]
+
+
+def test_moved_rows_take_their_new_row_number():
+    pr, gstr2b = make_registers(200, 180, seed=4)
+    pr.append(dict(pr[3], id="pr_repeat", row_number=len(pr) + 2))  # DUPLICATE of pr_3 ("row 5")
+    incremental = IncrementalReconciliation()
+    incremental.reconcile(pr, gstr2b)
+
+    # A new first row pushes every other row down by one
+    pr2 = [dict(pr[0], id="pr_top", invoice_no="TOP-1")] + [dict(inv) for inv in pr]
+    for row_number, inv in enumerate(pr2, start=2):
+        inv["row_number"] = row_number
+    delta = incremental.update(pr2, None)
+
+    assert {inv["id"] for inv in delta.moved_invoices} == {inv["id"] for inv in pr}
+    assert incremental.results() == _run(pr2, gstr2b)[0]
+    [duplicate] = [r for r in incremental.results() if r.pr_invoice_id == "pr_repeat"]
+    assert duplicate.match_rule.endswith("row 6")
+
+
+def test_state_round_trip(tmp_path):
+    pr, gstr2b = make_registers(400, 380, seed=5, n_vendors=6)
+    incremental = IncrementalReconciliation()
+    incremental.reconcile(pr, gstr2b)
+    path = str(tmp_path / "run.json.gz")
+    incremental.save(path)
+
+    # Plain JSON, nothing to execute on load
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert json.load(f)["version"]
+
+    loaded = IncrementalReconciliation.load(path)
+    assert loaded.results() == incremental.results()
+    context, loaded_context = ReconciliationContext(), ReconciliationContext()
+    incremental.fill_context(context)
+    loaded.fill_context(loaded_context)
+    assert loaded_context.totals == context.totals
+    assert loaded_context.vendors == context.vendors
+
+    pr2 = _revised(pr, 5)
+    assert loaded.update(pr2, None) == incremental.update(pr2, None)
+    assert loaded.results() == incremental.results()
+
+
+def test_load_rejects_another_format_version(tmp_path):
+    pr, gstr2b = make_registers(50, 40, seed=1)
+    incremental = IncrementalReconciliation()
+    incremental.reconcile(pr, gstr2b)
+    path = str(tmp_path / "run.json.gz")
+    incremental.save(path)
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        state = json.load(f)
+    state["version"] += 1
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(state, f)
+    with pytest.raises(ValueError):
+        IncrementalReconciliation.load(path)
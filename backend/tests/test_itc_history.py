@@ -0,0 +1,98 @@
+"""
+ITC claim history: segment index, cross-process appends and repeat-claim detection
+"""
+from multiprocessing import get_context
+
+import numpy as np
+import pytest
+
+import core.itc_history as itc_history
+from core.itc_history import ItcHistoryIndex, find_repeat_claims, period_number, period_label
+from core.invoice_record import RecordBuilder
+from tests.factories import make_registers
+
+WORKERS = 4
+APPENDS_PER_WORKER = 20
+
+
+def _worker_hashes(worker, append):
+    return np.random.default_rng(worker * 1000 + append).integers(1, 2 ** 40, 150, dtype=np.uint64)
+
+
+def _append_claims(args):
+    """Worker process: append claims to a shared history directory"""
+    directory, worker = args
+    index = ItcHistoryIndex(directory)
+    for append in range(APPENDS_PER_WORKER):
+        index.record(_worker_hashes(worker, append), 202401 + append % 12)
+    return worker
+
+
+@pytest.mark.parametrize("text, number", [
+    ("07-2024", 202407), ("2024-07", 202407), ("7-2024", 202407), (" 2024-7 ", 202407), ("", 0), (None, 0), ("Q1", 0),
+])
+def test_period_number(text, number):
+    assert period_number(text) == number
+
+
+def test_period_label():
+    assert period_label(202407) == "07-2024"
+
+
+def test_record_and_lookup_keep_first_period(tmp_path):
+    index = ItcHistoryIndex(str(tmp_path / "client"))
+    assert index.lookup(np.array([1, 2], dtype=np.uint64)).tolist() == [0, 0]  # No directory yet
+
+    assert index.record(np.array([5, 3, 3], dtype=np.uint64), 202404) == 2
+    assert index.record(np.array([3, 9], dtype=np.uint64), 202405) == 1
+    assert index.lookup(np.array([3, 9, 5, 4], dtype=np.uint64)).tolist() == [202404, 202405, 202404, 0]
+    assert len(index) == 3
+
+
+def test_segments_stay_logarithmic(tmp_path):
+    index = ItcHistoryIndex(str(tmp_path))
+    rng = np.random.default_rng(0)
+    for append in range(64):
+        index.record(rng.integers(1, 2 ** 60, 100, dtype=np.uint64), 202401)
+    assert len(index._sequences()) <= 8
+    assert len(index) == 6400
+
+
+def test_appends_from_processes_are_not_lost(tmp_path):
+    directory = str(tmp_path / "client")
+    with get_context("spawn").Pool(WORKERS) as pool:
+        assert sorted(pool.map(_append_claims, [(directory, w) for w in range(WORKERS)])) == list(range(WORKERS))
+
+    expected = np.unique(np.concatenate([
+        _worker_hashes(w, a) for w in range(WORKERS) for a in range(APPENDS_PER_WORKER)
+    ]))
+    index = ItcHistoryIndex(directory)
+    assert len(index) == len(expected)
+    assert (index.lookup(expected) > 0).all()
+
+
+def test_find_repeat_claims_across_periods(tmp_path, monkeypatch):
+    monkeypatch.setattr(itc_history, "CLAIM_CHUNK_SIZE", 7)  # Several chunks per register
+    pr, _ = make_registers(60, 0, seed=3)
+    records = RecordBuilder().build_all(pr)
+    keyed = [rec for rec in records if rec.key]
+    index = ItcHistoryIndex(str(tmp_path))
+
+    assert find_repeat_claims(index, iter(records), "04-2024") == []
+    # Re-checking the same period reports nothing
+    assert find_repeat_claims(index, iter(records), "04-2024") == []
+
+    # May's register repeats two of April's invoices, plus one new invoice
+    builder = RecordBuilder()
+    may = [dict(pr[i], id=f"may_{i}") for i in (0, 1)] + [dict(pr[2], id="may_new", taxable_value=123456.0)]
+    repeats = find_repeat_claims(index, (builder.build(inv) for inv in may), "2024-05")
+    assert {r["pr_invoice_id"] for r in repeats} == {f"may_{i}" for i in (0, 1) if pr[i]["invoice_no"]}
+    assert all(r["first_claimed_period"] == "04-2024" for r in repeats)
+    assert len(index) == len({(rec.gstin, rec.key, rec.taxable) for rec in keyed}) + 1
+
+
+def test_unknown_period_is_not_checked(tmp_path):
+    pr, _ = make_registers(10, 0, seed=1)
+    index = ItcHistoryIndex(str(tmp_path / "client"))
+    assert find_repeat_claims(index, RecordBuilder().build_all(pr), "") == []
+    assert len(index) == 0
@@ -0,0 +1,38 @@
+"""
+Tests for services.matching_engine fuzzy matching
+"""
+from services.matching_engine import MatchingEngine
+
+
+def _invoice(id: str, invoice_no: str, taxable: float, gstin: str = "27ABCDE1234F1Z5") -> dict:
+    return {"id": id, "vendor_gstin": gstin, "invoice_no": invoice_no, "taxable_value": taxable}
+
+
+def _pairs(results):
+    return {(r["pr_invoice_id"], r["gstr2b_invoice_id"], r["match_rule_applied"]) for r in results}
+
+
+def test_fuzzy_pairs_same_gstin_within_ten_percent():
+    results = MatchingEngine().match_invoices(
+        [_invoice("pr_0", "A1", 100)],
+        [_invoice("gstr2b_0", "B2", 101)]
+    )
+    assert _pairs(results) == {("pr_0", "gstr2b_0", "fuzzy_match")}
+
+
+def test_fuzzy_skips_other_gstin_and_wide_amounts():
+    results = MatchingEngine().match_invoices(
+        [_invoice("pr_0", "A1", 100), _invoice("pr_1", "A2", 100)],
+        [_invoice("gstr2b_0", "B1", 100, gstin="29ABCDE1234F1Z5"), _invoice("gstr2b_1", "B2", 150)]
+    )
+    assert all(r["match_rule_applied"] == "unmatched" for r in results)
+
+
+def test_fuzzy_does_not_reuse_claimed_gstr2b_row():
+    results = MatchingEngine().match_invoices(
+        [_invoice("pr_0", "A1", 100), _invoice("pr_1", "A2", 100)],
+        [_invoice("gstr2b_0", "B1", 100)]
+    )
+    fuzzy = [r for r in results if r["match_rule_applied"] == "fuzzy_match"]
+    assert [(r["pr_invoice_id"], r["gstr2b_invoice_id"]) for r in fuzzy] == [("pr_0", "gstr2b_0")]
+    assert ("pr_1", None, "unmatched") in _pairs(results)
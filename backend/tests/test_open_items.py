@@ -0,0 +1,90 @@
+"""
+Open items carried forward across return periods
+"""
+from core.reconciliation_engine import ReconciliationEngine, MatchStatus
+from core.invoice_record import RecordBuilder
+from core.open_items import (
+    OpenItem, OpenItemsIndex, PR_SOURCE, GSTR2B_SOURCE, carry_forward, probe_keys, match_key
+)
+
+GSTIN = "27ABCDE1234F1Z5"
+
+
+def _invoice(id, invoice_no, taxable=1000.0, invoice_date="2024-06-10", gstin=GSTIN):
+    return {
+        "id": id, "vendor_gstin": gstin, "invoice_no": invoice_no, "invoice_date": invoice_date,
+        "taxable_value": taxable, "igst": round(taxable * 0.18, 2), "cgst": 0.0, "sgst": 0.0, "cess": 0.0,
+        "total_tax": round(taxable * 0.18, 2),
+    }
+
+
+def _period(pr, gstr2b):
+    """Single-sided results and records of one period"""
+    engine = ReconciliationEngine()
+    results = [r for r in engine.reconcile(pr, gstr2b) if r.status in (MatchStatus.PR_ONLY, MatchStatus.GSTR2B_ONLY)]
+    builder = RecordBuilder()
+    return results, {inv["id"]: builder.build(inv) for inv in pr + gstr2b}
+
+
+def _stored(items):
+    """Items as they come back from the open_items table"""
+    return [OpenItem.from_row(dict(item.as_row("client-1"), id=f"item_{i}")) for i, item in enumerate(items)]
+
+
+def test_carry_forward_closes_items_of_earlier_periods():
+    engine = ReconciliationEngine()
+    # June: booked in the PR, not yet in GSTR-2B; and a GSTR-2B invoice missing from the PR
+    results, records = _period([_invoice("pr_0", "INV-1")], [_invoice("g_0", "INV-9", 500.0)])
+    closed, opened = carry_forward(engine, OpenItemsIndex(), results, records, "2024-06")
+    assert closed == []
+    assert {(item.source, item.invoice_id) for item in opened} == {(PR_SOURCE, "pr_0"), (GSTR2B_SOURCE, "g_0")}
+
+    # July: the supplier files INV-1 late (amounts within tolerance, another date)
+    results, records = _period([], [_invoice("g_1", "inv 1", 1000.5, invoice_date="2024-07-02")])
+    assert probe_keys(results, records) == [match_key(GSTIN, "INV1")]
+    index = OpenItemsIndex(_stored(opened))
+    closed, opened_july = carry_forward(engine, index, results, records, "2024-07")
+
+    [item] = closed
+    assert (item.item.invoice_id, item.invoice_id) == ("pr_0", "g_1")
+    assert item.as_dict()["opened_period"] == "2024-06"
+    assert item.as_dict()["closed_period"] == "2024-07"
+    assert opened_july == []
+
+
+def test_carry_forward_opens_items_whose_amounts_differ():
+    engine = ReconciliationEngine()
+    results, records = _period([_invoice("pr_0", "INV-1")], [])
+    _, opened = carry_forward(engine, OpenItemsIndex(), results, records, "2024-06")
+
+    results, records = _period([], [_invoice("g_1", "INV-1", 1500.0)])
+    closed, opened = carry_forward(engine, OpenItemsIndex(_stored(opened)), results, records, "2024-07")
+    assert closed == []
+    assert [(item.source, item.return_period) for item in opened] == [(GSTR2B_SOURCE, "2024-07")]
+
+
+def test_index_take_pops_oldest_matching_item_of_the_side():
+    engine = ReconciliationEngine()
+    builder = RecordBuilder()
+    items = [
+        OpenItem.from_record(builder.build(_invoice(f"pr_{i}", "INV-1", taxable)), PR_SOURCE, period)
+        for i, (taxable, period) in enumerate([(2000.0, "2024-04"), (1000.0, "2024-05"), (1000.0, "2024-06")])
+    ]
+    index = OpenItemsIndex(items)
+    rec = builder.build(_invoice("g_0", "INV-1"))
+    key = match_key(rec.gstin, rec.key)
+
+    assert index.take(GSTR2B_SOURCE, key, rec, engine) is None  # Only PR items under this key
+    assert index.take(PR_SOURCE, match_key(rec.gstin, "OTHER"), rec, engine) is None
+    assert index.take(PR_SOURCE, key, rec, engine).return_period == "2024-05"
+    assert index.take(PR_SOURCE, key, rec, engine).return_period == "2024-06"
+    assert index.take(PR_SOURCE, key, rec, engine) is None
+    assert [item.return_period for item in index.items[(PR_SOURCE, key)]] == ["2024-04"]
+
+
+def test_stored_row_round_trip():
+    rec = RecordBuilder().build(_invoice("pr_0", "INV/7", 100.10))
+    item = OpenItem.from_record(rec, PR_SOURCE, "2024-06")
+    restored = OpenItem.from_row(item.as_row("client-1"))
+    assert restored == item
+    assert restored.record().total == rec.total
@@ -0,0 +1,32 @@
+"""
+ParallelReconciliationEngine (vendor shards in worker processes) against the row engine
+"""
+import pytest
+
+from core.reconciliation_engine import ReconciliationEngine
+from core.parallel_engine import ParallelReconciliationEngine, warm_process_pool, shutdown_process_pool
+from tests.factories import make_registers
+
+WORKERS = 3
+
+
+@pytest.fixture(scope="module", autouse=True)
+def process_pool():
+    yield
+    shutdown_process_pool()
+
+
+def test_warm_pool_starts_every_worker():
+    assert warm_process_pool(WORKERS) == WORKERS
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_parallel_engine_matches_row_engine(seed):
+    pr, gstr2b = make_registers(300 + 100 * seed, 280 + 100 * seed, seed=seed, n_vendors=12)
+    expected = ReconciliationEngine().reconcile(pr, gstr2b)
+    assert ParallelReconciliationEngine(WORKERS).reconcile(pr, gstr2b) == expected
+
+
+def test_parallel_engine_single_vendor_runs_in_process():
+    pr, gstr2b = make_registers(200, 180, seed=9, n_vendors=1)
+    assert ParallelReconciliationEngine(WORKERS).reconcile(pr, gstr2b) == ReconciliationEngine().reconcile(pr, gstr2b)
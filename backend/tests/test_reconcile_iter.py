@@ -0,0 +1,53 @@
+"""
+reconcile_iter streams the results reconcile returns, phase by phase
+"""
+import inspect
+
+import pytest
+
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext, MatchStatus
+from core.columnar_engine import ColumnarReconciliationEngine
+from core.parallel_engine import ParallelReconciliationEngine, shutdown_process_pool
+from tests.factories import make_registers
+
+ENGINES = {
+    "row": ReconciliationEngine,
+    "columnar": ColumnarReconciliationEngine,
+    "parallel": lambda: ParallelReconciliationEngine(2),
+}
+
+# Results without a partner in the other register, yielded after every pair
+UNPAIRED = (MatchStatus.PR_ONLY, MatchStatus.GSTR2B_ONLY, MatchStatus.DUPLICATE)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def process_pool():
+    yield
+    shutdown_process_pool()
+
+
+@pytest.mark.parametrize("name", sorted(ENGINES))
+def test_reconcile_iter_matches_reconcile(name):
+    pr, gstr2b = make_registers(400, 380, seed=4, n_vendors=8)
+    engine = ENGINES[name]()
+    expected_context = ReconciliationContext()
+    expected = engine.reconcile(pr, gstr2b, expected_context)
+
+    context = ReconciliationContext()
+    stream = engine.reconcile_iter(pr, gstr2b, context)
+    assert inspect.isgenerator(stream)
+    assert list(stream) == expected
+    assert context.totals == expected_context.totals
+    row_context = ReconciliationContext()
+    ReconciliationEngine().reconcile(pr, gstr2b, row_context)
+    assert context.totals == row_context.totals
+    assert context.matched_pr_ids == expected_context.matched_pr_ids
+    assert context.matched_gstr2b_ids == expected_context.matched_gstr2b_ids
+
+
+def test_reconcile_iter_yields_pairs_before_unpaired():
+    pr, gstr2b = make_registers(300, 280, seed=2)
+    statuses = [r.status for r in ReconciliationEngine().reconcile_iter(pr, gstr2b)]
+    first_unpaired = next(i for i, status in enumerate(statuses) if status in UNPAIRED)
+    assert first_unpaired > 0
+    assert all(status in UNPAIRED for status in statuses[first_unpaired:])
@@ -0,0 +1,97 @@
+"""
+Client rule profiles compiled into engine classes
+"""
+import pickle
+
+import pytest
+
+from core.columnar_engine import ColumnarReconciliationEngine
+from core.parallel_engine import ParallelReconciliationEngine, shutdown_process_pool
+from core.reconciliation_engine import ReconciliationEngine, MatchStatus
+from core.rule_profile import RuleProfile, profile_engine, client_rule_profile
+from tests.factories import make_registers
+
+WORKERS = 3
+GSTIN = "27ABCDE1234F1Z5"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def process_pool():
+    yield
+    shutdown_process_pool()
+
+
+def _invoice(id, invoice_no, taxable, igst=0.0, invoice_date="2024-07-01"):
+    return {
+        "id": id, "vendor_gstin": GSTIN, "invoice_no": invoice_no, "invoice_date": invoice_date,
+        "taxable_value": taxable, "igst": igst, "cgst": 0.0, "sgst": 0.0, "cess": 0.0, "total_tax": igst,
+    }
+
+
+# Reissued invoice: only the GSTIN and the total agree, so only the amount-only rule pairs it
+REISSUED = (
+    [_invoice("pr_0", "A-100", 1000.0, igst=180.0)],
+    [_invoice("gstr2b_0", "REISSUE-9", 1000.5, igst=179.5, invoice_date="2024-11-20")],
+)
+
+
+@pytest.mark.parametrize("base", [ReconciliationEngine, ColumnarReconciliationEngine])
+@pytest.mark.parametrize("profile", [RuleProfile(), RuleProfile.from_dict({})])
+def test_empty_profile_reconciles_like_plain_engine(base, profile):
+    pr, gstr2b = make_registers(300, 280, seed=3, n_vendors=6)
+    engine = profile_engine(profile, base)
+    assert type(engine) is not base and isinstance(engine, base)
+    assert engine.reconcile(pr, gstr2b) == base().reconcile(pr, gstr2b)
+
+
+def test_disabled_rule_leaves_invoices_unpaired():
+    pr, gstr2b = REISSUED
+    assert ReconciliationEngine().reconcile(pr, gstr2b)[0].status == MatchStatus.INVOICE_MISMATCH
+
+    rules = [name for name in RuleProfile().rules if name != "amount_only"]
+    engine = profile_engine(RuleProfile.from_dict({"rules": rules}))
+    assert {r.status for r in engine.reconcile(pr, gstr2b)} == {MatchStatus.PR_ONLY, MatchStatus.GSTR2B_ONLY}
+
+
+def test_confidence_override_is_applied():
+    pr, gstr2b = REISSUED
+    engine = profile_engine(RuleProfile.from_dict({"confidence": {"amount_only": 42}}))
+    [result] = engine.reconcile(pr, gstr2b)
+    assert result.status == MatchStatus.INVOICE_MISMATCH
+    assert result.confidence_score == 42.0
+
+
+def test_amount_tolerance_is_applied():
+    pr = [_invoice("pr_0", "A-100", 1000.0)]
+    gstr2b = [_invoice("gstr2b_0", "A-100", 1001.5)]
+    assert ReconciliationEngine().reconcile(pr, gstr2b)[0].status == MatchStatus.AMOUNT_MISMATCH
+    engine = profile_engine(RuleProfile.from_dict({"amount_tolerance": 2}))
+    assert engine.reconcile(pr, gstr2b)[0].status == MatchStatus.EXACT_MATCH
+
+
+def test_invalid_stored_profile_falls_back_to_plain_engine():
+    assert client_rule_profile({"id": "c1", "rule_profile": {"rules": ["no_such_rule"]}}) is None
+    assert client_rule_profile({"id": "c1", "rule_profile": None}) is None
+
+
+PROFILE = RuleProfile.from_dict({
+    "date_tolerance_days": 10,
+    "rules": ["exact", "date_mismatch", "amount_mismatch", "gstin_mismatch", "invoice_mismatch"],
+    "confidence": {"exact": 97.5, "gstin_mismatch": 55},
+})
+
+
+def test_compiled_engine_pickles():
+    engine = profile_engine(PROFILE)
+    restored = pickle.loads(pickle.dumps(engine))
+    assert type(restored) is type(engine)
+    pr, gstr2b = make_registers(200, 180, seed=1)
+    assert restored.reconcile(pr, gstr2b) == engine.reconcile(pr, gstr2b)
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_compiled_parallel_engine_matches_compiled_row_engine(seed):
+    pr, gstr2b = make_registers(400, 380, seed=seed, n_vendors=12)
+    expected = profile_engine(PROFILE).reconcile(pr, gstr2b)
+    assert profile_engine(PROFILE, ParallelReconciliationEngine, WORKERS).reconcile(pr, gstr2b) == expected
+    assert any(r.confidence_score == 97.5 for r in expected)
@@ -0,0 +1,91 @@
+"""
+SplitMatcher: meet-in-the-middle groups, the tolerance boundary and the candidate cap
+"""
+import random
+from itertools import combinations
+
+import pytest
+
+from core.invoice_record import RecordBuilder
+from core.reconciliation_engine import ReconciliationEngine
+from core.split_matcher import SplitMatcher, combined_record
+
+GSTIN = "27ABCDE1234F1Z5"
+
+
+def _invoice(id, taxable, igst=0.0, gstin=GSTIN):
+    return {
+        "id": id, "vendor_gstin": gstin, "invoice_no": id, "invoice_date": "2024-07-01",
+        "taxable_value": taxable, "igst": igst, "cgst": 0.0, "sgst": 0.0, "cess": 0.0, "total_tax": igst,
+    }
+
+
+def _records(invoices):
+    return RecordBuilder().build_all(invoices)
+
+
+def _split_ids(single, parts, **caps):
+    groups = SplitMatcher(ReconciliationEngine(), **caps).match(_records([single]), _records(parts))
+    return [[p.id for p in g.parts] for g in groups]
+
+
+def _brute_force(engine, single, parts, max_group):
+    """Best group by (size, total difference, file positions) over every combination"""
+    best = None
+    eligible = [i for i, p in enumerate(parts) if 0 < p.total < single.total + engine.AMOUNT_TOLERANCE_PAISE]
+    for size in range(2, max_group + 1):
+        for members in combinations(eligible, size):
+            combined = combined_record([parts[i] for i in members])
+            if abs(single.total - combined.total) > engine.AMOUNT_TOLERANCE_PAISE:
+                continue
+            if engine.all_amounts_match(single, combined):
+                rank = (size, abs(single.total - combined.total), members)
+                best = rank if best is None or rank < best else best
+    return None if best is None else [parts[i].id for i in best[2]]
+
+
+def test_group_spanning_both_halves_is_found():
+    # The parts sit at both ends of the candidate list, so each half holds some of them
+    parts = [_invoice("p0", 250.0)] + [_invoice(f"x{i}", 70.0 + 13 * i) for i in range(8)] + [
+        _invoice("p1", 250.0), _invoice("p2", 300.0), _invoice("p3", 200.0)
+    ]
+    assert _split_ids(_invoice("s", 1000.0), parts) == [["p0", "p1", "p2", "p3"]]
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_matches_brute_force(seed):
+    rnd = random.Random(seed)
+    engine = ReconciliationEngine()
+    amounts = [rnd.choice([100.0, 150.0, 200.0, 250.0, 333.33, 400.0]) for _ in range(rnd.randint(2, 12))]
+    parts = [_invoice(f"p{i}", a + rnd.choice([0, 0.5, -0.75, 1.5])) for i, a in enumerate(amounts)]
+    single = _invoice("s", sum(rnd.sample(amounts, min(len(amounts), rnd.randint(2, 4)))))
+    expected = _brute_force(engine, _records([single])[0], _records(parts), max_group=4)
+    assert _split_ids(single, parts) == ([expected] if expected else [])
+
+
+@pytest.mark.parametrize("last_part, pairs", [(301.0, True), (301.01, False), (299.0, True), (298.99, False)])
+def test_tolerance_boundary_is_inclusive(last_part, pairs):
+    parts = [_invoice("p0", 300.0), _invoice("p1", 300.0), _invoice("p2", last_part)]
+    assert _split_ids(_invoice("s", 900.0), parts) == ([["p0", "p1", "p2"]] if pairs else [])
+
+
+def test_part_within_tolerance_above_target_is_a_candidate():
+    # A part may exceed the single by less than the tolerance (the rest nets it off)
+    parts = [_invoice("p0", 500.5), _invoice("p1", 0.01)]
+    assert _split_ids(_invoice("s", 500.0), parts) == [["p0", "p1"]]
+
+
+def test_candidate_cap_keeps_largest_totals():
+    # Larger parts that cannot form a group crowd the two halves out of a 3-wide window
+    parts = [_invoice("p0", 500.0), _invoice("p1", 500.0)] + [_invoice(f"x{i}", 900.0 + 10 * i) for i in range(3)]
+    single = _invoice("s", 1000.0)
+    assert _split_ids(single, parts, max_candidates=3) == []
+    assert _split_ids(single, parts, max_candidates=5) == [["p0", "p1"]]
+
+
+def test_used_parts_leave_the_window():
+    # Two singles of the same total: the second takes the remaining parts
+    singles = _records([_invoice("s0", 1000.0), _invoice("s1", 1000.0)])
+    parts = _records([_invoice(f"p{i}", 500.0) for i in range(4)] + [_invoice("other", 500.0, gstin="29ABCDE1234F1Z5")])
+    groups = SplitMatcher(ReconciliationEngine()).match(singles, parts)
+    assert [(g.single.id, [p.id for p in g.parts]) for g in groups] == [("s0", ["p0", "p1"]), ("s1", ["p2", "p3"])]
@@ -0,0 +1,201 @@
+"""
+SqlPushdown against a full in-memory ReconciliationEngine run: SQLite always,
+Postgres when DATABASE_URL is set (inside a transaction that is rolled back)
+"""
+import os
+import re
+import sqlite3
+import sys
+
+import pytest
+
+from core.invoice_record import normalize_gstin
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext
+from core.sql_pushdown import SqlPushdown, PushdownResidue, register_sqlite_functions, connect_postgres
+from tests.factories import make_registers
+
+RUN_ID = "run-1"
+SEEDS = range(6)
+MIGRATION = os.path.join(os.path.dirname(__file__), "..", "..", "supabase", "migrations", "006_sql_pushdown.sql")
+
+# The columns of the invoices / match_results tables the rule SQL reads and writes
+_SCHEMA = (
+    """
+    CREATE {temp} TABLE invoices (
+        id TEXT PRIMARY KEY, run_id TEXT, source TEXT, invoice_no TEXT, invoice_date {date},
+        vendor_gstin TEXT, taxable_value {amount}, igst {amount}, cgst {amount}, sgst {amount},
+        cess {amount}, total_tax {amount}, row_number INTEGER
+    )
+    """,
+    """
+    CREATE {temp} TABLE match_results (
+        id {serial}, run_id TEXT, pr_invoice_id TEXT, gstr2b_invoice_id TEXT, match_status TEXT,
+        confidence_score {amount}, match_rule_applied TEXT, taxable_diff {amount}, igst_diff {amount},
+        cgst_diff {amount}, sgst_diff {amount}, total_diff {amount}
+    )
+    """,
+)
+
+_INVOICE_COLUMNS = (
+    "id", "run_id", "source", "invoice_no", "invoice_date", "vendor_gstin", "taxable_value",
+    "igst", "cgst", "sgst", "cess", "total_tax", "row_number"
+)
+
+_RESULT_COLUMNS = (
+    "pr_invoice_id, gstr2b_invoice_id, match_status, confidence_score, match_rule_applied, "
+    "taxable_diff, igst_diff, cgst_diff, sgst_diff, total_diff"
+)
+
+
+def _load(conn, pr, gstr2b, placeholder):
+    statement = (
+        f"INSERT INTO invoices ({', '.join(_INVOICE_COLUMNS)}) "
+        f"VALUES ({', '.join([placeholder] * len(_INVOICE_COLUMNS))})"
+    )
+    rows = [
+        tuple({**inv, "run_id": RUN_ID, "source": source}[c] for c in _INVOICE_COLUMNS)
+        for source, invoices in (("purchase_register", pr), ("gstr2b", gstr2b))
+        for inv in invoices
+    ]
+    # Another run's invoice, which the rule SQL must not touch
+    rows.append(("other-1", "run-2", "gstr2b", "1", None, "X", 1, 0, 0, 0, 0, 0, 2))
+    cur = conn.cursor()
+    cur.executemany(statement, rows)
+    cur.close()
+
+
+def _result_rows(conn):
+    cur = conn.cursor()
+    cur.execute(f"SELECT {_RESULT_COLUMNS} FROM match_results")
+    rows = [_normalized(row) for row in cur.fetchall()]
+    cur.close()
+    return sorted(rows, key=repr)
+
+
+def _normalized(row):
+    """Result row with numeric columns as floats (Postgres returns Decimals)"""
+    pr_id, gstr2b_id, status, confidence, rule, *diffs = row
+    return (pr_id, gstr2b_id, status, float(confidence), rule, *(float(d) for d in diffs))
+
+
+def _expected(pr, gstr2b):
+    context = ReconciliationContext()
+    results = ReconciliationEngine().reconcile(pr, gstr2b, context)
+    rows = [
+        (
+            r.pr_invoice_id, r.gstr2b_invoice_id, r.status.value, r.confidence_score, r.match_rule,
+            r.taxable_diff, r.igst_diff, r.cgst_diff, r.sgst_diff, r.total_diff
+        )
+        for r in results
+    ]
+    return sorted(rows, key=repr), context
+
+
+def _check_pushdown(conn, dialect, pr, gstr2b):
+    expected_rows, expected_context = _expected(pr, gstr2b)
+    context = ReconciliationContext()
+    residue = PushdownResidue(with_claims=True)
+
+    counts = SqlPushdown(ReconciliationEngine(), dialect).reconcile_run(conn, RUN_ID, context, residue=residue)
+
+    assert counts == (len(pr), len(gstr2b))
+    assert _result_rows(conn) == expected_rows
+    assert context.totals == expected_context.totals
+    assert [claim["id"] for claim in residue.claims] == [inv["id"] for inv in pr]
+    open_ids = {r[0] or r[1] for r in expected_rows if r[2] in ("pr_only", "gstr2b_only")}
+    assert {r.pr_invoice_id or r.gstr2b_invoice_id for r in residue.open_results} == open_ids
+    assert open_ids <= {inv["id"] for inv in residue.invoices}
+
+
+def _padded_registers(seed):
+    """Registers whose GSTINs carry leading / trailing whitespace beyond spaces and tabs"""
+    pr, gstr2b = make_registers(200, 180, seed=seed, n_vendors=4)
+    padding = ["", "\t", "\u00a0", "\u3000 ", "\n\x0b", "\u2003\r"]
+    for i, inv in enumerate(pr + gstr2b):
+        inv["vendor_gstin"] = padding[i % len(padding)] + inv["vendor_gstin"] + padding[(i // 2) % len(padding)]
+    return pr, gstr2b
+
+
+def _run_sqlite(pr, gstr2b):
+    conn = sqlite3.connect(":memory:")
+    register_sqlite_functions(conn)
+    for statement in _SCHEMA:
+        conn.execute(statement.format(temp="", date="TEXT", amount="REAL", serial="INTEGER PRIMARY KEY"))
+    _load(conn, pr, gstr2b, "?")
+    try:
+        _check_pushdown(conn, "sqlite", pr, gstr2b)
+    finally:
+        conn.close()
+
+
+def _connect_postgres():
+    """
+    Connection with the schema as temp tables (shadowing the real ones) and
+    the migration's functions; callers roll back, so nothing is committed
+    """
+    conn = connect_postgres(os.environ["DATABASE_URL"])
+    cur = conn.cursor()
+    for statement in _SCHEMA:
+        cur.execute(statement.format(temp="TEMP", date="DATE", amount="NUMERIC", serial="SERIAL PRIMARY KEY"))
+    with open(MIGRATION) as f:
+        cur.execute(f.read())
+    cur.close()
+    return conn
+
+
+def _run_postgres(pr, gstr2b):
+    conn = _connect_postgres()
+    try:
+        _load(conn, pr, gstr2b, "%s")
+        _check_pushdown(conn, "postgres", pr, gstr2b)
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+needs_postgres = pytest.mark.skipif(not os.environ.get("DATABASE_URL"), reason="DATABASE_URL not set")
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_sqlite_pushdown_matches_engine(seed):
+    _run_sqlite(*make_registers(200 + 40 * seed, 180 + 40 * seed, seed=seed, n_vendors=seed + 2))
+
+
+def test_sqlite_pushdown_padded_gstins():
+    _run_sqlite(*_padded_registers(0))
+
+
+def test_migration_norm_gstin_trims_what_strip_does():
+    # The characters norm_gstin passes to btrim, against the ones str.strip() removes
+    with open(MIGRATION) as f:
+        sql = f.read()
+    function = sql[sql.index("FUNCTION norm_gstin"):sql.index("$$ LANGUAGE", sql.index("FUNCTION norm_gstin"))]
+    [literal] = re.findall(r"E'((?:\\u[0-9A-Fa-f]{4})+)'", function)
+    trimmed = {chr(int(code, 16)) for code in re.findall(r"\\u([0-9A-Fa-f]{4})", literal)}
+    assert trimmed == {c for c in map(chr, range(sys.maxunicode + 1)) if c.isspace()}
+
+
+@needs_postgres
+@pytest.mark.parametrize("seed", SEEDS)
+def test_postgres_pushdown_matches_engine(seed):
+    _run_postgres(*make_registers(200 + 40 * seed, 180 + 40 * seed, seed=seed, n_vendors=seed + 2))
+
+
+@needs_postgres
+def test_postgres_pushdown_padded_gstins():
+    _run_postgres(*_padded_registers(0))
+
+
+@needs_postgres
+def test_postgres_norm_gstin_matches_normalize_gstin():
+    values = [None, "", " 27abcde1234f1z5 ", "\u00a027ABCDE1234F1Z5\u3000", "\x0b27 ABCDE 1234F1Z5\x1f", "\u2028\u2029"]
+    conn = _connect_postgres()
+    try:
+        cur = conn.cursor()
+        for value in values:
+            cur.execute("SELECT norm_gstin(%s)", (value,))
+            assert cur.fetchone()[0] == normalize_gstin(value)
+        cur.close()
+    finally:
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,117 @@
+"""
+ToleranceSweep at the engine's own setting reproduces the stored run, with
+the run's rows read back through the service's paging
+"""
+import pytest
+
+from api.routes.reconciliation import _tolerance_sweep
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext
+from models.schemas import ToleranceSweepRequest, ToleranceSettingRequest
+from services.supabase_service import SupabaseService
+from tests.factories import make_registers
+
+RUN_ID = "run-1"
+PAGE_SIZE = 50
+
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    """The postgrest builder calls the service makes: eq / order / range / execute"""
+
+    def __init__(self, table):
+        self.table = table
+        self.filters = []
+        self.order_by = []
+        self.window = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, value))
+        return self
+
+    def order(self, column):
+        self.order_by.append(column)
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end)
+        return self
+
+    def execute(self):
+        rows = [r for r in self.table.rows if all(r.get(c) == v for c, v in self.filters)]
+        for column in reversed(self.order_by):
+            rows.sort(key=lambda r: r[column])
+        self.table.pages += 1
+        start, end = self.window
+        return _Response(rows[start:end + 1])
+
+
+class _Table:
+    def __init__(self, rows):
+        self.rows = rows
+        self.pages = 0
+
+
+class _Client:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def table(self, name):
+        return _Query(self.tables[name])
+
+
+def _stored_run(engine, pr, gstr2b):
+    context = ReconciliationContext()
+    results = engine.reconcile(pr, gstr2b, context)
+    invoices = (
+        [dict(inv, run_id=RUN_ID, source="purchase_register") for inv in pr]
+        + [dict(inv, run_id=RUN_ID, source="gstr2b") for inv in gstr2b]
+    )
+    rows = [
+        {
+            "id": f"{i:06d}",
+            "run_id": RUN_ID,
+            "match_status": r.status.value,
+            "pr_invoice_id": r.pr_invoice_id,
+            "gstr2b_invoice_id": r.gstr2b_invoice_id,
+            "confidence_score": r.confidence_score,
+            "match_rule_applied": r.match_rule,
+        }
+        for i, r in enumerate(results)
+    ]
+    service = SupabaseService.__new__(SupabaseService)
+    service.client = _Client({"invoices": _Table(invoices), "match_results": _Table(rows)})
+    return service, context
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_sweep_at_engine_setting_reproduces_run(seed):
+    engine = ReconciliationEngine()
+    pr, gstr2b = make_registers(300, 280, seed=seed, n_vendors=6)
+    service, context = _stored_run(engine, pr, gstr2b)
+
+    result_rows = list(service.iter_match_results_for_run(RUN_ID, page_size=PAGE_SIZE))
+    pr_invoices = list(service.iter_invoices_for_run(RUN_ID, "purchase_register", page_size=PAGE_SIZE))
+    gstr2b_invoices = list(service.iter_invoices_for_run(RUN_ID, "gstr2b", page_size=PAGE_SIZE))
+    assert len(result_rows) > PAGE_SIZE
+    assert service.client.tables["match_results"].pages == len(result_rows) // PAGE_SIZE + 1
+
+    request = ToleranceSweepRequest(settings=[ToleranceSettingRequest()])
+    [summary] = _tolerance_sweep(engine, pr_invoices, gstr2b_invoices, result_rows, request)
+    expected = {status: n for status, n in context.totals.status_counts.items() if n}
+    assert summary["status_counts"] == expected
+
+
+def test_match_results_paging_filters_status():
+    engine = ReconciliationEngine()
+    pr, gstr2b = make_registers(300, 280, seed=0, n_vendors=6)
+    service, context = _stored_run(engine, pr, gstr2b)
+    rows = list(service.iter_match_results_for_run(RUN_ID, "pr_only", page_size=7))
+    assert len(rows) == context.totals.status_counts["pr_only"]
+    assert [r["id"] for r in rows] == sorted(r["id"] for r in rows)
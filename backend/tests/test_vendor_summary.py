@@ -0,0 +1,84 @@
+"""
+Vendor aggregate pre-pass and the balanced-vendor fast path
+"""
+import random
+
+import pytest
+
+from core.invoice_record import normalize_invoices
+from core.reconciliation_engine import ReconciliationEngine, ReconciliationContext
+from core.columnar_engine import ColumnarReconciliationEngine
+from core.vendor_summary import aggregate_vendors, balanced_pairs, period_of, SUMMARY_FIELDS
+from tests.factories import make_registers
+
+
+def _balanced_registers(seed):
+    """Registers where about half the vendors' GSTR-2B rows are exact shuffled copies of the PR"""
+    rnd = random.Random(seed)
+    pr, gstr2b = make_registers(300, 280, seed=seed, n_vendors=10)
+    clean = {inv["vendor_gstin"].strip() for inv in pr if rnd.random() < 0.5}
+    copies = [dict(inv, id=f"gstr2b_copy_{i}") for i, inv in enumerate(pr) if inv["vendor_gstin"].strip() in clean]
+    rnd.shuffle(copies)
+    return pr, [inv for inv in gstr2b if inv["vendor_gstin"].strip() not in clean] + copies
+
+
+def test_aggregates_match_per_period_sums():
+    pr, gstr2b = make_registers(200, 180, seed=3)
+    pr_records, gstr2b_records = normalize_invoices(pr), normalize_invoices(gstr2b)
+    vendors = aggregate_vendors(pr_records, gstr2b_records)
+
+    for records, side in ((pr_records, "pr"), (gstr2b_records, "gstr2b")):
+        assert sum(getattr(v, f"{side}_count") for v in vendors.values()) == len(records)
+        for field in SUMMARY_FIELDS:
+            assert sum(getattr(v, f"{side}_totals")[field] for v in vendors.values()) == sum(
+                getattr(rec, field) for rec in records
+            )
+    assert list(vendors) == sorted(vendors)
+
+
+def test_vendor_summary_rows_in_rupees():
+    invoice = {
+        "id": "pr_0", "vendor_gstin": "27ABCDE1234F1Z5", "invoice_no": "1", "invoice_date": "2024-07-03",
+        "taxable_value": 100.10, "igst": 18.02, "cgst": 0, "sgst": 0, "cess": 0, "total_tax": 18.02,
+    }
+    context = ReconciliationContext()
+    ReconciliationEngine().reconcile([invoice], [dict(invoice, id="gstr2b_0", taxable_value=100.0)], context)
+    [row] = context.vendor_summary()
+    assert row["period"] == "2024-07"
+    assert row["taxable_delta"] == 0.1
+    assert not row["balanced"]
+
+
+def test_leftover_invoice_disables_fast_path_for_its_period():
+    pr, _ = make_registers(50, 0, seed=4, n_vendors=1)
+    pr_records = normalize_invoices(pr)
+    gstr2b_records = normalize_invoices([dict(inv, id=f"g{i}") for i, inv in enumerate(pr)])
+    vendors = aggregate_vendors(pr_records, gstr2b_records)
+    assert all(v.balanced for v in vendors.values())
+    assert len(balanced_pairs(pr_records, gstr2b_records, vendors)) == len({r.id for r in pr_records if r.key})
+
+    # Same counts and totals, but one invoice number changed: nothing in that period pairs early
+    moved = dict(pr[0], id="g0", invoice_no="ZZZ-" + pr[0]["invoice_no"])
+    gstr2b_records = normalize_invoices([moved] + [dict(inv, id=f"g{i}") for i, inv in enumerate(pr) if i])
+    vendors = aggregate_vendors(pr_records, gstr2b_records)
+    paired = balanced_pairs(pr_records, gstr2b_records, vendors)
+    group = (pr_records[0].gstin, period_of(pr_records[0].date_ordinal))
+    assert vendors[group].balanced
+    assert not any((rec.gstin, period_of(rec.date_ordinal)) == group for rec in pr_records if rec.id in paired)
+    assert paired
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("engine_cls", [ReconciliationEngine, ColumnarReconciliationEngine])
+def test_fast_path_does_not_change_results(seed, engine_cls, monkeypatch):
+    pr, gstr2b = _balanced_registers(seed)
+    context = ReconciliationContext()
+    with_fast_path = engine_cls().reconcile(pr, gstr2b, context)
+    assert any(vendor.balanced for vendor in context.vendors.values())
+
+    def no_pairs(self, pr_records, gstr2b_records, context):
+        context.vendors = aggregate_vendors(pr_records, gstr2b_records)
+        return {}
+
+    monkeypatch.setattr(engine_cls, "balanced_vendor_pairs", no_pairs)
+    assert engine_cls().reconcile(pr, gstr2b) == with_fast_path
@@ -18,6 +18,8 @@ export type MatchStatus =
     | 'amount_mismatch'
     | 'date_mismatch'
     | 'gstin_mismatch'
+    | 'invoice_mismatch'
+    | 'split_match'
     | 'pr_only'
     | 'gstr2b_only'
     | 'duplicate'
@@ -0,0 +1,18 @@
+-- ============================================
+-- Match status: split_match
+-- One invoice matched to several invoices of the same vendor on the other side
+-- ============================================
+
+ALTER TABLE match_results DROP CONSTRAINT IF EXISTS match_results_match_status_check;
+
+ALTER TABLE match_results ADD CONSTRAINT match_results_match_status_check CHECK (match_status IN (
+  'exact_match',      -- Perfect match
+  'amount_mismatch',  -- GSTIN + Invoice match, amounts differ
+  'date_mismatch',    -- GSTIN + Invoice match, dates differ
+  'gstin_mismatch',   -- Invoice matched but GSTIN has issues
+  'invoice_mismatch', -- GSTIN + Amounts + Date match, invoice number differs
+  'split_match',      -- One invoice = several invoices on the other side (summed amounts)
+  'pr_only',          -- Only in Purchase Register
+  'gstr2b_only',      -- Only in GSTR-2B
+  'duplicate'         -- Potential duplicate
+));
@@ -0,0 +1,22 @@
+-- ============================================
+-- SQL pushdown reconciliation
+-- Normalization functions used by the set-based rule SQL (backend/core/sql_pushdown.py);
+-- they must match normalize_gstin / normalize_invoice_no in backend/core/invoice_record.py
+-- ============================================
+
+-- Uppercase, trimmed, without spaces. The trimmed characters are those
+-- Python's str.strip() removes, so this agrees with normalize_gstin
+CREATE OR REPLACE FUNCTION norm_gstin(gstin TEXT) RETURNS TEXT AS $$
+  SELECT upper(replace(btrim(
+    coalesce(gstin, ''),
+    E'\u0009\u000A\u000B\u000C\u000D\u001C\u001D\u001E\u001F\u0020\u0085\u00A0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200A\u2028\u2029\u202F\u205F\u3000'
+  ), ' ', ''))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Uppercase letters and digits only
+CREATE OR REPLACE FUNCTION norm_invoice_no(invoice_no TEXT) RETURNS TEXT AS $$
+  SELECT regexp_replace(upper(coalesce(invoice_no, '')), '[^A-Z0-9]', '', 'g')
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- File order of a run's invoices, used to read back the residue
+CREATE INDEX IF NOT EXISTS idx_invoices_run_row ON invoices(run_id, source, row_number);
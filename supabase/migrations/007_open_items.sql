@@ -0,0 +1,51 @@
+-- ============================================
+-- Open items carry-forward
+-- Invoices left PR_ONLY / GSTR2B_ONLY in a return period, per client,
+-- probed by later periods on (GSTIN + invoice no) and closed when they match
+-- ============================================
+
+CREATE TABLE open_items (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  client_id UUID REFERENCES clients(id) ON DELETE CASCADE,
+  
+  -- Side the invoice is missing a counterpart on
+  source TEXT NOT NULL CHECK (source IN ('purchase_register', 'gstr2b')),
+  
+  -- Normalized GSTIN + '|' + normalized invoice no
+  match_key TEXT NOT NULL,
+  -- Content hash of the row within its side and period (re-runs add nothing)
+  item_hash TEXT NOT NULL,
+  
+  return_period TEXT NOT NULL,
+  vendor_gstin TEXT,
+  invoice_no TEXT,
+  invoice_date DATE,
+  taxable_value DECIMAL(18,2) DEFAULT 0,
+  igst DECIMAL(12,2) DEFAULT 0,
+  cgst DECIMAL(12,2) DEFAULT 0,
+  sgst DECIMAL(12,2) DEFAULT 0,
+  cess DECIMAL(12,2) DEFAULT 0,
+  total_tax DECIMAL(12,2) DEFAULT 0,
+  invoice_id UUID REFERENCES invoices(id) ON DELETE SET NULL,
+  
+  -- Closing
+  status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'closed')),
+  closed_period TEXT,
+  closed_by_invoice_id UUID REFERENCES invoices(id) ON DELETE SET NULL,
+  closed_at TIMESTAMPTZ,
+  
+  created_at TIMESTAMPTZ DEFAULT now(),
+  UNIQUE(client_id, item_hash)
+);
+
+-- Probe: open items of a client by match key
+CREATE INDEX idx_open_items_probe ON open_items(client_id, match_key) WHERE status = 'open';
+CREATE INDEX idx_open_items_period ON open_items(client_id, return_period);
+
+ALTER TABLE open_items ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "View open items for accessible clients" ON open_items
+  FOR SELECT USING (can_access_client(auth.uid(), client_id));
+
+CREATE POLICY "Manage open items for accessible clients" ON open_items
+  FOR ALL USING (can_access_client(auth.uid(), client_id));
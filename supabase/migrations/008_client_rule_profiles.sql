@@ -0,0 +1,11 @@
+-- ============================================
+-- Per-client rule profiles
+-- Tolerances, enabled rules (in priority order), confidence overrides and
+-- fuzzy thresholds of a client; '{}' reconciles with the engine defaults
+-- ============================================
+
+ALTER TABLE clients ADD COLUMN IF NOT EXISTS rule_profile JSONB NOT NULL DEFAULT '{}'::jsonb;
+
+COMMENT ON COLUMN clients.rule_profile IS
+  'Matching rule profile: amount_tolerance (INR), percentage_tolerance (%), percentage_threshold (INR), '
+  'date_tolerance_days, rules, confidence, split_matching, fuzzy';